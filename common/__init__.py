@@ -12,6 +12,9 @@ CONFIG_DEFAULT_MONGODB_DB_NAME = "crunchdb"
 CONFIG_DEFAULT_MONGODB_COLLECTION_NAME = "preferences"
 CONFIG_DEFAULT_STORAGE_DIR = "storage_dir"
 CONFIG_DEFAULT_STORAGE_BATCH_SIZE = 50
+CONFIG_DEFAULT_COMPACTION_INTERVAL = 0
+CONFIG_DEFAULT_COMPACTION_RECORDS = 10000
+CONFIG_DEFAULT_MAX_WAIT_MS = 50
 
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 
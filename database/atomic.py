@@ -0,0 +1,39 @@
+import os
+import threading
+
+
+def atomic_write(file_path: str, data: bytes, sync: bool = True) -> None:
+    """Replaces the content of the file, so the file always contains either the old or the new data.
+
+    The data is written to a temporary file next to the file, which is synchronized to disk, and then
+    it replaces the file with `os.replace()`. At last, the directory is synchronized, so the new file
+    stays in place after a crash. The temporary file is unique for the process and the thread,
+    so the concurrent writers of the same file don't overwrite each other's temporary files,
+    and it's removed when the write fails.
+
+    Args:
+        file_path: Path of the replaced file.
+        data: New content of the file.
+        sync: If False, then nothing is synchronized to disk, for the files which can be lost after a crash
+            (e.g. a cache). The file is still replaced atomically, so it's never read partially written.
+    """
+    temp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    if not sync:
+        return
+    fd = os.open(os.path.dirname(file_path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,485 @@
+"""Compressed bitmaps, in the Roaring bitmap style.
+
+The 32 bit values are split into containers by the high 16 bits,
+each container stores the low 16 bits of the values in one of the forms:
+
+- `ArrayContainer` - a sorted array of values, for sparse containers,
+- `BitmapContainer` - a bitmap of 65536 bits, for dense containers,
+- `RunContainer` - a list of runs of consecutive values.
+
+The form is chosen when a container is created, as the one which takes the least space.
+The intersections and unions work on the compressed forms (e.g. two lists of runs give a list of runs),
+a result with a bitmap is kept as a bitmap, unless an array is smaller.
+"""
+from abc import ABC, abstractmethod
+from enum import IntEnum
+from typing import Dict, Iterable, Iterator, Tuple
+
+import numpy as np
+
+# number of values which can be stored in one container
+CONTAINER_SIZE = 65536
+
+# size in bytes of a bitmap container
+BITMAP_SIZE_IN_BYTES = CONTAINER_SIZE // 8
+
+_POPCOUNT = np.array([bin(n).count("1") for n in range(256)], dtype=np.uint8)
+
+
+class ContainerType(IntEnum):
+    """Type of the container, stored in the data files."""
+
+    ARRAY = 0
+    BITMAP = 1
+    RUN = 2
+
+
+class Container(ABC):
+    """Base class for the containers of 16 bit values.
+
+    Attributes:
+        TYPE: Type of the container.
+        cardinality: Number of values stored in the container.
+    """
+
+    TYPE: ContainerType
+    cardinality: int
+
+    @staticmethod
+    def from_values(values: np.ndarray) -> "Container":
+        """Creates the smallest container for the values.
+
+        Args:
+            values: Sorted array of unique values from the range [0, 65536).
+
+        Returns:
+            One of the containers, the one which takes the least space.
+        """
+        values = np.asarray(values, dtype=np.uint16)
+        runs = RunContainer.runs_from_values(values)
+
+        sizes = {
+            ContainerType.ARRAY: 2 * len(values),
+            ContainerType.BITMAP: BITMAP_SIZE_IN_BYTES,
+            ContainerType.RUN: 4 * len(runs),
+        }
+        best = min(sizes, key=lambda container_type: (sizes[container_type], container_type))
+
+        if best == ContainerType.ARRAY:
+            return ArrayContainer(values)
+        if best == ContainerType.RUN:
+            return RunContainer(runs)
+        return BitmapContainer.from_values(values)
+
+    @staticmethod
+    def from_runs(runs: np.ndarray) -> "Container":
+        """Creates the smallest container for the runs, without expanding them to values when it's not needed.
+
+        Args:
+            runs: Array of pairs (first value, length - 1), sorted by the first value, not overlapping.
+
+        Returns:
+            One of the containers, the one which takes the least space.
+        """
+        container = RunContainer(runs)
+        sizes = {
+            ContainerType.ARRAY: 2 * container.cardinality,
+            ContainerType.BITMAP: BITMAP_SIZE_IN_BYTES,
+            ContainerType.RUN: 4 * len(container.runs()),
+        }
+        best = min(sizes, key=lambda container_type: (sizes[container_type], container_type))
+
+        if best == ContainerType.ARRAY:
+            return ArrayContainer(container.values())
+        if best == ContainerType.BITMAP:
+            return BitmapContainer(container.bitmap())
+        return container
+
+    @staticmethod
+    def from_bytes(container_type: ContainerType, data: bytes) -> "Container":
+        """Creates a container from its serialized form.
+
+        Args:
+            container_type: Type of the container.
+            data: Bytes created with `to_bytes()`.
+
+        Returns:
+            Container of the given type.
+        """
+        if container_type == ContainerType.ARRAY:
+            return ArrayContainer(np.frombuffer(data, dtype=">u2").astype(np.uint16))
+        if container_type == ContainerType.BITMAP:
+            return BitmapContainer(np.frombuffer(data, dtype=np.uint8))
+        if container_type == ContainerType.RUN:
+            return RunContainer(np.frombuffer(data, dtype=">u2").astype(np.uint16).reshape(-1, 2))
+        raise ValueError(f"Unknown container type {container_type}.")
+
+    @abstractmethod
+    def to_bytes(self) -> bytes:
+        """Serializes the container.
+
+        Returns:
+            Bytes representing the container.
+        """
+
+    @abstractmethod
+    def values(self) -> np.ndarray:
+        """Returns all the values stored in the container.
+
+        Returns:
+            Sorted array of the values.
+        """
+
+    @abstractmethod
+    def contains(self, values: np.ndarray) -> np.ndarray:
+        """Checks which of the values are stored in the container.
+
+        Args:
+            values: Array of values to check.
+
+        Returns:
+            Array of booleans, one for each of the values.
+        """
+
+    def bitmap(self) -> np.ndarray:
+        """Returns the container as a bitmap.
+
+        Returns:
+            Array of `BITMAP_SIZE_IN_BYTES` bytes, bit `n` is set if the value `n` is in the container.
+        """
+        bits = np.zeros(CONTAINER_SIZE, dtype=bool)
+        bits[self.values()] = True
+        return np.packbits(bits)
+
+    def runs(self) -> np.ndarray:
+        """Returns the runs of consecutive values stored in the container.
+
+        Returns:
+            Array of pairs (first value, length - 1).
+        """
+        return RunContainer.runs_from_values(self.values())
+
+    def and_cardinality(self, other: "Container") -> int:
+        """Counts the values stored in both containers, without creating their intersection.
+
+        Args:
+            other: The other container.
+
+        Returns:
+            Number of the common values.
+        """
+        if isinstance(self, ArrayContainer):
+            return int(other.contains(self._values).sum())
+        if isinstance(other, ArrayContainer):
+            return int(self.contains(other._values).sum())
+        if isinstance(self, RunContainer) and isinstance(other, RunContainer):
+            return RunContainer(RunContainer.intersect_runs(self._runs, other._runs)).cardinality
+        return int(_POPCOUNT[self.bitmap() & other.bitmap()].sum(dtype=np.int64))
+
+    def __and__(self, other: "Container") -> "Container":
+        if isinstance(self, ArrayContainer):
+            return Container.from_values(self._values[other.contains(self._values)])
+        if isinstance(other, ArrayContainer):
+            return Container.from_values(other._values[self.contains(other._values)])
+        if isinstance(self, RunContainer) and isinstance(other, RunContainer):
+            return Container.from_runs(RunContainer.intersect_runs(self._runs, other._runs))
+        return BitmapContainer(self.bitmap() & other.bitmap()).optimize()
+
+    def __or__(self, other: "Container") -> "Container":
+        if isinstance(self, ArrayContainer) and isinstance(other, ArrayContainer):
+            return Container.from_values(np.union1d(self._values, other._values))
+        if not isinstance(self, BitmapContainer) and not isinstance(other, BitmapContainer):
+            return Container.from_runs(RunContainer.union_runs(self.runs(), other.runs()))
+        return BitmapContainer(self.bitmap() | other.bitmap())
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Container):
+            return NotImplemented
+        return self.cardinality == other.cardinality and np.array_equal(self.values(), other.values())
+
+
+class ArrayContainer(Container):
+    """Container storing a sorted array of values.
+
+    Args:
+        values: Sorted array of unique values.
+    """
+
+    TYPE = ContainerType.ARRAY
+
+    def __init__(self, values: np.ndarray):
+        self._values = np.asarray(values, dtype=np.uint16)
+        self.cardinality = len(self._values)
+
+    def to_bytes(self) -> bytes:
+        return self._values.astype(">u2").tobytes()
+
+    def values(self) -> np.ndarray:
+        return self._values
+
+    def contains(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.int64)
+        if len(self._values) == 0:
+            return np.zeros(values.shape, dtype=bool)
+        # the index of a value greater than all the stored ones points after the end of the array
+        index = np.minimum(np.searchsorted(self._values, values), len(self._values) - 1)
+        return self._values[index] == values
+
+
+class BitmapContainer(Container):
+    """Container storing a bitmap of all the possible values.
+
+    Args:
+        bitmap: Array of `BITMAP_SIZE_IN_BYTES` bytes.
+    """
+
+    TYPE = ContainerType.BITMAP
+
+    def __init__(self, bitmap: np.ndarray):
+        self._bitmap = np.asarray(bitmap, dtype=np.uint8)
+        self.cardinality = int(_POPCOUNT[self._bitmap].sum(dtype=np.int64))
+
+    @staticmethod
+    def from_values(values: np.ndarray) -> "BitmapContainer":
+        """Creates a bitmap container for the values.
+
+        Args:
+            values: Array of values.
+
+        Returns:
+            Bitmap container with the values.
+        """
+        bits = np.zeros(CONTAINER_SIZE, dtype=bool)
+        bits[values] = True
+        return BitmapContainer(np.packbits(bits))
+
+    def optimize(self) -> Container:
+        """Converts the container to an array container, if it's smaller.
+
+        The runs are not searched, so the bitmap is not expanded to the values when it stays a bitmap.
+
+        Returns:
+            Container with the same values.
+        """
+        if 2 * self.cardinality < BITMAP_SIZE_IN_BYTES:
+            return ArrayContainer(self.values())
+        return self
+
+    def to_bytes(self) -> bytes:
+        return self._bitmap.tobytes()
+
+    def values(self) -> np.ndarray:
+        return np.flatnonzero(np.unpackbits(self._bitmap)).astype(np.uint16)
+
+    def contains(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.int64)
+        return (self._bitmap[values >> 3] & (0x80 >> (values & 7))) != 0
+
+    def bitmap(self) -> np.ndarray:
+        return self._bitmap
+
+
+class RunContainer(Container):
+    """Container storing runs of consecutive values.
+
+    Args:
+        runs: Array of pairs (first value, length - 1), sorted by the first value.
+    """
+
+    TYPE = ContainerType.RUN
+
+    def __init__(self, runs: np.ndarray):
+        self._runs = np.asarray(runs, dtype=np.uint16).reshape(-1, 2)
+        self.cardinality = int(self._runs[:, 1].sum(dtype=np.int64)) + len(self._runs)
+
+    @staticmethod
+    def runs_from_values(values: np.ndarray) -> np.ndarray:
+        """Finds the runs of consecutive values.
+
+        Args:
+            values: Sorted array of unique values.
+
+        Returns:
+            Array of pairs (first value, length - 1).
+        """
+        values = np.asarray(values, dtype=np.int64)
+        if len(values) == 0:
+            return np.zeros((0, 2), dtype=np.uint16)
+
+        starts = np.flatnonzero(np.diff(values) != 1) + 1
+        starts = np.concatenate(([0], starts))
+        ends = np.concatenate((starts[1:], [len(values)]))
+        return np.stack((values[starts], ends - starts - 1), axis=1).astype(np.uint16)
+
+    @staticmethod
+    def intersect_runs(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+        """Intersects two lists of runs, without expanding them to values.
+
+        Args:
+            first: Array of pairs (first value, length - 1), sorted by the first value, not overlapping.
+            second: Array of pairs (first value, length - 1), sorted by the first value, not overlapping.
+
+        Returns:
+            Array of pairs (first value, length - 1) of the values stored in both lists.
+        """
+        first_starts, first_ends = RunContainer._bounds(first)
+        second_starts, second_ends = RunContainer._bounds(second)
+
+        # each run of the first list overlaps the runs [low, high) of the second list
+        low = np.searchsorted(second_ends, first_starts, side="left")
+        high = np.searchsorted(second_starts, first_ends, side="right")
+        overlaps = np.maximum(high - low, 0)
+
+        first_index = np.repeat(np.arange(len(first)), overlaps)
+        second_index = np.arange(overlaps.sum()) - np.repeat(np.cumsum(overlaps) - overlaps, overlaps)
+        second_index += np.repeat(low, overlaps)
+
+        starts = np.maximum(first_starts[first_index], second_starts[second_index])
+        ends = np.minimum(first_ends[first_index], second_ends[second_index])
+        return np.stack((starts, ends - starts), axis=1).astype(np.uint16)
+
+    @staticmethod
+    def union_runs(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+        """Joins two lists of runs, without expanding them to values.
+
+        Args:
+            first: Array of pairs (first value, length - 1), sorted by the first value, not overlapping.
+            second: Array of pairs (first value, length - 1), sorted by the first value, not overlapping.
+
+        Returns:
+            Array of pairs (first value, length - 1) of the values stored in any of the lists.
+        """
+        starts, ends = RunContainer._bounds(np.concatenate((first.reshape(-1, 2), second.reshape(-1, 2))))
+        if len(starts) == 0:
+            return np.zeros((0, 2), dtype=np.uint16)
+
+        order = np.argsort(starts, kind="stable")
+        starts, ends = starts[order], ends[order]
+        # a new run starts after a gap behind all the previous runs
+        reached = np.maximum.accumulate(ends)
+        new_runs = np.flatnonzero(np.concatenate(([True], starts[1:] > reached[:-1] + 1)))
+        run_ends = np.maximum.reduceat(ends, new_runs)
+        return np.stack((starts[new_runs], run_ends - starts[new_runs]), axis=1).astype(np.uint16)
+
+    @staticmethod
+    def _bounds(runs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the first and the last values of the runs."""
+        starts = runs[:, 0].astype(np.int64)
+        return starts, starts + runs[:, 1].astype(np.int64)
+
+    def to_bytes(self) -> bytes:
+        return self._runs.astype(">u2").tobytes()
+
+    def runs(self) -> np.ndarray:
+        return self._runs
+
+    def bitmap(self) -> np.ndarray:
+        starts, ends = self._bounds(self._runs)
+        # +1 at the start of each run and -1 after its end, so the running sum is 1 inside the runs
+        changes = np.zeros(CONTAINER_SIZE + 1, dtype=np.int32)
+        changes[starts] += 1
+        changes[ends + 1] -= 1
+        return np.packbits(np.cumsum(changes[:CONTAINER_SIZE]) > 0)
+
+    def values(self) -> np.ndarray:
+        starts = self._runs[:, 0].astype(np.int64)
+        lengths = self._runs[:, 1].astype(np.int64) + 1
+        # for each value: its run start plus its position in the run
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return (np.repeat(starts, lengths) + offsets).astype(np.uint16)
+
+    def contains(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.int64)
+        index = np.searchsorted(self._runs[:, 0], values, side="right") - 1
+        starts = self._runs[:, 0].astype(np.int64)[index]
+        ends = starts + self._runs[:, 1].astype(np.int64)[index]
+        return (index >= 0) & (values >= starts) & (values <= ends)
+
+
+class RoaringBitmap:
+    """Compressed bitmap of 32 bit values.
+
+    Args:
+        values: Values to store in the bitmap.
+    """
+
+    def __init__(self, values: Iterable[int] = ()):
+        self._containers: Dict[int, Container] = dict()
+        self.add_many(values)
+
+    @staticmethod
+    def from_containers(containers: Dict[int, Container]) -> "RoaringBitmap":
+        """Creates the bitmap from the containers, without decoding them.
+
+        Args:
+            containers: Dictionary [high 16 bits->Container].
+
+        Returns:
+            Bitmap made of the containers.
+        """
+        bitmap = RoaringBitmap()
+        bitmap._containers = {key: container for key, container in containers.items() if container.cardinality}
+        return bitmap
+
+    def containers(self) -> Iterator[Tuple[int, Container]]:
+        """Yields the containers sorted by the key.
+
+        Yields:
+            Tuples with the high 16 bits of the values and the container.
+        """
+        for key in sorted(self._containers):
+            yield key, self._containers[key]
+
+    def add_many(self, values: Iterable[int]) -> None:
+        """Adds the values to the bitmap.
+
+        Args:
+            values: Values from the range [0, 2**32).
+        """
+        if isinstance(values, np.ndarray):
+            values = np.unique(values.astype(np.int64))
+        else:
+            values = np.unique(np.fromiter(values, dtype=np.int64))
+        if len(values) == 0:
+            return
+
+        keys = values >> 16
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        for group in np.split(values, bounds):
+            key = int(group[0] >> 16)
+            container = Container.from_values(group & 0xFFFF)
+            if key in self._containers:
+                container = self._containers[key] | container
+            self._containers[key] = container
+
+    def to_array(self) -> np.ndarray:
+        """Returns all the values stored in the bitmap.
+
+        Returns:
+            Sorted array of the values.
+        """
+        parts = [(key << 16) + container.values().astype(np.int64) for key, container in self.containers()]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return sum(container.cardinality for container in self._containers.values())
+
+    def __contains__(self, value: int) -> bool:
+        container = self._containers.get(value >> 16)
+        return container is not None and bool(container.contains(np.array([value & 0xFFFF]))[0])
+
+    def __and__(self, other: "RoaringBitmap") -> "RoaringBitmap":
+        return RoaringBitmap.from_containers(
+            {key: self._containers[key] & other._containers[key] for key in self._containers.keys() & other._containers}
+        )
+
+    def __or__(self, other: "RoaringBitmap") -> "RoaringBitmap":
+        containers = dict(self._containers)
+        for key, container in other._containers.items():
+            containers[key] = containers[key] | container if key in containers else container
+        return RoaringBitmap.from_containers(containers)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, RoaringBitmap):
+            return NotImplemented
+        return dict(self.containers()) == dict(other.containers())
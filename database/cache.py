@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from .atomic import atomic_write
+
+log = logging.getLogger(__name__)
+
+
+class QueryCache:
+    """Cache of the query results.
+
+    Each entry is stored with the version of the data it was computed for. An entry is returned only
+    if the version is still the current one, so there is no need to remove the entries after a write,
+    the outdated ones are just replaced with the next results for the same key.
+
+    The entries can be also stored in a json file, so the processes using the same file share the results.
+    The file is a cache only, so it's not synchronized to disk, and the concurrent writers can lose
+    each other's entries. When the file was changed by another process, it's read again on the next miss.
+
+    The file is written in the background, at most once per `store_interval` seconds, with all the entries
+    put in the meantime, so the queries don't wait for it. A file which can't be written (e.g. in a read only
+    directory) is only logged, the entries are still cached in memory.
+
+    Args:
+        file_path: Path of the file with the shared entries, if None, then the entries are kept only in memory.
+        max_entries: Maximal number of the entries, the oldest ones are removed first.
+        store_interval: Number of seconds between putting an entry and writing the file.
+
+    Attributes:
+        file_path: Path of the file with the shared entries.
+        max_entries: Maximal number of the entries.
+        store_interval: Number of seconds between putting an entry and writing the file.
+    """
+
+    def __init__(self, file_path: Optional[str] = None, max_entries: int = 1024, store_interval: float = 1.0):
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.store_interval = store_interval
+        self._entries: Dict[str, Tuple[Any, Any]] = dict()
+        self._file_version = None
+        self._lock = threading.Lock()
+        self._store_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._store_failed = False
+
+    def get(self, key: str, version: Any) -> Optional[Any]:
+        """Returns the value stored for the key and the version.
+
+        Args:
+            key: Key of the entry.
+            version: Current version of the data, it has to be json serializable.
+
+        Returns:
+            The stored value, None if there is no entry, or it was computed for another version.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is None or entry[0] != version) and self._file_changed():
+                self._load()
+                entry = self._entries.get(key)
+
+        if entry is None or entry[0] != version:
+            return None
+        return entry[1]
+
+    def put(self, key: str, version: Any, value: Any) -> None:
+        """Stores the value computed for the version of the data.
+
+        Args:
+            key: Key of the entry.
+            version: Version of the data the value was computed for, it has to be json serializable.
+            value: Value to store, it has to be json serializable.
+        """
+        with self._lock:
+            if self._file_changed():
+                self._load()
+
+            # the json file converts the tuples into lists, so the versions are compared in the same form
+            self._entries.pop(key, None)
+            self._entries[key] = (json.loads(json.dumps(version)), value)
+            while len(self._entries) > self.max_entries:
+                del self._entries[next(iter(self._entries))]
+
+            if self.file_path is not None and self._timer is None:
+                # the entries put until the timer fires are written together
+                self._timer = threading.Timer(self.store_interval, self.flush)
+                self._timer.start()
+
+    def clear(self) -> None:
+        """Removes all the entries, also from the file."""
+        with self._lock:
+            self._entries = dict()
+            self._cancel_timer()
+        self._store()
+
+    def flush(self) -> None:
+        """Writes the entries which were put since the last write to the file, without waiting for the timer."""
+        with self._lock:
+            if self._timer is None:
+                return
+            self._cancel_timer()
+        self._store()
+
+    def _cancel_timer(self) -> None:
+        """Cancels the scheduled write of the file, it has to be called in the lock."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _get_file_version(self) -> Optional[Tuple[int, int]]:
+        """Returns the inode and the modification time of the cache file, None for a missing file."""
+        if self.file_path is None or not os.path.exists(self.file_path):
+            return None
+        stat = os.stat(self.file_path)
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _file_changed(self) -> bool:
+        """Checks if the cache file was changed since it was read or written by this object."""
+        return self.file_path is not None and self._get_file_version() != self._file_version
+
+    def _load(self) -> None:
+        """Reads the entries from the cache file, they replace the entries for the same keys."""
+        self._file_version = self._get_file_version()
+        if self._file_version is None:
+            return
+
+        try:
+            with open(self.file_path) as f:
+                entries = json.load(f)
+        except ValueError:
+            log.warning(f"Ignoring the broken cache file {self.file_path}.")
+            return
+
+        for key, (version, value) in entries.items():
+            self._entries.pop(key, None)
+            self._entries[key] = (version, value)
+
+    def _store(self) -> None:
+        """Writes all the entries to the cache file.
+
+        The file is replaced with `atomic_write()`, but it's not synchronized to disk. The entries are
+        serialized and written out of the lock, so `get()` and `put()` don't wait for the write.
+        """
+        if self.file_path is None:
+            return
+
+        with self._store_lock:
+            with self._lock:
+                entries = {key: [version, value] for key, (version, value) in self._entries.items()}
+            try:
+                atomic_write(self.file_path, json.dumps(entries).encode(), sync=False)
+            except OSError as e:
+                # the next failures are most likely the same, so only the first one is a warning
+                if self._store_failed:
+                    log.debug(f"Can't write the cache file {self.file_path}: {e}")
+                else:
+                    log.warning(f"Can't write the cache file {self.file_path}: {e}")
+                self._store_failed = True
+                return
+            with self._lock:
+                self._file_version = self._get_file_version()
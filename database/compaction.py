@@ -0,0 +1,58 @@
+import logging
+import threading
+from typing import Dict, Optional
+
+from .db import Database, Layout
+
+log = logging.getLogger(__name__)
+
+
+class Compactor(threading.Thread):
+    """Background thread compacting the collections of the database.
+
+    Every `interval` seconds, each collection with at least `min_records` records appended since
+    the last compaction is compacted with `Database.compact()`.
+
+    Args:
+        database: Database to compact.
+        interval: Number of seconds between the compaction runs.
+        min_records: Minimal number of the appended records to compact a collection.
+        layouts: Dictionary [collection_name->Layout] of the compacted files, the default one is `Layout.BLOCKS`.
+
+    Attributes:
+        database: Database to compact.
+        interval: Number of seconds between the compaction runs.
+        min_records: Minimal number of the appended records to compact a collection.
+        layouts: Dictionary [collection_name->Layout] of the compacted files.
+    """
+
+    def __init__(
+        self, database: Database, interval: float, min_records: int, layouts: Optional[Dict[str, Layout]] = None
+    ):
+        super().__init__(name="compactor", daemon=True)
+        self.database = database
+        self.interval = interval
+        self.min_records = min_records
+        self.layouts = layouts or dict()
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.compact()
+
+    def compact(self) -> None:
+        """Compacts all the collections with enough appended records."""
+        for name in self.database.collection_names():
+            if self.database.tail_records(name) < self.min_records:
+                continue
+            try:
+                self.database.compact(name, self.layouts.get(name, Layout.BLOCKS))
+            except Exception:
+                # the data is still readable from the old files, so the next run can try again
+                log.exception(f"Compaction of {name} failed.")
+
+    def stop(self) -> None:
+        """Stops the thread and waits until the current compaction is finished."""
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import marshal
+import os
+import struct
+import sys
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict, List, Optional, Tuple
+
+from .atomic import atomic_write
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class CompiledConfig:
+    """Structures built from the config file, which are used by the database.
+
+    The routing table is used only for storing the answers, so it's decoded on the first use,
+    and opening the database for the queries doesn't pay for it.
+
+    Attributes:
+        choices: Dictionary [choice_name->values].
+        collections: Dictionary [collection_name->(multiple_answers, choices_name, layout)].
+        routes_data: Serialized routing table, see `routes`.
+    """
+
+    choices: Dict[str, List[str]]
+    collections: Dict[str, Tuple[bool, str, str]]
+    routes_data: bytes
+
+    @cached_property
+    def routes(self) -> Dict[str, Tuple[str, int]]:
+        """Dictionary [answer key->(collection_name, choice index)] for the multiple answers collections."""
+        return marshal.loads(self.routes_data)
+
+    @classmethod
+    def build(
+        cls,
+        choices: Dict[str, List[str]],
+        collections: Dict[str, Tuple[bool, str, str]],
+        routes: Dict[str, Tuple[str, int]],
+    ) -> "CompiledConfig":
+        """Creates the compiled config, with all the strings interned.
+
+        The interned strings are stored only once in the compiled file, and they stay interned when it's loaded,
+        so e.g. the collection names are shared by the collections and the routing table.
+
+        Args:
+            choices: Dictionary [choice_name->values].
+            collections: Dictionary [collection_name->(multiple_answers, choices_name, layout)].
+            routes: Dictionary [answer key->(collection_name, choice index)].
+
+        Returns:
+            The compiled config.
+        """
+        choices = {sys.intern(name): [sys.intern(value) for value in values] for name, values in choices.items()}
+        collections = {
+            sys.intern(name): (multiple_answers, sys.intern(choices_name), sys.intern(layout))
+            for name, (multiple_answers, choices_name, layout) in collections.items()
+        }
+        routes = {sys.intern(key): (sys.intern(name), index) for key, (name, index) in routes.items()}
+        return cls(choices=choices, collections=collections, routes_data=marshal.dumps(routes))
+
+
+class CompiledConfigFile:
+    """Class for reading and writing the config file compiled into the structures used by the database.
+
+    Parsing and validating the json config file, and building the routing table is repeated by each process
+    opening the database. So the structures are stored in this file (serialized with `marshal`),
+    and they're loaded with one read:
+
+        ---------------------------------------------------------------------------------------
+        |          8B            |                   varies                      |   varies   |
+        | size of the next field | (header, choices, collections) with marshal   | routes_data|
+        ---------------------------------------------------------------------------------------
+
+    The header is the format version, the Python version (the `marshal` format depends on it),
+    and the digest of the config file it was compiled from. So the file is used only for the same config file,
+    and it's compiled again when the config file is changed.
+
+    Args:
+        file_path: Path of the compiled file.
+
+    Attributes:
+        FORMAT_VERSION: Version of the format of the compiled file.
+        file_path: Path of the compiled file.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    def _header(self, config_data: bytes) -> tuple:
+        """Returns the header of the file compiled from the config file."""
+        digest = hashlib.blake2b(config_data, digest_size=16).digest()
+        return self.FORMAT_VERSION, tuple(sys.version_info[:2]), digest
+
+    def read(self, config_data: bytes) -> Optional[CompiledConfig]:
+        """Reads the compiled config.
+
+        Args:
+            config_data: Content of the config file.
+
+        Returns:
+            The compiled config, None for a missing or broken file, or a file compiled from another config file.
+        """
+        if not os.path.exists(self.file_path):
+            return None
+
+        with open(self.file_path, "rb") as f:
+            data = f.read()
+        try:
+            (size,) = struct.unpack_from("<Q", data)
+            end = 8 + size
+            header, choices, collections = marshal.loads(data[8:end])
+        except (EOFError, ValueError, TypeError, struct.error):
+            log.warning(f"Ignoring the broken compiled config file {self.file_path}.")
+            return None
+
+        if header != self._header(config_data):
+            return None
+        return CompiledConfig(choices=choices, collections=collections, routes_data=data[end:])
+
+    def write(self, config_data: bytes, config: CompiledConfig) -> None:
+        """Writes the compiled config.
+
+        The file is replaced with `atomic_write()`.
+
+        Args:
+            config_data: Content of the config file the config was compiled from.
+            config: The compiled config.
+        """
+        data = marshal.dumps((self._header(config_data), config.choices, config.collections))
+        atomic_write(self.file_path, struct.pack("<Q", len(data)) + data + config.routes_data)
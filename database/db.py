@@ -1,11 +1,45 @@
 import json
 import logging
 import os.path
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
 from enum import Enum
-from typing import List, Any
+from itertools import islice
+from statistics import NormalDist
+from typing import Dict, Generator, List, Any, Optional, Tuple, Union
 import time
-from .file_format import IdsDataFile, MultiValueDataFile, SingleValue, SingleValueDataFile, MultiValue
+
+import numpy as np
+
+from .atomic import atomic_write
+from .cache import QueryCache
+from .compiled_config import CompiledConfig, CompiledConfigFile
+from .lock import WriterLock
+from .pk_index import OffsetIndex, PkIndex
+from .wal import Operation, WalRecord, WriteAheadLog
+from .file_format import (
+    Cooccurrence,
+    CooccurrenceDataFile,
+    Counters,
+    CountersDataFile,
+    DataFile,
+    IdsDataFile,
+    OffsetIndexDataFile,
+    PkIndexDataFile,
+    MultiValueDataFile,
+    MultiValueBlocksDataFile,
+    MultiValueColumnsDataFile,
+    MultiValueRoaringDataFile,
+    SingleValue,
+    SingleValueBlocksDataFile,
+    SingleValueDataFile,
+    SingleValuePackedDataFile,
+    MultiValue,
+    SampleDataFile,
+    TombstonesDataFile,
+    VersionDataFile,
+)
 
 log = logging.getLogger(__name__)
 
@@ -20,16 +54,56 @@ class FileType(Enum):
     """
 
     SINGLE_VALUE = "single.data"
+    SINGLE_VALUE_BLOCKS = "single.blocks"
+    SINGLE_VALUE_PACKED = "single.packed"
     MULTI_VALUE = "multi.data"
+    MULTI_VALUE_BLOCKS = "multi.blocks"
+    MULTI_VALUE_COLUMNS = "multi.columns"
+    MULTI_VALUE_ROARING = "multi.roaring"
     IDS = "ids"
+    COUNTS = "counts"
+    PK_INDEX = "pks"
+    OFFSETS = "offsets"
+    VERSION = "version"
+    SAMPLE = "sample"
+    TOMBSTONES = "tombstones"
+    COOCCURRENCE = "cooc"
+
+
+class Layout(Enum):
+    """Layout of the collection data file.
+
+    ROWS: each record is stored as one row (`SingleValueDataFile`, `MultiValueDataFile`).
+    COLUMNS: the records are stored in per choice bitmaps (`MultiValueColumnsDataFile`),
+             available only for the collections with multiple answers.
+    ROARING: the records are stored in per choice compressed bitmaps (`MultiValueRoaringDataFile`),
+             available only for the collections with multiple answers.
+    BLOCKS: the records are stored as rows in blocks with precomputed counts
+            (`SingleValueBlocksDataFile`, `MultiValueBlocksDataFile`).
+    PACKED: the values are stored with the narrowest width, and the pks are delta encoded
+            (`SingleValuePackedDataFile`), available only for the collections with single answers.
+    """
+
+    ROWS = "rows"
+    COLUMNS = "columns"
+    ROARING = "roaring"
+    BLOCKS = "blocks"
+    PACKED = "packed"
 
 
 @dataclass
 class AggregatedAnswer:
-    """Class for storing the aggregated answer like counting number of occurrences."""
+    """Class for storing the aggregated answer like counting number of occurrences.
+
+    Attributes:
+        value: the counted value
+        count: number of occurrences, for an approximate answer it's the estimate
+        interval: for an approximate answer, the confidence interval (inclusive) of the number of occurrences
+    """
 
     value: str
     count: int
+    interval: Optional[Tuple[int, int]] = None
 
 
 @dataclass
@@ -39,12 +113,78 @@ class SearchAnswer:
     Attributes:
         results: data with the answer
         time: search time in seconds
-        data_size: number of searched records
+        data_size: number of searched records, for an approximate answer it's the estimate
+        approximate: if True, then the answer was estimated from a sample of the records
     """
 
     results: List[Any]
     time: float
     data_size: int
+    approximate: bool = False
+
+
+@dataclass
+class CooccurrenceAnswer:
+    """Class for the co-occurrence counts of the choices of two collections.
+
+    Attributes:
+        choices_a: Choices of the first collection, the rows of the counts.
+        choices_b: Choices of the second collection, the columns of the counts.
+        counts: 2-D array, the number of people who answered "yes" for both `choices_a[i]` and `choices_b[j]`.
+        time: search time in seconds
+        data_size: number of people with the answers stored in both collections
+    """
+
+    choices_a: List[str]
+    choices_b: List[str]
+    counts: np.ndarray
+    time: float
+    data_size: int
+
+
+@dataclass
+class Filter:
+    """Condition on the answers of a collection, used for counting only the answers of the selected people.
+
+    Examples:
+        `Filter("owned_cars", "bmw")` selects the people who own a BMW,
+        `Filter("favourite_singer", "abba")` selects the people whose favourite singer is ABBA,
+        `Filter("known_singers", "abba", yes=False)` selects the people who answered that they don't know ABBA.
+
+    Attributes:
+        collection_name: Name of the collection with the condition.
+        choice: The chosen value.
+        yes: If False, then the answers "no" are selected, only for the collections with multiple answers.
+    """
+
+    collection_name: str
+    choice: str
+    yes: bool = True
+
+
+@dataclass
+class CountQuery:
+    """Arguments of one `Database.count()` call, used for running many counts at once with `Database.count_many()`.
+
+    Attributes:
+        collection_name: Name of the collection to count the data for.
+        limit: Number of values to return.
+        sorting: Sorting direction of the results.
+        pk_range: If set, only the answers with pk in the range (inclusive) are counted.
+        filters: If set, only the answers of the people matching all the filters are counted.
+        approx: If True, then the answer can be estimated from the sample of the records.
+        max_error: Maximal half-width of the confidence intervals of the estimate, as a fraction of all the records.
+        confidence: Confidence level of the intervals of the estimate.
+    """
+
+    collection_name: str
+    limit: int = 10
+    sorting: Sorting = Sorting.DESC
+    pk_range: Optional[Tuple[int, int]] = None
+    filters: List[Filter] = field(default_factory=list)
+    approx: bool = False
+    max_error: float = 0.01
+    confidence: float = 0.95
 
 
 @dataclass
@@ -54,6 +194,34 @@ class Collection:
     name: str
     multiple_answers: bool
     choices_name: str
+    layout: Layout = Layout.ROWS
+
+
+@dataclass
+class Segments:
+    """Generations of the files of a collection.
+
+    The answers are appended to the tail files. The compaction merges the base files and the tail files
+    into new base files sorted by pk, and starts new tail files.
+
+    Attributes:
+        tail: Generation of the tail files, the files of the generation 0 have no generation in the name.
+        base: Generation of the compacted files, None if the collection wasn't compacted yet.
+        base_layout: Layout of the compacted files.
+        base_records: Number of records in the compacted files.
+        obsolete: Generations replaced by the last compaction, their files are removed by the next one,
+                  so the readers which still use them can finish.
+        base_size: Number of choices the compacted files were written with, None for the current number.
+        tail_size: Number of choices the tail files were written with, None for the current number.
+    """
+
+    tail: int = 0
+    base: Optional[int] = None
+    base_layout: Optional[Layout] = None
+    base_records: int = 0
+    obsolete: List[int] = field(default_factory=list)
+    base_size: Optional[int] = None
+    tail_size: Optional[int] = None
 
 
 @dataclass
@@ -71,79 +239,469 @@ class DatabaseConfigException(Exception):
     pass
 
 
+class DatabaseReadOnlyException(Exception):
+    """Exception used by the Database class opened in the read only mode, when there is a write."""
+
+    pass
+
+
 class Database:
     """Main database API.
 
+    Nothing is read from the collection files when the database is opened, the state of a collection
+    (like the index of the stored pks) is loaded when the collection is used for the first time.
+    So opening the database takes the same time regardless of the amount of the stored data.
+
+    In the read only mode, a batch left in the write-ahead log is not applied, as it can be written
+    by another process at the same time, and all the writes raise `DatabaseReadOnlyException`.
+
+    The query results are cached together with the version of the collection data, which is increased
+    with each write, so the repeated queries between the writes don't read the data files.
+
     Args:
         directory: data storage directory
+        read_only: if True, then the database is opened only for the queries
+        shared_cache: if True, then the cached query results are also stored in the cache file,
+                      so they are shared by all the processes using the database directory
 
     Attributes:
         CONFIG_FILE_NAME: name of the configuration file
+        WAL_FILE_NAME: name of the write-ahead log file
+        MANIFEST_FILE_NAME: name of the file with the generations of the collection files
+        CACHE_FILE_NAME: name of the file with the shared query results
+        LOCK_FILE_NAME: name of the file locked by the writing process
+        CATALOG_FILE_NAME: name of the file with the choices the collection files were converted to
+        COMPILED_CONFIG_FILE_NAME: name of the file with the config file compiled into the used dictionaries
+        SAMPLE_SIZE: maximum number of the records in the sample of a collection, used for the approximate counts
         _CONFIG_FILE_PATH: path of the configuration file
-        _ids: dictionary [collection_name->List[ids]]
+        _CATALOG_FILE_PATH: path of the catalog file
+        _pk_indexes: dictionary [collection_name->(tail generation, PkIndex)], loaded on the first use
+        _offset_indexes: dictionary [collection_name->(tail generation, OffsetIndex)], loaded on the first lookup
         _choices: dictionary [choice_name->List[Choice]]
         _collections: dictionary [collection_name->List[Collection]]
+        _segments: dictionary [collection_name->Segments]
+        _config: config file compiled into the choices, the collections and the routing table (`CompiledConfig`)
+        _wal: write-ahead log for the stored answers
+        _cache: cache of the query results
+        _lock: lock for the writes and the compaction, shared with the other processes using the directory
+        _read_only: if True, then the database is opened only for the queries
     """
 
     CONFIG_FILE_NAME = "config.json"
-
-    def __init__(self, directory: str):
+    WAL_FILE_NAME = "wal.log"
+    MANIFEST_FILE_NAME = "manifest.json"
+    CACHE_FILE_NAME = "query_cache.json"
+    LOCK_FILE_NAME = "write.lock"
+    CATALOG_FILE_NAME = "catalog.json"
+    COMPILED_CONFIG_FILE_NAME = "config.compiled"
+    SAMPLE_SIZE = 16384
+
+    def __init__(self, directory: str, read_only: bool = False, shared_cache: bool = False):
         self._directory = directory
+        self._read_only = read_only
         self._CONFIG_FILE_PATH = os.path.join(directory, self.CONFIG_FILE_NAME)
+        self._MANIFEST_FILE_PATH = os.path.join(directory, self.MANIFEST_FILE_NAME)
+        self._CATALOG_FILE_PATH = os.path.join(directory, self.CATALOG_FILE_NAME)
 
-        self._ids = dict()
+        self._pk_indexes: Dict[str, Tuple[int, PkIndex]] = dict()
+        self._offset_indexes: Dict[str, Tuple[int, OffsetIndex]] = dict()
         self._choices = dict()
         self._collections = dict()
+        self._segments: Dict[str, Segments] = dict()
+        self._config: Optional[CompiledConfig] = None
+        self._manifest_version = None
+        self._config_version = None
+        self._wal = WriteAheadLog(os.path.join(directory, self.WAL_FILE_NAME))
+        self._cache = QueryCache(os.path.join(directory, self.CACHE_FILE_NAME) if shared_cache else None)
+        self._lock = WriterLock(None if read_only else os.path.join(directory, self.LOCK_FILE_NAME))
 
         self._read_config()
-        self._read_ids_files(self._collections.values())
+        self._read_manifest()
+        if read_only:
+            self._read_catalog()
+        else:
+            with self._lock:
+                self._catch_up()
 
-    def _get_file_name(self, collection: Collection, file_type: FileType) -> str:
+    def _check_writable(self) -> None:
+        """Checks if the database can be changed.
+
+        Raises:
+            DatabaseReadOnlyException: if the database was opened in the read only mode.
+        """
+        if self._read_only:
+            raise DatabaseReadOnlyException("The database is opened in the read only mode.")
+
+    def _get_file_name(self, collection: Collection, file_type: FileType, generation: int = 0) -> str:
         """Creates a file name base one the collection and the file type.
 
         Examples:
             For a Collection with name `XXX` and file type `FileType.MULTI_VALUE`
-            it will return: `XXX.multi.data`
+            it will return: `XXX.multi.data`, and for the generation 3: `XXX.3.multi.data`
 
         Args:
             collection: Collection to create the file name for.
             file_type: Type of the file to create the name for.
+            generation: Generation of the collection files.
 
         Returns:
             New file name for the collection and type.
         """
-        return os.path.join(self._directory, f"{collection.name}.{file_type.value}")
+        if generation == 0:
+            return os.path.join(self._directory, f"{collection.name}.{file_type.value}")
+        return os.path.join(self._directory, f"{collection.name}.{generation}.{file_type.value}")
+
+    def _read_ids(self, collection: Collection, start: int = 0) -> np.ndarray:
+        """Reads the ids files of the collection.
+
+        Args:
+            collection: Collection to read the ids files for.
+            start: If set, only the ids from this position are read, the files before it are skipped.
+
+        Returns:
+            Array of all the stored ids, the ids of the compacted files are followed by the ids of the tail files.
+        """
+        views = [np.zeros(0, dtype=np.int64)]
+        for ids_file, _ in self._get_segment_files(collection):
+            view = ids_file.view()
+            if start < len(view):
+                views.append(view[start:])
+            start = max(0, start - len(view))
+        return np.concatenate(views).astype(np.int64)
+
+    def _get_pk_index(self, collection: Collection) -> PkIndex:
+        """Returns the index of the pks stored in the collection, it's loaded on the first use.
+
+        The pks stored in the pk index file are memory-mapped, only the ids stored after the index file
+        was written are read from the ids files. Without a valid index file, all the ids files are read.
+        The index is brought up to date with the ids appended by the other writing processes.
+
+        Args:
+            collection: Collection to get the index for.
+
+        Returns:
+            Index of the stored pks.
+        """
+        generation = self._segments[collection.name].tail
+        records_count = self._records_count(collection)
+
+        cached = self._pk_indexes.get(collection.name)
+        index = cached[1] if cached is not None and cached[0] == generation else None
+        if index is not None and index.indexed <= records_count:
+            if index.indexed < records_count:
+                index.add_many(self._read_ids(collection, index.indexed).tolist())
+            return index
+
+        pks = self._get_pk_index_file(collection).read_pks(generation)
+        ids = self._read_ids(collection)
+        if pks is None or len(pks) > len(ids):
+            index = PkIndex(np.unique(ids).astype(np.uint32), indexed=len(ids))
+            index.merged = True
+        else:
+            start = len(pks)
+            index = PkIndex(pks, ids[start:].tolist(), indexed=len(ids))
+
+        self._pk_indexes[collection.name] = (generation, index)
+        return index
+
+    def _get_pk_index_file(self, collection: Collection) -> PkIndexDataFile:
+        """Creates the pk index file object for the collection.
+
+        Args:
+            collection: Collection to create the file for.
+
+        Returns:
+            Pk index file object.
+        """
+        return PkIndexDataFile(self._get_file_name(collection, FileType.PK_INDEX))
+
+    def _get_offset_index(self, collection: Collection) -> OffsetIndex:
+        """Returns the index of the positions of the records in the collection, by their pks.
+
+        The index is loaded on the first use from the offsets file, only the ids stored after the file was written
+        are read from the ids files. Without a valid offsets file, all the ids files are read.
+        The index is brought up to date with the records appended since the last lookup, also by another process.
+        When the index is merged, it's stored in the offsets file (not in the read only mode).
+
+        Args:
+            collection: Collection to get the index for.
+
+        Returns:
+            Index of the positions of the records.
+        """
+        generation = self._segments[collection.name].tail
+        records_count = self._records_count(collection)
+
+        cached = self._offset_indexes.get(collection.name)
+        index = cached[1] if cached is not None and cached[0] == generation else None
+        if index is None or index.indexed > records_count:
+            offsets_file = self._get_offset_index_file(collection)
+            stored = offsets_file.read_positions(generation)
+            if stored is None or stored[0] > records_count:
+                stored = 0, np.zeros(0, dtype=offsets_file.dtype)
+            index = OffsetIndex(stored[1], stored[0])
+
+        if index.indexed < records_count:
+            index.add_many(self._read_ids(collection, index.indexed).tolist())
+
+        if index.merged and not self._read_only:
+            with self._lock:
+                # the files could have been compacted in the meantime
+                if generation == self._segments[collection.name].tail:
+                    offsets_file = self._get_offset_index_file(collection)
+                    offsets_file.write_positions(generation, index.indexed, index.sorted_records())
+            index.merged = False
+
+        self._offset_indexes[collection.name] = (generation, index)
+        return index
+
+    def _get_offset_index_file(self, collection: Collection) -> OffsetIndexDataFile:
+        """Creates the offsets file object for the collection.
+
+        Args:
+            collection: Collection to create the file for.
+
+        Returns:
+            Offsets file object.
+        """
+        return OffsetIndexDataFile(self._get_file_name(collection, FileType.OFFSETS))
+
+    def _records_count(self, collection: Collection) -> int:
+        """Returns the number of records stored in the collection.
+
+        Args:
+            collection: Collection to count the records for.
+
+        Returns:
+            Number of records in the compacted files and the tail files, including the removed ones.
+        """
+        return self._segments[collection.name].base_records + self.tail_records(collection.name)
+
+    def _live_records_count(self, collection: Collection) -> int:
+        """Returns the number of records stored in the collection, which were not removed.
+
+        Args:
+            collection: Collection to count the records for.
+
+        Returns:
+            Number of records in the compacted files and the tail files, without the removed ones.
+        """
+        return self._records_count(collection) - self._get_tombstones_file(collection).records_count()
+
+    def _get_tombstones_file(self, collection: Collection, generation: Optional[int] = None) -> TombstonesDataFile:
+        """Creates the tombstones file object for the collection.
 
-    def _read_ids_files(self, collections: List[Collection]) -> None:
-        """Reads the ids files for the collections and stores them in self._ids.
+        The removed records are stored for the generation of the tail files, as their positions change
+        with the compaction.
 
         Args:
-            collections: List of collections to read the ids files for.
+            collection: Collection to create the file for.
+            generation: Generation of the tail files, the current one by default.
+
+        Returns:
+            Tombstones file object, with the records in the rows layout.
+        """
+        if generation is None:
+            generation = self._segments[collection.name].tail
+        file_path = self._get_file_name(collection, FileType.TOMBSTONES, generation)
+        if collection.multiple_answers:
+            records_file = MultiValueDataFile(file_path, self._get_size(collection, generation))
+        else:
+            records_file = SingleValueDataFile(file_path)
+        return TombstonesDataFile(file_path, records_file)
+
+    def _read_manifest(self) -> None:
+        """Reads the generations of the collection files from the manifest file.
+
+        The collections missing in the manifest (or all of them, if there is no manifest file)
+        were not compacted, and have only the tail files of the generation 0.
+        """
+        segments = {name: Segments() for name in self._collections}
+        if not os.path.exists(self._MANIFEST_FILE_PATH):
+            self._segments = segments
+            return
+
+        self._manifest_version = self._get_manifest_version()
+        with open(self._MANIFEST_FILE_PATH) as f:
+            manifest = json.load(f)
+
+        for name, value in manifest.items():
+            if name not in self._collections:
+                continue
+            base_layout = value.get("base_layout")
+            segments[name] = Segments(
+                tail=value["tail"],
+                base=value.get("base"),
+                base_layout=Layout(base_layout) if base_layout else None,
+                base_records=value.get("base_records", 0),
+                obsolete=value.get("obsolete", []),
+                base_size=value.get("base_size"),
+                tail_size=value.get("tail_size"),
+            )
+
+        # the whole dictionary is replaced at once, so the concurrent readers see either the old or the new one
+        self._segments = segments
+
+    def _refresh_manifest(self) -> None:
+        """Reads the manifest file again, if it was changed by another process.
+
+        The config file is also read again when it was changed, as new choices could have been appended.
+        """
+        if self._get_config_version() != self._config_version:
+            self._read_config()
+            self._read_manifest()
+            return
+        if not os.path.exists(self._MANIFEST_FILE_PATH):
+            return
+        if self._get_manifest_version() != self._manifest_version:
+            self._read_manifest()
+
+    def _get_manifest_version(self) -> Tuple[int, int]:
+        """Returns the inode and the modification time of the manifest file.
+
+        The manifest is always replaced with a new file, so the inode changes with each write.
+        """
+        stat = os.stat(self._MANIFEST_FILE_PATH)
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _get_config_version(self) -> Optional[Tuple[int, int, int]]:
+        """Returns the inode, the modification time and the size of the config file, None for a missing file."""
+        try:
+            stat = os.stat(self._CONFIG_FILE_PATH)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _write_manifest(self) -> None:
+        """Writes the generations of the collection files to the manifest file.
+
+        The file is replaced with `atomic_write()`.
         """
-        for collection in collections:
-            self._ids[collection.name] = []
-            file_path = self._get_file_name(collection, FileType.IDS)
-            self._ids[collection.name] = list(IdsDataFile(file_path).read())
+        manifest = {
+            name: {
+                "tail": segments.tail,
+                "base": segments.base,
+                "base_layout": segments.base_layout.value if segments.base_layout else None,
+                "base_records": segments.base_records,
+                "obsolete": segments.obsolete,
+                "base_size": segments.base_size,
+                "tail_size": segments.tail_size,
+            }
+            for name, segments in self._segments.items()
+        }
+
+        atomic_write(self._MANIFEST_FILE_PATH, json.dumps(manifest).encode())
+        self._manifest_version = self._get_manifest_version()
 
     def _read_config(self) -> None:
         """Reads the config file, makes config file validation.
+
+        The config file is compiled into the dictionaries used by the database (see `_compile_config()`),
+        which are stored in the compiled config file. Until the config file is changed, they are loaded
+        from the compiled file, so the config file is read, but it's not parsed nor validated again.
+
+        The file version is taken before the file is read, so a change made in the meantime is noticed
+        by the next `_refresh_manifest()`. The dictionaries are replaced at once, for the concurrent readers.
+        """
+        self._config_version = self._get_config_version()
+        try:
+            with open(self._CONFIG_FILE_PATH, "rb") as f:
+                config_data = f.read()
+        except Exception as e:
+            raise DatabaseConfigException(f"{e}")
+
+        compiled_file = CompiledConfigFile(os.path.join(self._directory, self.COMPILED_CONFIG_FILE_NAME))
+        compiled = compiled_file.read(config_data)
+        if compiled is None:
+            compiled = self._compile_config(config_data)
+            try:
+                compiled_file.write(config_data, compiled)
+            except OSError as e:
+                # it's only a cache, e.g. the directory can be read only for the queries
+                log.warning(f"Can't write the compiled config file: {e}")
+
+        # building the dictionaries with indices is faster than loading them
+        self._choices = {
+            name: Choice(name=name, values=values, dict_values=dict(zip(values, range(len(values)))))
+            for name, values in compiled.choices.items()
+        }
+        self._collections = {
+            name: Collection(
+                name=name, multiple_answers=multiple_answers, choices_name=choices_name, layout=Layout(layout)
+            )
+            for name, (multiple_answers, choices_name, layout) in compiled.collections.items()
+        }
+        self._config = compiled
+
+    @property
+    def _routes(self) -> Dict[str, Tuple[str, int]]:
+        """Dictionary [answer key->(collection_name, choice index)] for the multiple answers collections.
+
+        It's decoded from the compiled config on the first use, so the database opened for the queries
+        doesn't pay for it.
+        """
+        return self._config.routes
+
+    def _compile_config(self, config_data: bytes) -> CompiledConfig:
+        """Parses and validates the config file, and builds the dictionaries used by the database.
+
+        Args:
+            config_data: Content of the config file.
+
+        Returns:
+            The compiled config.
         """
         try:
-            with open(self._CONFIG_FILE_PATH) as f:
-                config = json.load(f)
+            config = json.loads(config_data)
         except Exception as e:
             raise DatabaseConfigException(f"{e}")
 
         self._validate_config(config)
 
+        choices = dict()
         for name, values in config["choices"].items():
             # as we will be looking for the index of the value, we also need to have a dictionary with indices:
-            self._choices[name] = Choice(name=name, values=values, dict_values={v: i for i, v in enumerate(values)},)
-
-        for name, value in config["collections"].items():
-            self._collections[name] = Collection(
-                name=name, multiple_answers=value["multiple_answers"], choices_name=value["choices"],
+            choices[name] = Choice(name=name, values=values, dict_values={v: i for i, v in enumerate(values)},)
+
+        collections = [
+            Collection(
+                name=name,
+                multiple_answers=value["multiple_answers"],
+                choices_name=value["choices"],
+                layout=Layout(value.get("layout", Layout.ROWS.value)),
             )
+            for name, value in config["collections"].items()
+        ]
+
+        return CompiledConfig.build(
+            choices={name: choice.values for name, choice in choices.items()},
+            collections={c.name: (c.multiple_answers, c.choices_name, c.layout.value) for c in collections},
+            routes=self._make_routes(collections, choices),
+        )
+
+    @staticmethod
+    def _make_routes(collections: List[Collection], choices: Dict[str, Choice]) -> Dict[str, Tuple[str, int]]:
+        """Creates the routing table for the keys of the answers of the multiple answers collections.
+
+        Examples:
+            For a collection `listened_singers` with the choices `["10cc", "abba"]`,
+            the routes are: `{"listened_singers.10cc": ("listened_singers", 0), "listened_singers.abba": (..., 1)}`
+
+        Args:
+            collections: Collections to create the routes for.
+            choices: Dictionary [choice_name->Choice] with the choices of the collections.
+
+        Returns:
+            Dictionary [answer key->(collection_name, choice index)].
+        """
+        routes = dict()
+        # a key is split on the first dot, so for the same keys the collection with the shorter name is used
+        for collection in sorted(collections, key=lambda c: len(c.name), reverse=True):
+            if not collection.multiple_answers:
+                continue
+            for choice, index in choices[collection.choices_name].dict_values.items():
+                routes[f"{collection.name}.{choice}"] = (collection.name, index)
+        return routes
 
     def _validate_config(self, config: dict) -> None:
         """Validates if the config has good data format.
@@ -158,11 +716,14 @@ class Database:
             "collections": {
                 "collection_one": {
                   "multiple_answers": true,
-                  "choices": "choice_one"
+                  "choices": "choice_one",
+                  "layout": "rows"
                 },
             }
         }
 
+        The `layout` field is optional, the default value is "rows".
+
         Raises:
             AssertionError: in case of bad config file format
 
@@ -201,152 +762,1781 @@ class Database:
             if ch not in choice_names:
                 raise DatabaseConfigException("The choices field should have one of the choices as value.")
 
+            layout = value.get("layout", Layout.ROWS.value)
+            if layout not in [item.value for item in Layout]:
+                raise DatabaseConfigException(f"Unknown layout '{layout}' for {name}.")
+            try:
+                self._validate_layout(Layout(layout), ma)
+            except ValueError as e:
+                raise DatabaseConfigException(f"{e} ({name}).")
+
+    @staticmethod
+    def _validate_layout(layout: Layout, multiple_answers: bool) -> None:
+        """Checks if the layout can be used for the kind of the collection.
+
+        Args:
+            layout: Layout of the collection files.
+            multiple_answers: Kind of the collection.
+
+        Raises:
+            ValueError: if the layout is not available for the collection.
+        """
+        if layout in [Layout.COLUMNS, Layout.ROARING] and not multiple_answers:
+            raise ValueError(f"The {layout.value} layout is available only for multiple answers")
+        if layout == Layout.PACKED and multiple_answers:
+            raise ValueError(f"The {layout.value} layout is available only for single answers")
+
     def store_answer(self, answer: dict) -> None:
-        """Saves the answer to the collection.
+        """Saves the answer to the collections, see `store_answers()`.
 
-        We don't support updates now, so if the answer is already stored, nothing will be written to any file.
+        If the pk of the answer is already stored, the answer is skipped, use `upsert_answers()` to replace it.
 
         Args:
             answer: Answer to store as dictionary from parsed json.
         """
-        pk = int(answer["pk"])
-        for name, collection in self._collections.items():
+        self.store_answers([answer])
 
-            if pk in self._ids[collection.name]:
-                log.info(f"There already is data for {collection} for pk={pk}, skipping it.")
-                continue
+    def store_answers(self, answers: List[dict]) -> None:
+        """Saves a batch of answers to the collections.
 
-            if collection.multiple_answers is False:
-                value = answer[name]
-                log.debug(f"one item, {name} -> {value}")
-                self.write_to_one_answer_file(collection, pk, value)
+        The batch is first appended to the write-ahead log, which is synchronized to disk once for the whole batch.
+        Then the values for each collection are encoded together, and each file is written with one write.
+        When all the files are synchronized to disk, the log is cleared.
 
-            else:
-                yes_choices = []
-                no_choices = []
-                for answer_key, answer_value in answer.items():
-                    key_parts = answer_key.split(".")
-                    if key_parts[0] != name:
-                        continue
-                    choice_name = ".".join(key_parts[1:])
-                    if answer_value == "no":
-                        no_choices.append(choice_name)
-                    elif answer_value == "yes":
-                        yes_choices.append(choice_name)
-                self.write_to_multi_answer_file(collection, pk, yes_choices, no_choices)
-
-    def write_to_multi_answer_file(
-        self, collection: Collection, pk: int, yes_choices: List[str], no_choices: List[str]
-    ) -> None:
-        """Writes answers to a multi value data file.
+        An answer whose pk is already stored (it's found in the pk index of the collection) is skipped,
+        so nothing is written for it to any file, and the stored answer is not changed.
+        The same applies to an answer repeated in the batch, only the first one is stored.
+        The stored answers are replaced with `upsert_answers()`, and removed with `delete_answers()`.
 
         Args:
-            collection: Collection to write the value to.
-            pk: Primary key of the answer.
-            yes_choices: List of user selected choices where user answered "yes".
-            no_choices:  List of user selected choices where user answered "no".
+            answers: Answers to store as dictionaries from parsed json.
+        """
+        self._write_batch(Operation.STORE, list(answers))
 
+    def upsert_answers(self, answers: List[dict]) -> None:
+        """Saves a batch of answers to the collections, the answers replace the stored ones with the same pks.
+
+        A stored value is not changed in place: it's appended to the tombstones file of the collection,
+        and the new value is appended to the tail files, the same way as a new answer.
+        The counters are corrected by subtracting the old value and adding the new one.
+        For an answer repeated in the batch, only the last one is stored.
+        An answer with the same values as the stored ones doesn't change anything.
+
+        Args:
+            answers: Answers to store as dictionaries from parsed json.
         """
+        self._write_batch(Operation.UPSERT, list(answers))
 
-        log.debug(f"Writing to {collection.name}: {pk}")
+    def delete_answers(self, pks: List[int]) -> None:
+        """Removes the answers with the pks from all the collections.
 
-        int_yes_values = [self._choices[collection.choices_name].dict_values[value] for value in yes_choices]
-        int_no_values = [self._choices[collection.choices_name].dict_values[value] for value in no_choices]
+        The removed values are appended to the tombstones files of the collections,
+        and they are subtracted from the counters. The data files are not changed.
 
-        self._ids[collection.name].append(pk)
-        IdsDataFile(self._get_file_name(collection, FileType.IDS)).write(pk)
+        Args:
+            pks: Primary keys of the answers to remove.
+        """
+        self._write_batch(Operation.DELETE, [{"pk": str(pk)} for pk in pks])
 
-        data_file = MultiValueDataFile(
-            self._get_file_name(collection, FileType.MULTI_VALUE), len(self._get_choices(collection))
-        )
-        value = MultiValue(pk=pk, yes_choices=int_yes_values, no_choices=int_no_values)
-        data_file.write(value)
+    def _write_batch(self, operation: Operation, answers: List[dict]) -> None:
+        """Applies the operation to the batch of answers, using the write-ahead log.
 
-    def write_to_one_answer_file(self, collection: Collection, pk: int, value: str) -> None:
-        """Writes answer to the SingleValue file.
+        The answers are converted to the values of the collections, and encoded for the write-ahead log,
+        before the writer lock is acquired. So the concurrent writers do only the work which depends
+        on the stored data in the lock: selecting the new answers, and writing the files.
 
         Args:
-            collection: Collection to write the value to.
-            pk: Primary key of the answer.
-            value: Value to write to, in this case it's just the one chosen position.
+            operation: Operation to apply.
+            answers: Answers from the batch.
+        """
+        self._check_writable()
+        routes = self._routes
+        try:
+            values = self._make_values(answers, operation)
+        except KeyError:
+            # the answer can be one of the choices appended to the config file, which is read again in the lock
+            values = None
+        encoded_answers = self._wal.encode_answers(answers)
+        with self._write_lock():
+            if values is None or self._routes is not routes:
+                # the config file was read again, so the answers are converted again with the appended choices
+                values = self._make_values(answers, operation)
+            records = {name: self.tail_records(name) for name in self._collections}
+            tombstones = {
+                name: self._get_tombstones_file(collection).records_count()
+                for name, collection in self._collections.items()
+            }
+            record = WalRecord(records=records, answers=answers, tombstones=tombstones, operation=operation)
+            self._wal.append(record, encoded_answers)
+            self._apply_answers(answers, operation, values)
+            self._wal.clear()
 
+    @contextmanager
+    def _write_lock(self) -> Generator[None, None, None]:
+        """Acquires the writer lock, and brings the state up to date with the changes of the other writers.
+
+        See `_catch_up()`.
         """
-        int_value = self._choices[collection.choices_name].dict_values[value]
-        log.debug(f"Writing to {collection.name}: {pk} -> {value}[{int_value}]")
+        with self._lock:
+            self._catch_up()
+            yield
 
-        self._ids[collection.name].append(pk)
-        IdsDataFile(self._get_file_name(collection, FileType.IDS)).write(pk)
+    def _catch_up(self) -> None:
+        """Brings the state up to date with the changes of the other writers, and of the config file.
 
-        SingleValueDataFile(self._get_file_name(collection, FileType.SINGLE_VALUE)).write(
-            SingleValue(pk=pk, value=int_value)
-        )
+        The other processes could have compacted the collections (so the manifest is read again),
+        or crashed in the middle of a batch (so the batch is applied again from the write-ahead log).
+        The ids appended by them are added to the indexes on the first use.
+        The choices appended to the config file are applied to the collection files.
 
-    def _get_choices(self, collection) -> List[str]:
-        """Returns list of choices for the collection.
+        It's called with the writer lock acquired.
+        """
+        self._refresh_manifest()
+        if not self._wal.is_empty():
+            self._recover()
+        self._evolve_collections()
 
-        Args:
-            collection: Collection to find the choices for.
+    def _read_catalog(self) -> Optional[dict]:
+        """Reads the catalog file, and checks the config file against it.
+
+        The format is:
+
+        {
+            "version": 2,
+            "choices": {
+                "choice_one": ["a", "b"],
+            }
+        }
 
         Returns:
-            List of choices for the collection.
+            The catalog, None if there is no catalog file.
+
+        Raises:
+            DatabaseConfigException: if the choices of the config file are not the ones from the catalog
+                                     with new ones appended.
         """
-        return self._choices[collection.choices_name].values
+        if not os.path.exists(self._CATALOG_FILE_PATH):
+            return None
+        with open(self._CATALOG_FILE_PATH) as f:
+            catalog = json.load(f)
 
-    def count(self, collection_name: str, limit: int = 10, sorting: Sorting = Sorting.DESC) -> SearchAnswer:
-        """Counts the choices for the collection.
+        for name, values in catalog["choices"].items():
+            choice = self._choices.get(name)
+            if choice is not None and choice.values[: len(values)] != values:
+                raise DatabaseConfigException(
+                    f"The choices {name} were changed, the new choices can be only appended to the stored ones."
+                )
+        return catalog
 
-        In case of a multi choice collection, we count the answers where user chose "yes".
+    def _write_catalog(self, version: int) -> None:
+        """Writes the choices of the config file to the catalog file.
 
-        All results are sorted by the count number (depending on the `sorting` argument).
-        The results then are limited to the number of the `limit` argument.
+        The file is replaced with `atomic_write()`.
 
         Args:
-            collection_name: Name of the collection to count the data for.
-            limit: Number of values to return.
-            sorting: Sorting direction of the results.
-
-        Returns:
-            List of values with the count number.
+            version: Version of the catalog.
         """
+        catalog = {"version": version, "choices": {name: choice.values for name, choice in self._choices.items()}}
 
-        start_time = time.time()
+        atomic_write(self._CATALOG_FILE_PATH, json.dumps(catalog).encode())
 
-        collection = self._collections.get(collection_name)
-        if collection is None:
-            raise ValueError("Bad collection name.")
+    def _evolve_collections(self) -> None:
+        """Applies the choices appended to the config file to the collection files.
 
-        choices = self._get_choices(collection)
+        The choices can be only appended, so the indices of the stored answers don't change, only the number
+        of the choices does (and with it the size of the records of some layouts). The compacted files are
+        not rewritten: the manifest keeps the number of choices they were written with, and the readers pad
+        their counts and bits with zeros for the appended choices. Only the tail files, which are small
+        as they are merged by each compaction, are copied to a new generation with the current number
+        of choices, so the answers for the appended choices can be stored. Then the manifest is replaced,
+        and the counters and the sample are converted.
+
+        The catalog file keeps the choices the derived files (the counters and the samples) were written with,
+        it's written after they are converted, so an interrupted conversion is finished by the next writer.
+
+        Raises:
+            DatabaseConfigException: if the choices of the config file are not the stored ones
+                                     with new ones appended.
+        """
+        config_choices = {name: choice.values for name, choice in self._choices.items()}
+        stored_catalog = self._read_catalog()
+        # without the catalog file, the files were written before there was one, so with the current choices
+        catalog = stored_catalog or {"version": 0, "choices": config_choices}
 
-        result = {n: 0 for n in range(0, len(choices))}
+        segments_changed = False
+        converted = []
+        for name, collection in self._collections.items():
+            choices = self._get_choices(collection)
+            size = len(choices)
+            stored_size = len(catalog["choices"].get(collection.choices_name, choices))
+            segments = self._segments[name]
+            # the sizes are missing in the manifest for the files written without the catalog file
+            base_size = segments.base_size if segments.base_size is not None or segments.base is None else stored_size
+            tail_size = segments.tail_size if segments.tail_size is not None else stored_size
+            if max(base_size or 0, tail_size, stored_size) > size:
+                raise DatabaseConfigException(
+                    f"The collection {name} was stored with more choices, the choices can be only appended."
+                )
+
+            segments = replace(segments, base_size=base_size, tail_size=tail_size)
+            if tail_size != size:
+                segments = self._convert_tail(collection, segments, size)
+            if segments != self._segments[name]:
+                self._segments[name] = segments
+                segments_changed = True
+            if stored_size != size:
+                converted.append((collection, stored_size))
+
+        if segments_changed:
+            self._write_manifest()
+        for collection, stored_size in converted:
+            self._convert_counters(collection, stored_size)
+        if stored_catalog is None or catalog["choices"] != config_choices:
+            self._write_catalog(catalog["version"] + 1)
+
+    def _convert_tail(self, collection: Collection, segments: Segments, size: int) -> Segments:
+        """Copies the tail files of the collection to a new generation, written with the new number of choices.
+
+        The records keep their positions, so the tombstones and the indexes are copied too.
 
-        counter = 0
+        Args:
+            collection: Collection to convert the tail files of.
+            segments: Generations of the collection files, with the sizes.
+            size: New number of choices.
 
+        Returns:
+            Generations of the collection files with the new tail generation, the old one is obsolete.
+        """
+        generations = [segments.tail] + segments.obsolete
+        if segments.base is not None:
+            generations.append(segments.base)
+        # the next two generations could be written by a compaction running at the same time
+        tail = max(generations) + 3
+        tail_records = IdsDataFile(self._get_file_name(collection, FileType.IDS, segments.tail)).records_count()
+
+        log.info(f"Converting the tail files of {collection.name} to {size} choices in the generation {tail}.")
+
+        # there could be files left by an interrupted conversion
+        self._remove_generation_files(collection, tail)
+        data_file = self._get_data_file(collection, segments.tail, size=segments.tail_size)
+        values = list(islice(data_file.read(), tail_records))
+        if values:
+            self._write_segment(collection, tail, collection.layout, values, size)
+
+        file_path = self._get_file_name(collection, FileType.TOMBSTONES, segments.tail)
         if collection.multiple_answers:
-            # For the multiple answer we need to take each "yes" and add to the result
-            df = MultiValueDataFile(self._get_file_name(collection, FileType.MULTI_VALUE), len(choices))
-            for answer in df.read():
-                counter += 1
-                for yes in answer.yes_choices:
-                    result[yes] += 1
+            records_file = MultiValueDataFile(file_path, segments.tail_size)
+            new_records_file = MultiValueDataFile(file_path, size)
         else:
-            # For single answer we need to just add the answer to the result
-            df = SingleValueDataFile(self._get_file_name(collection, FileType.SINGLE_VALUE))
-            for answer in df.read():
-                counter += 1
-                result[answer.value] += 1
+            records_file = new_records_file = SingleValueDataFile(file_path)
+        tombstones = list(TombstonesDataFile(file_path, records_file).read())
+        if tombstones:
+            new_file_path = self._get_file_name(collection, FileType.TOMBSTONES, tail)
+            new_tombstones_file = TombstonesDataFile(new_file_path, new_records_file)
+            new_tombstones_file.write_many(tombstones)
+            new_tombstones_file.sync()
+
+        # the positions of the records are the same, so the indexes are stored for the new generation
+        pks = self._get_pk_index_file(collection).read_pks(segments.tail)
+        if pks is not None:
+            self._get_pk_index_file(collection).write_pks(tail, pks)
+        offsets_file = self._get_offset_index_file(collection)
+        positions = offsets_file.read_positions(segments.tail)
+        if positions is not None:
+            offsets_file.write_positions(tail, positions[0], positions[1])
+        for indexes in [self._pk_indexes, self._offset_indexes]:
+            cached = indexes.get(collection.name)
+            if cached is not None and cached[0] == segments.tail:
+                indexes[collection.name] = (tail, cached[1])
+
+        return replace(segments, tail=tail, tail_size=size, obsolete=segments.obsolete + [segments.tail])
+
+    def _convert_counters(self, collection: Collection, stored_size: int) -> None:
+        """Converts the counters and the sample of the collection to the current number of choices.
+
+        The counters are converted first, so if they can't be read with the stored number of choices,
+        the conversion was interrupted (or the counters are missing), and both are created again
+        from the data files.
 
-        # we need to translate the indices into the values:
-        result = {choices[index]: item for index, item in result.items()}
+        Args:
+            collection: Collection to convert the files of.
+            stored_size: Number of choices the files were written with.
+        """
+        size = len(self._get_choices(collection))
+        counters = self._get_counters_file(collection, stored_size).read_counters()
+        if counters is None:
+            log.warning(f"Counting again all the answers of {collection.name}.")
+            self._get_counters_file(collection).write_counters(self._count_stored_values(collection))
+            self._sample_stored_values(collection)
+        else:
+            self._get_counters_file(collection).write_counters(
+                Counters(
+                    records=counters.records,
+                    yes=np.pad(counters.yes, (0, size - stored_size)),
+                    no=np.pad(counters.no, (0, size - stored_size)),
+                )
+            )
+            sample_file = self._get_sample_file(collection, stored_size)
+            self._get_sample_file(collection).replace_all(sample_file.decode(sample_file.read_records()))
+        self._increase_version(collection)
 
-        # and sort it
-        result = sorted(result.items(), key=lambda x: (x[1], x[0]), reverse=sorting == Sorting.DESC)
+    def _recover(self) -> None:
+        """Applies again the batches from the write-ahead log.
 
-        # and convert to the result objects
-        result = [AggregatedAnswer(name, value) for name, value in result]
+        A batch left in the log could have been applied only partially, so all the collection tail files
+        (and the tombstones files) are truncated to the number of records from before the batch,
+        and then the batch is applied again.
 
-        # and limit the number of answers
-        result = result[:limit]
+        An update or a delete doesn't always change the number of the stored records, so the counters
+        (and the samples) could be already changed by the batch, without a way to notice it.
+        So they are counted again from the data files after the batch is applied.
+        """
+        for record in self._wal.read():
+            log.warning(f"Recovering a batch of {len(record.answers)} answers from the write-ahead log.")
+            for name, records in record.records.items():
+                collection = self._collections.get(name)
+                if collection is None:
+                    continue
+                generation = self._segments[name].tail
+                IdsDataFile(self._get_file_name(collection, FileType.IDS, generation)).truncate(records)
+                self._get_data_file(collection, generation).truncate(records)
+                if name in record.tombstones:
+                    self._get_tombstones_file(collection).truncate(record.tombstones[name])
+
+                # the index file could contain the pks of the removed records, which is not noticed
+                # when there are updated pks, as the ids files have more records than the index
+                pk_index_file = self._get_pk_index_file(collection)
+                if os.path.exists(pk_index_file.file_path):
+                    os.remove(pk_index_file.file_path)
+                self._pk_indexes.pop(name, None)
+                self._offset_indexes.pop(name, None)
+
+            self._apply_answers(record.answers, record.operation)
+
+            if record.operation != Operation.STORE:
+                for name in record.records:
+                    collection = self._collections.get(name)
+                    if collection is None:
+                        continue
+                    log.warning(f"Counting again all the answers of {name}.")
+                    self._get_counters_file(collection).write_counters(self._count_stored_values(collection))
+                    self._sample_stored_values(collection)
 
-        elapsed_time = time.time() - start_time
+        # this also removes a torn record
+        self._wal.clear()
 
-        return SearchAnswer(results=result, time=elapsed_time, data_size=counter)
+    def _route_answers(self, answers: List[dict]) -> Dict[str, Tuple[List[List[int]], List[List[int]]]]:
+        """Converts the answers into the choices of the multiple answers collections.
+
+        The answers are converted in one pass: each key of an answer is looked up in the routing table,
+        and the choice index is appended to the buffer of its collection. The keys without a route
+        (like `pk`, or the single answer collections) are skipped.
+
+        Args:
+            answers: Answers as dictionaries from parsed json.
+
+        Returns:
+            Dictionary [collection_name->(lists of the "yes" choices, lists of the "no" choices)],
+            with one list for each answer.
+        """
+        # for each multiple answers collection: the lists of the "yes" and the "no" choices for each answer
+        buffers = {
+            name: ([[] for _ in answers], [[] for _ in answers])
+            for name, collection in self._collections.items()
+            if collection.multiple_answers
+        }
+        routes = self._routes
+        for row, answer in enumerate(answers):
+            for key, value in answer.items():
+                route = routes.get(key)
+                if route is None:
+                    continue
+                name, choice = route
+                if value == "yes":
+                    buffers[name][0][row].append(choice)
+                elif value == "no":
+                    buffers[name][1][row].append(choice)
+        return buffers
+
+    def _make_values(
+        self, answers: List[dict], operation: Operation = Operation.STORE
+    ) -> Dict[str, List[Union[SingleValue, MultiValue]]]:
+        """Converts the answers into the values of the collections.
+
+        Args:
+            answers: Answers as dictionaries from parsed json.
+            operation: Operation applied with the answers, for `Operation.DELETE` there are no values.
+
+        Returns:
+            Dictionary [collection_name->values], with one value for each answer.
+        """
+        if operation == Operation.DELETE:
+            return {name: [] for name in self._collections}
+
+        pks = [int(answer["pk"]) for answer in answers]
+        buffers = self._route_answers(answers)
+        values = dict()
+        for name, collection in self._collections.items():
+            if collection.multiple_answers:
+                yes, no = buffers[name]
+                values[name] = [MultiValue(pk=pk, yes_choices=y, no_choices=n) for pk, y, n in zip(pks, yes, no)]
+            else:
+                dict_values = self._choices[collection.choices_name].dict_values
+                values[name] = [SingleValue(pk=pk, value=dict_values[a[name]]) for pk, a in zip(pks, answers)]
+        return values
+
+    def _apply_answers(
+        self,
+        answers: List[dict],
+        operation: Operation = Operation.STORE,
+        values: Optional[Dict[str, List[Union[SingleValue, MultiValue]]]] = None,
+    ) -> None:
+        """Writes the answers to the collection files, and synchronizes them to disk.
+
+        Args:
+            answers: Answers to store as dictionaries from parsed json.
+            operation: Operation to apply, for `Operation.DELETE` only the pks of the answers are used.
+            values: The answers converted to the values (see `_make_values()`), converted here if not set.
+        """
+        pks = [int(answer["pk"]) for answer in answers]
+        if values is None:
+            values = self._make_values(answers, operation)
+
+        for name, collection in self._collections.items():
+            if operation == Operation.STORE:
+                rows = self._select_new_rows(collection, pks)
+                stored = dict()
+            else:
+                # for a pk repeated in the batch only the last answer is used
+                rows = sorted({pk: row for row, pk in enumerate(pks)}.values())
+                stored = self._find_live_records(collection, [pks[row] for row in rows])
+
+            if operation == Operation.DELETE:
+                removed = list(stored.values())
+                new_values = []
+            else:
+                new_values = [values[name][row] for row in rows]
+                new_values = [value for value in new_values if not self._same_value(stored.get(value.pk), value)]
+                removed = [stored[value.pk] for value in new_values if value.pk in stored]
+
+            self._write_values(collection, new_values, removed)
+
+    def _select_new_rows(self, collection: Collection, pks: List[int]) -> List[int]:
+        """Selects the answers which are not stored in the collection yet.
+
+        A pk which was deleted is not stored, so its answer can be stored again.
+
+        Args:
+            collection: Collection to check the pks in.
+            pks: Pks of the answers.
+
+        Returns:
+            Positions of the answers to store, for a pk repeated in the batch only the first one is stored.
+        """
+        index = self._get_pk_index(collection)
+        stored_pks = {pk for pk in pks if pk in index}
+        if stored_pks and self._get_tombstones_file(collection).records_count():
+            stored_pks = set(self._find_live_positions(collection, list(stored_pks)))
+
+        rows = []
+        batch_pks = set()
+        for row, pk in enumerate(pks):
+            if pk in batch_pks or pk in stored_pks:
+                log.info(f"There already is data for {collection} for pk={pk}, skipping it.")
+                continue
+
+            batch_pks.add(pk)
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def _same_value(
+        stored: Optional[Tuple[int, Union[SingleValue, MultiValue]]], value: Union[SingleValue, MultiValue]
+    ) -> bool:
+        """Checks if the stored record has the same answers as the value.
+
+        Args:
+            stored: Position and value of the stored record, None if there is no such record.
+            value: New value.
+
+        Returns:
+            True if the value doesn't change the stored record.
+        """
+        if stored is None:
+            return False
+        old = stored[1]
+        if isinstance(value, MultiValue):
+            return sorted(old.yes_choices) == sorted(value.yes_choices) and sorted(old.no_choices) == sorted(
+                value.no_choices
+            )
+        return old.value == value.value
+
+    def _write_values(
+        self,
+        collection: Collection,
+        values: List[Union[SingleValue, MultiValue]],
+        removed: List[Tuple[int, Union[SingleValue, MultiValue]]] = (),
+    ) -> None:
+        """Writes the values to the tail ids file and the tail data file of the collection.
+
+        Args:
+            collection: Collection to write the values to.
+            values: Values to write.
+            removed: Positions and values of the stored records, which are removed (updated or deleted).
+        """
+        self._check_writable()
+        if not values and not removed:
+            return
+
+        log.debug(f"Writing to {collection.name}: {len(values)} values, {len(removed)} removed")
+
+        stored_records = self._live_records_count(collection)
+        index = self._get_pk_index(collection)
+        index.add_many(value.pk for value in values)
+
+        if values:
+            self._write_segment(collection, self._segments[collection.name].tail, collection.layout, values)
+        if removed:
+            tombstones_file = self._get_tombstones_file(collection)
+            tombstones_file.write_many(removed)
+            tombstones_file.sync()
+
+        removed_values = [value for _, value in removed]
+        self._update_counters(collection, values, stored_records, removed_values)
+        self._update_sample(collection, values, stored_records, removed_values)
+        self._increase_version(collection)
+
+        # the index file is written only for the records synchronized to disk
+        if index.merged:
+            self._get_pk_index_file(collection).write_pks(self._segments[collection.name].tail, index.sorted_pks())
+            index.merged = False
+
+    def _write_segment(
+        self,
+        collection: Collection,
+        generation: int,
+        layout: Layout,
+        values: List[Union[SingleValue, MultiValue]],
+        size: Optional[int] = None,
+    ) -> None:
+        """Appends the values to the ids file and the data file of the generation, and synchronizes them to disk.
+
+        Args:
+            collection: Collection to write the values to.
+            generation: Generation of the files.
+            layout: Layout of the data file.
+            values: Values to write.
+            size: Number of choices of the data file, by default the one from the manifest.
+        """
+        ids_file = IdsDataFile(self._get_file_name(collection, FileType.IDS, generation))
+        ids_file.write_many([value.pk for value in values])
+
+        data_file = self._get_data_file(collection, generation, layout, size)
+        data_file.write_many(values)
+
+        ids_file.sync()
+        data_file.sync()
+
+    def _get_counters_file(self, collection: Collection, size: Optional[int] = None) -> CountersDataFile:
+        """Creates the counters file object for the collection.
+
+        Args:
+            collection: Collection to create the counters file for.
+            size: Number of choices of the counters, the current number by default.
+
+        Returns:
+            Counters file object.
+        """
+        if size is None:
+            size = len(self._get_choices(collection))
+        return CountersDataFile(self._get_file_name(collection, FileType.COUNTS), size)
+
+    def _count_values(self, collection: Collection, values: List[Union[SingleValue, MultiValue]]) -> Counters:
+        """Counts the answers in the values.
+
+        Args:
+            collection: Collection of the values.
+            values: Values to count.
+
+        Returns:
+            Counters of the values.
+        """
+        size = len(self._get_choices(collection))
+        if not collection.multiple_answers:
+            yes = np.bincount([value.value for value in values], minlength=size).astype(np.int64)
+            return Counters(records=len(values), yes=yes, no=np.zeros(size, dtype=np.int64))
+
+        yes_choices = [choice for value in values for choice in value.yes_choices]
+        no_choices = [choice for value in values for choice in value.no_choices]
+        return Counters(
+            records=len(values),
+            yes=np.bincount(yes_choices, minlength=size).astype(np.int64),
+            no=np.bincount(no_choices, minlength=size).astype(np.int64),
+        )
+
+    def _count_stored_values(self, collection: Collection) -> Counters:
+        """Counts all the answers stored in the data files of the collection.
+
+        Args:
+            collection: Collection to count the answers for.
+
+        Returns:
+            Counters of the stored values.
+        """
+        counters = self._count_values(collection, [])
+        for chunk in self._read_live_values(collection):
+            counters += self._count_values(collection, chunk)
+        return counters
+
+    def _read_live_values(self, collection: Collection) -> Generator[List[Union[SingleValue, MultiValue]], None, None]:
+        """Yields the values stored in the data files of the collection in chunks, without the removed ones.
+
+        Args:
+            collection: Collection to read the values of.
+
+        Yields:
+            List of at most `DataFile.READ_CHUNK_SIZE` values.
+        """
+        removed = self._get_tombstones_file(collection).positions()
+        position = 0
+        for _, data_file in self._get_segment_files(collection):
+            values = data_file.read()
+            while True:
+                chunk = list(islice(values, DataFile.READ_CHUNK_SIZE))
+                if not chunk:
+                    break
+                end = position + len(chunk)
+                if len(removed):
+                    dead = DataFile._sorted_contains(removed, np.arange(position, end))
+                    chunk = [value for value, is_dead in zip(chunk, dead.tolist()) if not is_dead]
+                position = end
+                yield chunk
+
+    def _update_counters(
+        self,
+        collection: Collection,
+        values: List[Union[SingleValue, MultiValue]],
+        stored_records: int,
+        removed: List[Union[SingleValue, MultiValue]] = (),
+    ) -> None:
+        """Adds the values, which were just written to the data files, to the stored counters.
+
+        The removed values are subtracted from the counters.
+        If the counters are missing, or they were not counted for the records stored before the values
+        (e.g. the counters were written, but the batch was interrupted before the write-ahead log was cleared),
+        they are counted again from the data files.
+
+        Args:
+            collection: Collection of the values.
+            values: Values written to the data files.
+            stored_records: Number of records stored before the values, without the removed ones.
+            removed: Values of the records removed with the values.
+        """
+        counters_file = self._get_counters_file(collection)
+        counters = counters_file.read_counters()
+        if counters is None and stored_records == 0:
+            counters = self._count_values(collection, values)
+        elif counters is not None and counters.records == stored_records:
+            counters += self._count_values(collection, values)
+            counters -= self._count_values(collection, removed)
+        else:
+            log.warning(f"Counting again all the answers of {collection.name}.")
+            counters = self._count_stored_values(collection)
+        counters_file.write_counters(counters)
+
+    def _get_sample_file(self, collection: Collection, size: Optional[int] = None) -> SampleDataFile:
+        """Creates the sample file object for the collection.
+
+        Args:
+            collection: Collection to create the sample file for.
+            size: Number of choices of the records, the current number by default.
+
+        Returns:
+            Sample file object, with the records in the rows layout.
+        """
+        if size is None:
+            size = len(self._get_choices(collection))
+        file_path = self._get_file_name(collection, FileType.SAMPLE)
+        if collection.multiple_answers:
+            records_file = MultiValueDataFile(file_path, size)
+        else:
+            records_file = SingleValueDataFile(file_path)
+        return SampleDataFile(file_path, records_file, self.SAMPLE_SIZE)
+
+    def _update_sample(
+        self,
+        collection: Collection,
+        values: List[Union[SingleValue, MultiValue]],
+        stored_records: int,
+        removed: List[Union[SingleValue, MultiValue]] = (),
+    ) -> None:
+        """Adds the values, which were just written to the data files, to the sample of the collection.
+
+        The removed values are removed from the sample first.
+        If the sample has less records than it should (e.g. it's missing, or a removed record was
+        in the full sample), it's created again from the data files.
+
+        Args:
+            collection: Collection of the values.
+            values: Values written to the data files.
+            stored_records: Number of records stored before the values, without the removed ones.
+            removed: Values of the records removed with the values.
+        """
+        sample_file = self._get_sample_file(collection)
+        sample_file.remove_many([value.pk for value in removed])
+        if len(sample_file.view()) < min(stored_records - len(removed), sample_file.max_records):
+            # the values are already in the data files
+            self._sample_stored_values(collection)
+            return
+
+        sample_file.write_many(values)
+        sample_file.sync()
+
+    def _sample_stored_values(self, collection: Collection) -> None:
+        """Creates the sample of the collection again from the data files.
+
+        Args:
+            collection: Collection to create the sample for.
+        """
+        log.warning(f"Sampling again all the answers of {collection.name}.")
+        sample_file = self._get_sample_file(collection)
+        if os.path.exists(sample_file.file_path):
+            os.remove(sample_file.file_path)
+        for chunk in self._read_live_values(collection):
+            sample_file.write_many(chunk)
+        sample_file.sync()
+
+    def _get_version_file(self, collection: Collection) -> VersionDataFile:
+        """Creates the version file object for the collection.
+
+        Args:
+            collection: Collection to create the version file for.
+
+        Returns:
+            Version file object.
+        """
+        return VersionDataFile(self._get_file_name(collection, FileType.VERSION))
+
+    def _increase_version(self, collection: Collection) -> None:
+        """Increases the version of the collection data, so the cached query results become outdated.
+
+        It's called after the changed files are synchronized to disk. Otherwise a query running
+        at the same time could cache the results of the old data for the new version.
+
+        Args:
+            collection: Collection which data was changed.
+        """
+        version_file = self._get_version_file(collection)
+        version_file.write_version(version_file.read_version() + 1)
+
+    def verify_counters(self, collection_name: str, repair: bool = False) -> bool:
+        """Checks if the stored counters are the same as the answers counted from the data files.
+
+        The state is brought up to date with the other writers first (see `_catch_up()`), so e.g. the counters
+        are already converted to the appended choices. The database opened only for the queries just reads
+        the manifest again. A collection without the counters file was never written, so its counters are zeros.
+
+        Args:
+            collection_name: Name of the collection to check the counters for.
+            repair: If True, then the wrong counters are replaced with the counted ones.
+
+        Returns:
+            True if the counters are correct.
+        """
+        collection = self._collections.get(collection_name)
+        if collection is None:
+            raise ValueError("Bad collection name.")
+
+        if repair:
+            self._check_writable()
+
+        with self._lock if self._read_only else self._write_lock():
+            if self._read_only:
+                self._refresh_manifest()
+            counters_file = self._get_counters_file(collection)
+            stored = counters_file.read_counters()
+            if stored is None and not os.path.exists(counters_file.file_path):
+                stored = self._count_values(collection, [])
+            counters = self._count_stored_values(collection)
+            if stored == counters:
+                return True
+
+            log.warning(f"The counters of {collection_name} don't match the data files.")
+            if repair:
+                counters_file.write_counters(counters)
+                self._increase_version(collection)
+            return False
+
+    def _get_data_file(
+        self,
+        collection: Collection,
+        generation: Optional[int] = None,
+        layout: Optional[Layout] = None,
+        size: Optional[int] = None,
+    ) -> DataFile:
+        """Creates the data file object for the collection, depending on its kind and layout.
+
+        Args:
+            collection: Collection to create the data file for.
+            generation: Generation of the file, the current tail generation by default.
+            layout: Layout of the file, the collection layout by default.
+            size: Number of choices the file was written with, by default the one from the manifest.
+
+        Returns:
+            Data file object for reading and writing the collection values.
+        """
+        if generation is None:
+            generation = self._segments[collection.name].tail
+        if layout is None:
+            layout = collection.layout
+
+        def file_name(file_type: FileType) -> str:
+            return self._get_file_name(collection, file_type, generation)
+
+        if size is None:
+            size = self._get_size(collection, generation)
+        if not collection.multiple_answers:
+            if layout == Layout.BLOCKS:
+                return SingleValueBlocksDataFile(file_name(FileType.SINGLE_VALUE_BLOCKS), size)
+            if layout == Layout.PACKED:
+                return SingleValuePackedDataFile(file_name(FileType.SINGLE_VALUE_PACKED), size)
+            return SingleValueDataFile(file_name(FileType.SINGLE_VALUE))
+
+        if layout == Layout.COLUMNS:
+            return MultiValueColumnsDataFile(file_name(FileType.MULTI_VALUE_COLUMNS), size)
+        if layout == Layout.ROARING:
+            return MultiValueRoaringDataFile(file_name(FileType.MULTI_VALUE_ROARING), size)
+        if layout == Layout.BLOCKS:
+            return MultiValueBlocksDataFile(file_name(FileType.MULTI_VALUE_BLOCKS), size)
+
+        return MultiValueDataFile(file_name(FileType.MULTI_VALUE), size)
+
+    def _get_size(
+        self, collection: Collection, generation: Optional[int] = None, segments: Optional[Segments] = None
+    ) -> int:
+        """Returns the number of choices the files of the generation were written with.
+
+        The choices can be appended to the config file, and the compacted files are not rewritten then,
+        so they keep the number of choices from the time they were written (see `_evolve_collections()`).
+
+        Args:
+            collection: Collection of the files.
+            generation: Generation of the files, the current tail generation by default.
+            segments: Generations of the files, the current ones by default.
+
+        Returns:
+            Number of choices, the current one for a new generation (e.g. one written by the compaction).
+        """
+        if segments is None:
+            segments = self._segments[collection.name]
+        size = None
+        if generation is None or generation == segments.tail:
+            size = segments.tail_size
+        elif generation == segments.base:
+            size = segments.base_size
+        return len(self._get_choices(collection)) if size is None else size
+
+    def _get_segment_files(
+        self, collection: Collection, segments: Optional[Segments] = None
+    ) -> List[Tuple[IdsDataFile, DataFile]]:
+        """Creates the file objects for all the generations of the collection which store the data.
+
+        Args:
+            collection: Collection to create the files for.
+            segments: Generations of the files, the current ones by default.
+
+        Returns:
+            List of the ids file and data file pairs, the compacted files are the first ones.
+        """
+        if segments is None:
+            segments = self._segments[collection.name]
+
+        generations = [(segments.tail, collection.layout)]
+        if segments.base is not None:
+            generations.insert(0, (segments.base, segments.base_layout))
+
+        return [
+            (
+                IdsDataFile(self._get_file_name(collection, FileType.IDS, generation)),
+                self._get_data_file(collection, generation, layout, self._get_size(collection, generation, segments)),
+            )
+            for generation, layout in generations
+        ]
+
+    def _remove_generation_files(self, collection: Collection, generation: int) -> None:
+        """Removes all the files of the generation of the collection.
+
+        Args:
+            collection: Collection to remove the files for.
+            generation: Generation of the files to remove.
+        """
+        for file_type in FileType:
+            if file_type in [
+                FileType.COUNTS,
+                FileType.PK_INDEX,
+                FileType.OFFSETS,
+                FileType.VERSION,
+                FileType.SAMPLE,
+                FileType.COOCCURRENCE,
+            ]:
+                # these files are common for all the generations
+                continue
+            file_path = self._get_file_name(collection, file_type, generation)
+            for path in [file_path, file_path + ".undo"]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def collection_names(self) -> List[str]:
+        """Returns names of all the collections from the config file.
+
+        Returns:
+            List of the collection names.
+        """
+        return list(self._collections)
+
+    def tail_records(self, collection_name: str) -> int:
+        """Returns the number of records appended to the collection since the last compaction.
+
+        Args:
+            collection_name: Name of the collection.
+
+        Returns:
+            Number of records in the tail files of the collection.
+        """
+        collection = self._collections[collection_name]
+        generation = self._segments[collection_name].tail
+        return IdsDataFile(self._get_file_name(collection, FileType.IDS, generation)).records_count()
+
+    def compact(self, collection_name: str, layout: Layout = Layout.BLOCKS) -> bool:
+        """Merges the compacted files and the tail files of the collection into new compacted files.
+
+        The new compacted files are sorted by pk, and are written in the layout from the argument,
+        so the appended rows can be turned into blocks with precomputed counts or per choice bitmaps.
+
+        The files are merged without blocking the writes, only the tail files are read with the lock.
+        Then the manifest is atomically replaced, so the readers switch from the old files to the new ones.
+        The records appended during the compaction are moved to the new tail files.
+        The old files are removed by the next compaction, so the readers which still use them can finish.
+
+        A collection is compacted by one process at a time, the compaction is skipped when the collection
+        is already being compacted by another process (or thread).
+
+        Args:
+            collection_name: Name of the collection to compact.
+            layout: Layout of the compacted files.
+
+        Returns:
+            True if the collection was compacted, False if there was nothing to compact,
+            or the collection is being compacted by another process.
+        """
+        collection = self._collections.get(collection_name)
+        if collection is None:
+            raise ValueError("Bad collection name.")
+        try:
+            self._validate_layout(layout, collection.multiple_answers)
+        except ValueError as e:
+            raise ValueError(f"{e} ({collection_name}).")
+        self._check_writable()
+
+        compaction_lock = WriterLock(os.path.join(self._directory, f"{collection_name}.compaction.lock"))
+        if not compaction_lock.acquire(blocking=False):
+            log.info(f"{collection_name} is being compacted by another process.")
+            return False
+        try:
+            return self._compact(collection, layout)
+        finally:
+            compaction_lock.release()
+
+    def _compact(self, collection: Collection, layout: Layout) -> bool:
+        """Merges the compacted files and the tail files of the collection, see `compact()`.
+
+        Args:
+            collection: Collection to compact.
+            layout: Layout of the compacted files.
+
+        Returns:
+            True if the collection was compacted, False if there was nothing to compact.
+        """
+        collection_name = collection.name
+        with self._write_lock():
+            segments = self._segments[collection_name]
+            tail_records = self.tail_records(collection_name)
+            tombstones_file = self._get_tombstones_file(collection)
+            tombstones = tombstones_file.records_count()
+            if tail_records == 0 and tombstones == 0:
+                return False
+            tail_values = list(islice(self._get_data_file(collection).read(), tail_records))
+            # the tail files were converted to the current number of choices by `_catch_up()`
+            size = self._get_size(collection)
+            removed = np.sort(tombstones_file.view()["position"][:tombstones].astype(np.int64))
+
+        values = []
+        if segments.base is not None:
+            values.extend(self._get_data_file(collection, segments.base, segments.base_layout).read())
+        values.extend(tail_values)
+
+        # the removed records are dropped, the positions of the kept ones are needed for the later tombstones
+        stored_records = len(values)
+        positions = np.flatnonzero(~DataFile._sorted_contains(removed, np.arange(stored_records)))
+        positions = sorted(positions.tolist(), key=lambda position: values[position].pk)
+        values = [values[position] for position in positions]
+        new_positions = np.full(stored_records, -1, dtype=np.int64)
+        new_positions[positions] = np.arange(len(positions))
+
+        generations = [segments.tail] + segments.obsolete
+        if segments.base is not None:
+            generations.append(segments.base)
+        base = max(generations) + 1
+        tail = base + 1
+
+        log.info(f"Compacting {collection_name}: {len(values)} records into the generation {base}")
+
+        # there could be files left by an interrupted compaction
+        self._remove_generation_files(collection, base)
+        self._remove_generation_files(collection, tail)
+        self._write_segment(collection, base, layout, values, size)
+
+        with self._write_lock():
+            if self._segments[collection_name].tail != segments.tail:
+                # the tail files were converted to the appended choices in the meantime
+                log.info(f"The tail files of {collection_name} were changed during the compaction, it's stopped.")
+                self._remove_generation_files(collection, base)
+                return False
+
+            appended_values = list(islice(self._get_data_file(collection).read(), tail_records, None))
+            if appended_values:
+                self._write_segment(collection, tail, collection.layout, appended_values, size)
+
+            # the records removed during the compaction are moved to the new tombstones file, with the new positions
+            appended_shift = len(values) - stored_records
+            appended_tombstones = [
+                (int(new_positions[position]) if position < stored_records else position + appended_shift, value)
+                for position, value in islice(tombstones_file.read(), tombstones, None)
+            ]
+            if appended_tombstones:
+                new_tombstones_file = self._get_tombstones_file(collection, tail)
+                new_tombstones_file.write_many(appended_tombstones)
+                new_tombstones_file.sync()
+
+            for generation in segments.obsolete:
+                self._remove_generation_files(collection, generation)
+
+            obsolete = [segments.tail] if segments.base is None else [segments.base, segments.tail]
+            self._segments[collection_name] = Segments(
+                tail=tail,
+                base=base,
+                base_layout=layout,
+                base_records=len(values),
+                obsolete=obsolete,
+                base_size=size,
+                tail_size=size,
+            )
+            self._write_manifest()
+
+            # the compacted pks are already sorted, so they are stored as the pk index for the new generation
+            base_pks = np.array([value.pk for value in values], dtype=np.uint32)
+            self._get_pk_index_file(collection).write_pks(tail, base_pks)
+            self._pk_indexes[collection_name] = (
+                tail,
+                PkIndex(base_pks, [value.pk for value in appended_values], indexed=len(values) + len(appended_values)),
+            )
+
+            # the compacted records are sorted by pk, so their positions are stored in the same order
+            offsets_file = self._get_offset_index_file(collection)
+            positions = np.zeros(len(base_pks), dtype=offsets_file.dtype)
+            positions["pk"] = base_pks
+            positions["position"] = np.arange(len(base_pks))
+            offsets_file.write_positions(tail, len(base_pks), positions)
+            self._offset_indexes.pop(collection_name, None)
+
+        return True
+
+    def get_answer(self, pk: int) -> Dict[str, Union[SingleValue, MultiValue]]:
+        """Reads the values stored for the pk in all the collections.
+
+        The position of the record is found in the offsets index of the collection (see `_get_offset_index()`),
+        then only this record is read from the compacted file or the tail file.
+
+        Args:
+            pk: Primary key of the answer.
+
+        Returns:
+            Dictionary [collection_name->value], without the collections which don't have a value for the pk
+            (or it was deleted).
+        """
+        # the manifest could have been changed by a compaction in another process
+        self._refresh_manifest()
+
+        answer = dict()
+        for name, collection in self._collections.items():
+            record = self._find_live_records(collection, [pk]).get(pk)
+            if record is not None:
+                answer[name] = record[1]
+        return answer
+
+    def _find_live_positions(self, collection: Collection, pks: List[int]) -> Dict[int, int]:
+        """Finds the positions of the records with the pks, which were not removed.
+
+        Args:
+            collection: Collection to find the records in.
+            pks: Pks of the records.
+
+        Returns:
+            Dictionary [pk->position] of the found records.
+        """
+        index = self._get_offset_index(collection)
+        positions = {pk: position for pk, position in ((pk, index.get(pk)) for pk in pks) if position is not None}
+        if not positions:
+            return positions
+
+        removed = self._get_tombstones_file(collection).positions()
+        if len(removed) == 0:
+            return positions
+        dead = DataFile._sorted_contains(removed, np.array(list(positions.values())))
+        return {pk: position for (pk, position), is_dead in zip(positions.items(), dead.tolist()) if not is_dead}
+
+    def _find_live_records(
+        self, collection: Collection, pks: List[int]
+    ) -> Dict[int, Tuple[int, Union[SingleValue, MultiValue]]]:
+        """Finds the records with the pks, which were not removed, and reads their values.
+
+        Args:
+            collection: Collection to find the records in.
+            pks: Pks of the records.
+
+        Returns:
+            Dictionary [pk->(position, value)] of the found records.
+        """
+        records = dict()
+        for pk, position in self._find_live_positions(collection, pks).items():
+            value = self._read_record(collection, position)
+            if value is not None:
+                records[pk] = (position, value)
+        return records
+
+    def _read_record(self, collection: Collection, position: int) -> Optional[Union[SingleValue, MultiValue]]:
+        """Reads the record at the position in the collection.
+
+        Args:
+            collection: Collection to read the record from.
+            position: Position of the record, the compacted files are the first ones.
+
+        Returns:
+            The value, None if there is no record at the position.
+        """
+        segments = self._segments[collection.name]
+        if segments.base is not None and position < segments.base_records:
+            data_file = self._get_data_file(collection, segments.base, segments.base_layout)
+        else:
+            data_file = self._get_data_file(collection, segments.tail)
+            position -= segments.base_records
+        return data_file.read_at(position)
+
+    def _get_choices(self, collection) -> List[str]:
+        """Returns list of choices for the collection.
+
+        Args:
+            collection: Collection to find the choices for.
+
+        Returns:
+            List of choices for the collection.
+        """
+        return self._choices[collection.choices_name].values
+
+    def _scan_data_files(
+        self, collection: Collection, pk_range: Optional[Tuple[int, int]] = None, pks: Optional[np.ndarray] = None
+    ) -> Tuple[int, np.ndarray]:
+        """Counts the choices reading all the data files of the collection.
+
+        Args:
+            collection: Collection to count the data for.
+            pk_range: If set, only the answers with pk in the range (inclusive) are counted.
+            pks: If set, only the answers with pk in the sorted array are counted.
+
+        Returns:
+            A tuple with the number of records and an array of counts indexed by the choice.
+        """
+        size = len(self._get_choices(collection))
+
+        # the removed records are still in the data files, so they are subtracted
+        tombstones_file = self._get_tombstones_file(collection)
+        removed_counter, removed_counts = tombstones_file.count_records(tombstones_file.records(), size, pk_range, pks)
+        counter = -removed_counter
+        counts = np.zeros(size, dtype=np.int64)
+        # the files written before the choices were appended have fewer counts, the missing ones are zeros
+        counts[: len(removed_counts)] -= removed_counts
+        for _, df in self._get_segment_files(collection):
+            if collection.multiple_answers:
+                # For the multiple answer we need to count all the "yes" for each choice,
+                # this is done in a vectorized way, without decoding the records one by one.
+                segment_counter, segment_counts = df.count_yes_choices(pk_range, pks)
+            else:
+                # For single answer we need to just count the chosen values
+                segment_counter, segment_counts = df.count_values(size, pk_range, pks)
+            counter += segment_counter
+            counts[: len(segment_counts)] += segment_counts
+        return counter, counts
+
+    def _validate_filter(self, query_filter: Filter) -> None:
+        """Checks if the filter refers to an existing collection and choice.
+
+        Args:
+            query_filter: Filter to check.
+
+        Raises:
+            ValueError: if the filter is not valid.
+        """
+        collection = self._collections.get(query_filter.collection_name)
+        if collection is None:
+            raise ValueError(f"Bad collection name in the filter: {query_filter.collection_name}.")
+        if query_filter.choice not in self._choices[collection.choices_name].dict_values:
+            raise ValueError(f"Bad choice in the filter for {query_filter.collection_name}: {query_filter.choice}.")
+        if not query_filter.yes and not collection.multiple_answers:
+            raise ValueError(f'The collection {query_filter.collection_name} doesn\'t store the answers "no".')
+
+    def _select_pks(self, query_filter: Filter) -> np.ndarray:
+        """Finds the pks of the answers matching the filter.
+
+        Args:
+            query_filter: Filter to find the pks for.
+
+        Returns:
+            Sorted array of unique pks.
+        """
+        collection = self._collections[query_filter.collection_name]
+        choice = self._choices[collection.choices_name].dict_values[query_filter.choice]
+        tombstones_file = self._get_tombstones_file(collection)
+        removed = np.zeros(0, dtype=np.int64)
+        if choice < self._get_size(collection):
+            removed = tombstones_file.select_pks(tombstones_file.records(), choice, query_filter.yes)
+        selected = [np.zeros(0, dtype=np.int64)]
+        segments = self._segments[collection.name]
+        generations = [segments.tail] if segments.base is None else [segments.base, segments.tail]
+        for generation, (_, df) in zip(generations, self._get_segment_files(collection, segments)):
+            if choice >= self._get_size(collection, generation, segments):
+                # the choice was appended after the file was written, so there are no answers for it
+                continue
+            if collection.multiple_answers:
+                selected.append(df.select_pks(choice, query_filter.yes))
+            else:
+                selected.append(df.select_pks(choice))
+        if len(removed) == 0:
+            return np.unique(np.concatenate(selected))
+
+        # an updated pk can be selected by its removed record and by the new one, so only the removed records
+        # are subtracted from the number of the selected records of each pk
+        pks, counts = np.unique(np.concatenate(selected), return_counts=True)
+        removed, removed_counts = np.unique(removed, return_counts=True)
+        found = DataFile._sorted_contains(pks, removed)
+        counts[np.searchsorted(pks, removed[found])] -= removed_counts[found]
+        return pks[counts > 0]
+
+    def _filter_pks(self, filters: List[Filter]) -> np.ndarray:
+        """Finds the pks of the answers matching all the filters.
+
+        The pks are found separately for each filter, then the sorted arrays are intersected.
+
+        Args:
+            filters: Filters to find the pks for.
+
+        Returns:
+            Sorted array of unique pks.
+        """
+        pks = self._select_pks(filters[0])
+        for query_filter in filters[1:]:
+            if len(pks) == 0:
+                break
+            pks = np.intersect1d(pks, self._select_pks(query_filter), assume_unique=True)
+        return pks
+
+    def _approximate_count(
+        self,
+        collection: Collection,
+        limit: int,
+        sorting: Sorting,
+        pk_range: Optional[Tuple[int, int]],
+        filters: List[Filter],
+        max_error: float,
+        confidence: float,
+    ) -> Optional[Tuple[int, List[AggregatedAnswer], bool]]:
+        """Estimates the counts of the choices from the samples of the collections.
+
+        The samples of all the used collections contain the records with the smallest hashes of the pks,
+        so only the records with the hashes up to the smallest of the largest hashes of the full samples are used,
+        as they are in all the samples. The filters are applied to the joined samples.
+
+        The confidence intervals are the Wilson score intervals of the proportions of the sampled records,
+        with the finite population correction. The estimate is used only if all the intervals (also the one
+        of the number of the selected records) are narrower than `max_error`, and the intervals of the returned
+        results (and of the first one not returned) don't overlap, so their order is known.
+
+        Args:
+            collection: Collection to count the data for.
+            limit: Number of values to return.
+            sorting: Sorting direction of the results.
+            pk_range: If set, only the answers with pk in the range (inclusive) are counted.
+            filters: Only the answers of the people matching all the filters are counted.
+            max_error: Maximal half-width of the confidence intervals, as a fraction of all the records.
+            confidence: Confidence level of the intervals.
+
+        Returns:
+            A tuple with the (estimated) number of records, all the results sorted, and True if the results
+            are estimated (False if the samples contain all the records, so the results are exact).
+            None if the samples are not up to date, or the estimate is not precise enough.
+        """
+        sample_files = dict()
+        thresholds = []
+        for name in [collection.name] + [query_filter.collection_name for query_filter in filters]:
+            sample_file = self._get_sample_file(self._collections[name])
+            counters = self._get_counters_file(self._collections[name]).read_counters()
+            if counters is None or len(sample_file.view()) != min(counters.records, sample_file.max_records):
+                log.info(f"The sample of {name} is not up to date, counting exactly.")
+                return None
+            if name == collection.name:
+                population = counters.records
+            sample_files[name] = sample_file
+            thresholds.append(sample_file.threshold())
+
+        if population == 0:
+            return None
+
+        # only the records with the hashes up to the threshold are in all the samples
+        thresholds = [threshold for threshold in thresholds if threshold is not None]
+        threshold = min(thresholds) if thresholds else None
+
+        pks = None
+        for query_filter in filters:
+            sample_file = sample_files[query_filter.collection_name]
+            choices_name = self._collections[query_filter.collection_name].choices_name
+            choice = self._choices[choices_name].dict_values[query_filter.choice]
+            selected_pks = sample_file.select_pks(sample_file.read_records(threshold), choice, query_filter.yes)
+            pks = selected_pks if pks is None else np.intersect1d(pks, selected_pks, assume_unique=True)
+
+        sample_file = sample_files[collection.name]
+        records = sample_file.read_records(threshold)
+        choices = self._get_choices(collection)
+        counter, counts = sample_file.count_records(records, len(choices), pk_range, pks)
+
+        if threshold is None:
+            # the samples contain all the records
+            result = sorted(
+                [AggregatedAnswer(choices[index], int(count)) for index, count in enumerate(counts)],
+                key=lambda x: (x.count, x.value),
+                reverse=sorting == Sorting.DESC,
+            )
+            return counter, result, False
+
+        sampled = len(records)
+        proportions = np.append(counts, counter) / sampled
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        correction = (population - sampled) / max(population - 1, 1)
+        denominator = 1 + z ** 2 / sampled
+        center = (proportions + z ** 2 / (2 * sampled)) / denominator
+        variance = correction * proportions * (1 - proportions) / sampled + z ** 2 / (4 * sampled ** 2)
+        half_width = z * np.sqrt(variance) / denominator
+        if half_width.max() > max_error:
+            log.info(f"The estimate for {collection.name} is not precise enough, counting exactly.")
+            return None
+
+        low = np.floor(np.maximum(center - half_width, 0) * population).astype(np.int64)
+        high = np.ceil(np.minimum(center + half_width, 1) * population).astype(np.int64)
+        estimates = np.rint(proportions * population).astype(np.int64)
+
+        result = sorted(
+            [
+                AggregatedAnswer(choices[index], int(estimates[index]), (int(low[index]), int(high[index])))
+                for index in range(len(choices))
+            ],
+            key=lambda x: (x.count, x.value),
+            reverse=sorting == Sorting.DESC,
+        )
+        # the order of the returned results has to be known, also against the first one not returned
+        end = limit + 1
+        for first, second in zip(result, result[1:end]):
+            if sorting == Sorting.DESC:
+                overlap = first.interval[0] <= second.interval[1]
+            else:
+                overlap = first.interval[1] >= second.interval[0]
+            if overlap:
+                log.info(f"The top results for {collection.name} are too close, counting exactly.")
+                return None
+
+        return int(estimates[-1]), result, True
+
+    def count(
+        self,
+        collection_name: str,
+        limit: int = 10,
+        sorting: Sorting = Sorting.DESC,
+        pk_range: Optional[Tuple[int, int]] = None,
+        filters: Optional[List[Filter]] = None,
+        approx: bool = False,
+        max_error: float = 0.01,
+        confidence: float = 0.95,
+    ) -> SearchAnswer:
+        """Counts the choices for the collection.
+
+        In case of a multi choice collection, we count the answers where user chose "yes".
+
+        All results are sorted by the count number (depending on the `sorting` argument).
+        The results then are limited to the number of the `limit` argument.
+
+        The filters select the people by their answers in other collections (or in the same one),
+        e.g. to count the favourite singers of the people who own a BMW. The pks matching each of the filters
+        are intersected, and only the answers with these pks are counted.
+
+        The results are cached until the next change of the data of the collection, or of the filter collections.
+
+        With `approx`, the answers with the `pk_range` or the `filters` are estimated from the samples
+        of the collections (see `_approximate_count()`). When the estimate is not precise enough,
+        the answer is counted exactly. Without the `pk_range` and the `filters`, the exact answer
+        is read from the counters, which is as fast as the estimate.
+
+        Args:
+            collection_name: Name of the collection to count the data for.
+            limit: Number of values to return.
+            sorting: Sorting direction of the results.
+            pk_range: If set, only the answers with pk in the range (inclusive) are counted.
+            filters: If set, only the answers of the people matching all the filters are counted.
+            approx: If True, then the answer can be estimated from the samples of the records.
+            max_error: Maximal half-width of the confidence intervals of the estimate,
+                       as a fraction of all the records.
+            confidence: Confidence level of the intervals of the estimate.
+
+        Returns:
+            List of values with the count number.
+        """
+
+        start_time = time.time()
+
+        # the manifest could have been changed by a compaction in another process (and the config file by appending
+        # the choices), it's read before the collection, so the choices match the sizes of the files
+        self._refresh_manifest()
+
+        collection = self._collections.get(collection_name)
+        if collection is None:
+            raise ValueError("Bad collection name.")
+
+        filters = filters or []
+        for query_filter in filters:
+            self._validate_filter(query_filter)
+
+        choices = self._get_choices(collection)
+
+        # the versions are read before the data, so the results of a write done in the meantime are not cached,
+        # the appended choices are in the results before the collection files are converted, so they're also used
+        version = [
+            self._get_version_file(self._collections[name]).read_version()
+            for name in [collection_name] + [query_filter.collection_name for query_filter in filters]
+        ] + [len(choices)]
+        filters_key = [
+            [query_filter.collection_name, query_filter.choice, query_filter.yes] for query_filter in filters
+        ]
+        cache_key = json.dumps([collection_name, limit, sorting.value, pk_range, filters_key])
+        cached = self._cache.get(cache_key, version)
+        if cached is not None:
+            results = [AggregatedAnswer(value, count) for value, count in cached["results"]]
+            return SearchAnswer(results=results, time=time.time() - start_time, data_size=cached["data_size"])
+
+        if approx and (pk_range is not None or filters):
+            estimate = self._approximate_count(collection, limit, sorting, pk_range, filters, max_error, confidence)
+            if estimate is not None:
+                counter, result, approximate = estimate
+                return SearchAnswer(
+                    results=result[:limit], time=time.time() - start_time, data_size=counter, approximate=approximate
+                )
+
+        # without the pk range and the filters, the answer is just the counters updated with each write
+        counters = self._get_counters_file(collection).read_counters() if pk_range is None and not filters else None
+        if counters is not None:
+            counter, counts = counters.records, counters.yes
+        else:
+            pks = self._filter_pks(filters) if filters else None
+            counter, counts = self._scan_data_files(collection, pk_range, pks)
+
+        # we need to translate the indices into the values:
+        result = {choices[index]: int(count) for index, count in enumerate(counts)}
+
+        # and sort it
+        result = sorted(result.items(), key=lambda x: (x[1], x[0]), reverse=sorting == Sorting.DESC)
+
+        # and convert to the result objects
+        result = [AggregatedAnswer(name, value) for name, value in result]
+
+        # and limit the number of answers
+        result = result[:limit]
+
+        cached = {"results": [[answer.value, answer.count] for answer in result], "data_size": counter}
+        self._cache.put(cache_key, version, cached)
+
+        elapsed_time = time.time() - start_time
+
+        return SearchAnswer(results=result, time=elapsed_time, data_size=counter)
+
+    def count_many(self, queries: List[CountQuery], max_workers: Optional[int] = None) -> List[SearchAnswer]:
+        """Runs many counts at once, each one in a separate thread.
+
+        The scans of the data files spend most of the time in numpy and in reading the memory-mapped files,
+        which don't hold the GIL, so the whole call takes about the time of the slowest count.
+
+        Args:
+            queries: Arguments of the counts.
+            max_workers: Maximal number of the threads, by default one per query (limited by the number of cores).
+
+        Returns:
+            Answers in the order of the queries.
+
+        Raises:
+            ValueError: if there is a bad collection name or filter in any of the queries, then no count is run.
+        """
+        for query in queries:
+            if query.collection_name not in self._collections:
+                raise ValueError(f"Bad collection name: {query.collection_name}.")
+            for query_filter in query.filters:
+                self._validate_filter(query_filter)
+        if not queries:
+            return []
+
+        if max_workers is None:
+            max_workers = min(len(queries), os.cpu_count() or 1)
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="count") as executor:
+            futures = [
+                executor.submit(
+                    self.count,
+                    query.collection_name,
+                    query.limit,
+                    query.sorting,
+                    query.pk_range,
+                    query.filters,
+                    query.approx,
+                    query.max_error,
+                    query.confidence,
+                )
+                for query in queries
+            ]
+            return [future.result() for future in futures]
+
+    def _get_cooccurrence_file(self, collection_a: Collection, collection_b: Collection) -> CooccurrenceDataFile:
+        """Creates the co-occurrence file object for the pair of collections.
+
+        Examples:
+            For the collections `XXX` and `YYY` the file name is `XXX.YYY.cooc`.
+
+        Args:
+            collection_a: First collection.
+            collection_b: Second collection.
+
+        Returns:
+            Co-occurrence file object.
+        """
+        file_name = f"{collection_a.name}.{collection_b.name}.{FileType.COOCCURRENCE.value}"
+        return CooccurrenceDataFile(
+            os.path.join(self._directory, file_name),
+            len(self._get_choices(collection_a)),
+            len(self._get_choices(collection_b)),
+        )
+
+    def _read_yes_choices(
+        self,
+        collection: Collection,
+        segments: Segments,
+        tail_records: int,
+        start: Optional[int] = None,
+        removed: Optional[np.ndarray] = None,
+    ) -> Generator[Tuple[np.ndarray, np.ndarray], None, None]:
+        """Yields the pks and the "yes" answers of the records of the collection, in chunks.
+
+        Args:
+            collection: Collection to read the records of.
+            segments: Generations of the files to read.
+            tail_records: Number of the records of the tail files to read.
+            start: If set, only the records of the tail files from this position are read,
+                   the compacted files are skipped.
+            removed: If set, the records at the positions from the sorted array are skipped.
+
+        Yields:
+            Tuples with the array of pks, and the 2-D array with one row of bits (0 or 1) for each record.
+        """
+
+        size = len(self._get_choices(collection))
+
+        def skip_removed(chunks, position):
+            for pks, bits in chunks:
+                end = position + len(pks)
+                if removed is not None and len(removed):
+                    alive = ~DataFile._sorted_contains(removed, np.arange(position, end))
+                    pks, bits = pks[alive], bits[alive]
+                position = end
+                # the files written before the choices were appended have fewer bits
+                yield pks, np.pad(bits, ((0, 0), (0, size - bits.shape[1])))
+
+        *base_files, (_, tail_file) = self._get_segment_files(collection, segments)
+        if start is None:
+            for _, data_file in base_files:
+                yield from skip_removed(data_file.read_yes_choices(), 0)
+            start = 0
+        yield from skip_removed(tail_file.read_yes_choices(start, tail_records), segments.base_records + start)
+
+    def _read_stored_pks(self, collection: Collection, segments: Segments, tail_records: int) -> np.ndarray:
+        """Reads the pks of the collection stored before the position in the tail files.
+
+        Args:
+            collection: Collection to read the pks of.
+            segments: Generations of the files to read.
+            tail_records: Number of the records of the tail files to read.
+
+        Returns:
+            Array of the pks.
+        """
+        views = [ids_file.view() for ids_file, _ in self._get_segment_files(collection, segments)]
+        views[-1] = views[-1][:tail_records]
+        return np.concatenate(views).astype(np.int64)
+
+    @staticmethod
+    def _join_yes_choices(
+        chunks_a: Generator[Tuple[np.ndarray, np.ndarray], None, None],
+        chunks_b: Generator[Tuple[np.ndarray, np.ndarray], None, None],
+        size_a: int,
+        size_b: int,
+    ) -> Tuple[int, np.ndarray]:
+        """Counts the pairs of the "yes" answers of the records with the same pks.
+
+        The records of the second collection are kept packed in memory (one bit for each choice).
+        The records of the first collection are joined with them by pk in chunks, then the chunks of the bits
+        are multiplied as matrices: `(A^T @ B)[i][j]` is the number of records with both `i` and `j` chosen.
+        So there is no loop over the records nor over the pairs of the choices, it's all done by BLAS.
+
+        Args:
+            chunks_a: Pks and bits of the records of the first collection.
+            chunks_b: Pks and bits of the records of the second collection.
+            size_a: Number of choices of the first collection.
+            size_b: Number of choices of the second collection.
+
+        Returns:
+            A tuple with the number of the joined records, and the 2-D array of counts.
+        """
+        pks_b, packed_b = [np.zeros(0, dtype=np.int64)], [np.zeros((0, (size_b + 7) // 8), dtype=np.uint8)]
+        for pks, bits in chunks_b:
+            pks_b.append(pks)
+            packed_b.append(np.packbits(bits, axis=1))
+        pks_b, packed_b = np.concatenate(pks_b), np.concatenate(packed_b)
+
+        order = np.argsort(pks_b, kind="stable")
+        sorted_pks_b = pks_b[order]
+
+        records = 0
+        counts = np.zeros((size_a, size_b), dtype=np.int64)
+        if len(sorted_pks_b) == 0:
+            return records, counts
+
+        for pks, bits in chunks_a:
+            positions = np.minimum(np.searchsorted(sorted_pks_b, pks), len(sorted_pks_b) - 1)
+            matched = sorted_pks_b[positions] == pks
+            if not matched.any():
+                continue
+            bits_a = bits[matched].astype(np.float32)
+            bits_b = np.unpackbits(packed_b[order[positions[matched]]], axis=1)[:, :size_b].astype(np.float32)
+            # the chunks are smaller than 2^24 records, so the float32 counts are exact
+            counts += np.rint(bits_a.T @ bits_b).astype(np.int64)
+            records += int(matched.sum())
+
+        return records, counts
+
+    def cooccurrence(self, collection_a_name: str, collection_b_name: str) -> CooccurrenceAnswer:
+        """Counts how many people answered "yes" for each pair of the choices of two collections.
+
+        E.g. for `liked_cars` and `listened_singers` it answers how many people who like a car brand
+        listen to a singer. The same collection can be used twice.
+
+        The counts are stored in a file with the number of the counted records. The next call counts
+        only the appended records, if their pks are new for both collections (as when the same answers
+        are stored in all the collections). Otherwise, or after a compaction, all the records are counted again.
+        The database opened only for the queries doesn't store the counts.
+
+        Args:
+            collection_a_name: Name of the first collection, its choices are the rows of the counts.
+            collection_b_name: Name of the second collection, its choices are the columns of the counts.
+
+        Returns:
+            Counts of the pairs of the choices.
+        """
+        start_time = time.time()
+
+        # the manifest could have been changed by a compaction in another process
+        self._refresh_manifest()
+
+        collections = []
+        for name in [collection_a_name, collection_b_name]:
+            collection = self._collections.get(name)
+            if collection is None:
+                raise ValueError("Bad collection name.")
+            if not collection.multiple_answers:
+                raise ValueError(f"The co-occurrence is available only for multiple answers ({name}).")
+            collections.append(collection)
+        collection_a, collection_b = collections
+        size_a, size_b = len(self._get_choices(collection_a)), len(self._get_choices(collection_b))
+
+        segments_a, segments_b = self._segments[collection_a.name], self._segments[collection_b.name]
+        tails = (segments_a.tail, segments_b.tail)
+        tail_records = (self.tail_records(collection_a.name), self.tail_records(collection_b.name))
+        removed_a = self._get_tombstones_file(collection_a).positions()
+        removed_b = self._get_tombstones_file(collection_b).positions()
+        tombstones = (len(removed_a), len(removed_b))
+
+        cooccurrence_file = self._get_cooccurrence_file(collection_a, collection_b)
+        stored = cooccurrence_file.read_cooccurrence()
+
+        outdated = (
+            stored is None or stored.tails != tails or any(s > c for s, c in zip(stored.tail_records, tail_records))
+        )
+        if outdated or stored.tombstones != tombstones:
+            # the removed records are not subtracted from the stored counts, so everything is counted again
+            stored = None
+        elif stored.tail_records != tail_records:
+            # the counted pks are followed by the appended ones
+            pks_a = self._read_stored_pks(collection_a, segments_a, tail_records[0])
+            pks_b = self._read_stored_pks(collection_b, segments_b, tail_records[1])
+            old_a, new_a = np.split(pks_a, [len(pks_a) - tail_records[0] + stored.tail_records[0]])
+            old_b, new_b = np.split(pks_b, [len(pks_b) - tail_records[1] + stored.tail_records[1]])
+
+            if np.isin(new_a, old_b).any() or np.isin(new_b, old_a).any():
+                log.info(f"Counting again the co-occurrence of {collection_a.name} and {collection_b.name}.")
+                stored = None
+            else:
+                records, counts = self._join_yes_choices(
+                    self._read_yes_choices(collection_a, segments_a, tail_records[0], stored.tail_records[0]),
+                    self._read_yes_choices(collection_b, segments_b, tail_records[1], stored.tail_records[1]),
+                    size_a,
+                    size_b,
+                )
+                stored = Cooccurrence(
+                    tails=tails,
+                    tail_records=tail_records,
+                    tombstones=tombstones,
+                    records=stored.records + records,
+                    counts=stored.counts + counts,
+                )
+                if not self._read_only:
+                    cooccurrence_file.write_cooccurrence(stored)
+
+        if stored is None:
+            records, counts = self._join_yes_choices(
+                self._read_yes_choices(collection_a, segments_a, tail_records[0], removed=removed_a),
+                self._read_yes_choices(collection_b, segments_b, tail_records[1], removed=removed_b),
+                size_a,
+                size_b,
+            )
+            stored = Cooccurrence(
+                tails=tails, tail_records=tail_records, tombstones=tombstones, records=records, counts=counts
+            )
+            if not self._read_only:
+                cooccurrence_file.write_cooccurrence(stored)
+
+        return CooccurrenceAnswer(
+            choices_a=list(self._get_choices(collection_a)),
+            choices_b=list(self._get_choices(collection_b)),
+            counts=stored.counts,
+            time=time.time() - start_time,
+            data_size=stored.records,
+        )
@@ -1,14 +1,25 @@
 import logging
 import os.path
+import zlib
 from dataclasses import dataclass
+from itertools import chain, islice
 from typing import Any
 from typing import List
 from typing import Generator
-from bitarray import bitarray
+from typing import Optional
+from typing import Tuple
 from abc import ABC
 
+import numpy as np
+
+from .atomic import atomic_write
+from .bitmap import CONTAINER_SIZE, Container, ContainerType, RoaringBitmap
+
 log = logging.getLogger(__name__)
 
+# number of set bits for each byte value
+_POPCOUNT = np.array([bin(n).count("1") for n in range(256)], dtype=np.uint8)
+
 
 @dataclass
 class SingleValue:
@@ -38,6 +49,33 @@ class MultiValue:
     no_choices: List[int]
 
 
+@dataclass
+class Counters:
+    """Structure of data stored in the CountersDataFile.
+
+    Attributes:
+        records: Number of the counted records.
+        yes: Array of counts indexed by the choice, of the "yes" answers or of the chosen values.
+        no: Array of counts indexed by the choice, of the "no" answers.
+    """
+
+    records: int
+    yes: np.ndarray
+    no: np.ndarray
+
+    def __add__(self, other: "Counters") -> "Counters":
+        return Counters(records=self.records + other.records, yes=self.yes + other.yes, no=self.no + other.no)
+
+    def __sub__(self, other: "Counters") -> "Counters":
+        return Counters(records=self.records - other.records, yes=self.yes - other.yes, no=self.no - other.no)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Counters):
+            return NotImplemented
+        same_counts = np.array_equal(self.yes, other.yes) and np.array_equal(self.no, other.no)
+        return self.records == other.records and same_counts
+
+
 class DataFile(ABC):
     """Base class for data manipulation using different files formats.
 
@@ -47,22 +85,110 @@ class DataFile(ABC):
 
     Attributes:
         BYTEORDER: Order of the bytes used in the data files.
+        READ_CHUNK_SIZE: Number of records decoded at once when reading the values one by one.
         file_path: Path of the data file.
     """
 
     BYTEORDER = "big"
+    READ_CHUNK_SIZE = 65536
 
     def __init__(self, file_path: str):
         self.file_path = file_path
 
+    @property
+    def dtype(self) -> np.dtype:
+        """Numpy type describing one record stored in the data file."""
+        raise NotImplementedError
+
+    def view(self) -> np.ndarray:
+        """Returns a read-only view of all the records stored in the data file.
+
+        The file is memory-mapped, so there is no reading of the records one by one,
+        and no copying of the data. The records are read by the OS when they are accessed,
+        which means that repeated scans of the same file are served from the page cache.
+
+        An incomplete record at the end of the file is not a part of the view.
+
+        Returns:
+            Array of records with the `dtype` type, empty for a missing file.
+        """
+        if not os.path.exists(self.file_path):
+            return np.zeros(0, dtype=self.dtype)
+
+        records = os.path.getsize(self.file_path) // self.dtype.itemsize
+        if records == 0:
+            return np.zeros(0, dtype=self.dtype)
+
+        return np.memmap(self.file_path, dtype=self.dtype, mode="r", shape=(records,))
+
+    def _chunks(self) -> Generator[np.ndarray, None, None]:
+        """Yields the records from the `view()` in chunks of `READ_CHUNK_SIZE` records.
+
+        Yields:
+            Part of the memory-mapped view of the file.
+        """
+        data = self.view()
+        for start in range(0, len(data), self.READ_CHUNK_SIZE):
+            end = start + self.READ_CHUNK_SIZE
+            yield data[start:end]
+
     def write(self, value: Any) -> None:
         """Writes a value to the data file.
 
         Args:
             value: Value to store in the file.
         """
+        self.write_many([value])
+
+    def write_many(self, values: List[Any]) -> None:
+        """Writes the values to the data file.
+
+        The values are encoded into one buffer, which is appended to the file with one write.
+
+        Args:
+            values: Values to store in the file.
+        """
         raise NotImplementedError
 
+    def truncate(self, records: int) -> None:
+        """Removes all the records stored after the first `records` ones.
+
+        It's used for rolling back an interrupted write, so it also removes
+        any partially written data after the records.
+
+        Args:
+            records: Number of records to keep.
+        """
+        if not os.path.exists(self.file_path):
+            return
+
+        with open(self.file_path, "r+b") as f:
+            if os.fstat(f.fileno()).st_size > records * self.dtype.itemsize:
+                f.truncate(records * self.dtype.itemsize)
+
+    def sync(self) -> None:
+        """Makes sure all the written data is stored on disk."""
+        if not os.path.exists(self.file_path):
+            return
+
+        fd = os.open(self.file_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _append(self, data: bytes) -> None:
+        """Appends the bytes to the data file.
+
+        Args:
+            data: Bytes to append.
+        """
+        if not data:
+            return
+
+        with open(self.file_path, "ab") as f:
+            f.write(data)
+
     def read(self) -> Generator[Any, None, None]:
         """Yields a value from the data file.
 
@@ -71,16 +197,70 @@ class DataFile(ABC):
         """
         raise NotImplementedError
 
-    def _to_two_bytes(self, value: int) -> bytes:
-        """Converts the argument to two byte array representing the value.
+    def read_at(self, position: int) -> Optional[Any]:
+        """Reads the value stored at the position in the data file.
+
+        The values before the position are read one by one, the layouts which can find the record faster
+        override this method.
 
         Args:
-            value: value to convert
+            position: Position of the record, the same as the position of its pk in the ids file.
+
+        Returns:
+            The value, None if there is no record at the position.
+        """
+        return next(islice(self.read(), position, None), None)
+
+    @staticmethod
+    def _pk_range_mask(pks: np.ndarray, pk_range: Tuple[int, int]) -> np.ndarray:
+        """Checks which of the pks are in the range.
+
+        Args:
+            pks: Array of pks.
+            pk_range: The minimum and the maximum pk (inclusive).
+
+        Returns:
+            Array of booleans, one for each of the pks.
+        """
+        return (pks >= pk_range[0]) & (pks <= pk_range[1])
+
+    @classmethod
+    def _pk_mask(
+        cls, pks: np.ndarray, pk_range: Optional[Tuple[int, int]], selected_pks: Optional[np.ndarray]
+    ) -> np.ndarray:
+        """Checks which of the pks are in the range, and in the selected pks.
+
+        Args:
+            pks: Array of pks.
+            pk_range: The minimum and the maximum pk (inclusive), if None, then the range is not checked.
+            selected_pks: Sorted array of unique pks, if None, then all the pks are selected.
+
+        Returns:
+            Array of booleans, one for each of the pks.
+        """
+        mask = np.ones(len(pks), dtype=bool)
+        if pk_range is not None:
+            mask &= cls._pk_range_mask(pks, pk_range)
+        if selected_pks is not None:
+            mask &= cls._sorted_contains(selected_pks, pks)
+        return mask
+
+    @staticmethod
+    def _sorted_contains(sorted_pks: np.ndarray, pks: np.ndarray) -> np.ndarray:
+        """Checks which of the pks are in the sorted array, using binary search.
+
+        Args:
+            sorted_pks: Sorted array of unique pks.
+            pks: Array of pks to check.
 
         Returns:
-            Two byte array representing the value.
+            Array of booleans, one for each of the pks.
         """
-        return value.to_bytes(2, byteorder=self.BYTEORDER)
+        pks = np.asarray(pks, dtype=np.int64)
+        if len(sorted_pks) == 0:
+            return np.zeros(len(pks), dtype=bool)
+        positions = np.minimum(np.searchsorted(sorted_pks, pks), len(sorted_pks) - 1)
+        return sorted_pks[positions] == pks
 
     def _to_four_bytes(self, value: int) -> bytes:
         """Converts the argument to four byte array representing the value.
@@ -105,6 +285,99 @@ class DataFile(ABC):
         return int.from_bytes(value, byteorder=self.BYTEORDER)
 
 
+class UndoDataFile(DataFile):
+    """Base class for the data files which overwrite the last records in place, instead of only appending.
+
+    Before the file is overwritten from an offset, the previous content from the offset is stored
+    in the undo file (see `_save_undo()`). The undo file is removed by `sync()`, until then `truncate()`
+    of the subclass restores the previous content with `_restore_undo()`, so a write interrupted in the middle
+    of the overwritten records doesn't lose them.
+
+    Args:
+        file_path: Path of the data file.
+
+    Attributes:
+        UNDO_HEADER_SIZE: Size in bytes of the undo file header (offset 8B, length 8B, crc32 4B).
+        file_path: Path of the data file.
+        undo_file_path: Path of the file with the content overwritten by the last write.
+    """
+
+    UNDO_HEADER_SIZE = 20
+
+    def __init__(self, file_path: str):
+        super().__init__(file_path)
+        self.undo_file_path = f"{file_path}.undo"
+
+    def _read_undo(self) -> Optional[Tuple[int, bytes]]:
+        """Reads the undo file.
+
+        Returns:
+            Tuple with the offset and the stored content, None for a missing or incomplete undo file.
+        """
+        if not os.path.exists(self.undo_file_path):
+            return None
+
+        with open(self.undo_file_path, "rb") as f:
+            header = f.read(self.UNDO_HEADER_SIZE)
+            data = f.read()
+
+        if len(header) < self.UNDO_HEADER_SIZE:
+            return None
+        offset, length = self._from_bytes(header[:8]), self._from_bytes(header[8:16])
+        if length != len(data) or zlib.crc32(data) != self._from_bytes(header[16:]):
+            return None
+        return offset, data
+
+    def _save_undo(self, offset: int) -> None:
+        """Stores the content of the file from the offset in the undo file.
+
+        If there already is an undo file, it keeps the content from before the first of the not synchronized
+        writes. So only the content before its offset (not changed by the writes) is added to it.
+
+        Args:
+            offset: Offset of the first byte which is going to be overwritten.
+        """
+        undo = self._read_undo()
+        if undo is not None and undo[0] <= offset:
+            return
+
+        with open(self.file_path, "rb") as f:
+            f.seek(offset)
+            data = f.read() if undo is None else f.read(undo[0] - offset) + undo[1]
+
+        header = offset.to_bytes(8, self.BYTEORDER) + len(data).to_bytes(8, self.BYTEORDER)
+        with open(self.undo_file_path, "wb") as f:
+            f.write(header + zlib.crc32(data).to_bytes(4, self.BYTEORDER) + data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _restore_undo(self) -> None:
+        """Restores the content stored in the undo file, and removes the undo file.
+
+        An incomplete undo file is just removed, as the data file wasn't changed before the undo file was stored.
+        """
+        if not os.path.exists(self.undo_file_path):
+            return
+
+        undo = self._read_undo()
+        if undo is not None:
+            offset, data = undo
+            with open(self.file_path, "r+b") as f:
+                f.seek(offset)
+                f.write(data)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+
+        os.remove(self.undo_file_path)
+
+    def sync(self) -> None:
+        """Makes sure all the written data is stored on disk, and removes the undo file."""
+        super().sync()
+        if os.path.exists(self.undo_file_path):
+            os.remove(self.undo_file_path)
+
+
 class IdsDataFile(DataFile):
     """Class for reading and writing 4 byte integers one by one.
 
@@ -117,14 +390,18 @@ class IdsDataFile(DataFile):
         file_path: Path of the data file.
     """
 
-    def write(self, value: int) -> None:
-        """Writes a value to the data file.
+    @property
+    def dtype(self) -> np.dtype:
+        """Numpy type describing one record stored in the data file."""
+        return np.dtype(">u4")
+
+    def write_many(self, values: List[int]) -> None:
+        """Writes the values to the data file.
 
         Args:
-            value: Value to store in the file.
+            values: Values to store in the file.
         """
-        with open(self.file_path, "ab") as f:
-            f.write(self._to_four_bytes(value))
+        self._append(np.asarray(values, dtype=self.dtype).tobytes())
 
     def read(self) -> Generator[int, None, None]:
         """Yields a value from the data file.
@@ -132,144 +409,2509 @@ class IdsDataFile(DataFile):
         Yields:
             Value read from the file.
         """
+        for chunk in self._chunks():
+            yield from chunk.tolist()
+
+    def records_count(self) -> int:
+        """Returns the number of complete records stored in the file.
+
+        Returns:
+            Number of records, zero for a missing file.
+        """
         if not os.path.exists(self.file_path):
-            return
+            return 0
+        return os.path.getsize(self.file_path) // self.dtype.itemsize
 
-        with open(self.file_path, "rb") as f:
-            while True:
-                value = f.read(4)
-                if value:
-                    yield self._from_bytes(value)
-                else:
-                    break
 
+class PkIndexDataFile(DataFile):
+    """Class for reading and writing a sorted array of unique pks.
 
-class SingleValueDataFile(DataFile):
-    """Class for reading and writing SingleValue one by one.
+    The file starts with a header with the generation of the collection files the pks were read from (4B).
+    The pks are stored as little-endian 4 byte integers, so on most of the platforms the memory-mapped
+    file can be searched without converting it.
 
     Args:
-        BYTEORDER: Order of the bytes used in the data files.
         file_path: Path of the data file.
 
     Attributes:
-        BYTEORDER: Order of the bytes used in the data files.
+        HEADER_SIZE: Size in bytes of the file header.
         file_path: Path of the data file.
     """
 
-    def write(self, value: SingleValue) -> None:
-        """Writes a value to the data file.
+    HEADER_SIZE = 4
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Numpy type describing one record stored in the data file."""
+        return np.dtype("<u4")
+
+    def read_pks(self, generation: int) -> Optional[np.ndarray]:
+        """Returns a read-only view of the stored pks.
 
         Args:
-            value: Value to store in the file.
+            generation: Expected generation of the collection files.
+
+        Returns:
+            Sorted array of pks, None for a missing file or a file written for another generation.
         """
-        with open(self.file_path, "ab") as f:
-            f.write(self._to_four_bytes(value.pk))
-            f.write(self._to_two_bytes(value.value))
+        if not os.path.exists(self.file_path) or os.path.getsize(self.file_path) < self.HEADER_SIZE:
+            return None
 
-    def read(self) -> Generator[SingleValue, None, None]:
-        """Yields a value from the data file.
+        with open(self.file_path, "rb") as f:
+            if self._from_bytes(f.read(self.HEADER_SIZE)) != generation:
+                return None
 
-        Yields:
-            Value read from the file.
+        records = (os.path.getsize(self.file_path) - self.HEADER_SIZE) // self.dtype.itemsize
+        if records == 0:
+            return np.zeros(0, dtype=self.dtype)
+        return np.memmap(self.file_path, dtype=self.dtype, mode="r", offset=self.HEADER_SIZE, shape=(records,))
+
+    def write_pks(self, generation: int, pks: np.ndarray) -> None:
+        """Writes the pks, replacing the previous ones.
+
+        The file is replaced with `atomic_write()`.
+
+        Args:
+            generation: Generation of the collection files the pks were read from.
+            pks: Sorted array of unique pks.
         """
-        if not os.path.exists(self.file_path):
-            return
+        atomic_write(self.file_path, self._to_four_bytes(generation) + np.asarray(pks, dtype=self.dtype).tobytes())
+
+
+class OffsetIndexDataFile(DataFile):
+    """Class for reading and writing the positions of the records of a collection, sorted by their pks.
+
+    The file starts with a header with the generation of the collection files the positions were read from (4B),
+    and the number of the records of the collection which were indexed (4B).
+    Then there are records with the pk and the position of the record in the collection (little-endian 4B each),
+    so on most of the platforms the memory-mapped file can be searched without converting it.
+    A pk is stored only once, with the position of its last record.
+
+    Args:
+        file_path: Path of the data file.
+
+    Attributes:
+        HEADER_SIZE: Size in bytes of the file header.
+        file_path: Path of the data file.
+    """
+
+    HEADER_SIZE = 8
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Numpy type describing one record stored in the data file."""
+        return np.dtype([("pk", "<u4"), ("position", "<u4")])
+
+    def read_positions(self, generation: int) -> Optional[Tuple[int, np.ndarray]]:
+        """Returns a read-only view of the stored records.
+
+        Args:
+            generation: Expected generation of the collection files.
+
+        Returns:
+            A tuple with the number of the indexed records of the collection, and the array of records sorted by pk.
+            None for a missing file or a file written for another generation.
+        """
+        if not os.path.exists(self.file_path) or os.path.getsize(self.file_path) < self.HEADER_SIZE:
+            return None
 
         with open(self.file_path, "rb") as f:
-            while True:
-                pk = f.read(4)
-                value = f.read(2)
-                if pk and value:
-                    yield SingleValue(pk=self._from_bytes(pk), value=self._from_bytes(value))
-                else:
-                    break
+            header = f.read(self.HEADER_SIZE)
+        if self._from_bytes(header[:4]) != generation:
+            return None
+        indexed = self._from_bytes(header[4:])
 
+        records = (os.path.getsize(self.file_path) - self.HEADER_SIZE) // self.dtype.itemsize
+        if records == 0:
+            return indexed, np.zeros(0, dtype=self.dtype)
+        return (
+            indexed,
+            np.memmap(self.file_path, dtype=self.dtype, mode="r", offset=self.HEADER_SIZE, shape=(records,)),
+        )
 
-class MultiValueDataFile(DataFile):
-    """Class for reading and writing MultiValue one by one.
+    def write_positions(self, generation: int, indexed: int, records: np.ndarray) -> None:
+        """Writes the records, replacing the previous ones.
+
+        The file is replaced with `atomic_write()`.
+
+        Args:
+            generation: Generation of the collection files the positions were read from.
+            indexed: Number of the indexed records of the collection.
+            records: Array of records sorted by pk.
+        """
+        header = self._to_four_bytes(generation) + self._to_four_bytes(indexed)
+        atomic_write(self.file_path, header + np.asarray(records, dtype=self.dtype).tobytes())
+
+
+class CountersDataFile(DataFile):
+    """Class for reading and writing the Counters of a collection.
+
+    The file stores exactly one record, which is replaced as a whole with each write:
+
+        -----------------------------------------------
+        |    8B   |   choices * 8B  |  choices * 8B   |
+        | records |   yes counts    |   no counts     |
+        -----------------------------------------------
 
     Args:
         BYTEORDER: Order of the bytes used in the data files.
         file_path: Path of the data file.
-        size: Size in bits of the `yes` and `no` fields.
+        size: Number of choices.
 
     Attributes:
         BYTEORDER: Order of the bytes used in the data files.
         file_path: Path of the data file.
-        size: Size in bits of the `yes` and `no` fields.
-        size_in_bytes: Size in bytes of the `yes` and `no` fields.
+        size: Number of choices.
     """
 
     def __init__(self, file_path: str, size: int):
         super().__init__(file_path)
         self.size = size
 
-        self.size_in_bytes = size // 8
-        if size % 8 != 0:
-            self.size_in_bytes += 1
+    @property
+    def dtype(self) -> np.dtype:
+        """Numpy type describing one record stored in the data file."""
+        return np.dtype([("records", ">u8"), ("yes", ">u8", (self.size,)), ("no", ">u8", (self.size,))])
 
-    def write(self, value: MultiValue):
-        """Writes a value to the data file.
+    def read_counters(self) -> Optional[Counters]:
+        """Reads the counters.
+
+        Returns:
+            The stored counters, None for a missing file, or a file with another size.
+        """
+        if not os.path.exists(self.file_path) or os.path.getsize(self.file_path) != self.dtype.itemsize:
+            return None
+
+        record = np.fromfile(self.file_path, dtype=self.dtype)[0]
+        return Counters(
+            records=int(record["records"]), yes=record["yes"].astype(np.int64), no=record["no"].astype(np.int64)
+        )
+
+    def write_counters(self, counters: Counters) -> None:
+        """Writes the counters, the file is replaced with `atomic_write()`.
 
         Args:
-            value: Value to store in the file.
+            counters: Counters to store.
         """
-        yes_bits = bitarray(self.size, endian=self.BYTEORDER)
-        no_bits = bitarray(self.size, endian=self.BYTEORDER)
-        yes_bits.setall(0)
-        no_bits.setall(0)
+        record = np.zeros(1, dtype=self.dtype)
+        record["records"] = counters.records
+        record["yes"] = counters.yes
+        record["no"] = counters.no
 
-        for position in value.yes_choices:
-            yes_bits[position] = 1
+        atomic_write(self.file_path, record.tobytes())
 
-        for position in value.no_choices:
-            no_bits[position] = 1
 
-        with open(self.file_path, "ab") as f:
-            f.write(self._to_four_bytes(value.pk))
-            f.write(yes_bits.tobytes())
-            f.write(no_bits.tobytes())
+class RecordsDataFile(DataFile):
+    """Base class for the files with the records stored in the format of another data file.
+
+    Args:
+        file_path: Path of the data file.
+        records_file: Data file defining the format of the records (`SingleValueDataFile` or `MultiValueDataFile`).
+
+    Attributes:
+        file_path: Path of the data file.
+    """
+
+    def __init__(self, file_path: str, records_file: DataFile):
+        super().__init__(file_path)
+        self._records_file = records_file
+
+    def count_records(
+        self,
+        records: np.ndarray,
+        size: int,
+        pk_range: Optional[Tuple[int, int]] = None,
+        pks: Optional[np.ndarray] = None,
+    ) -> Tuple[int, np.ndarray]:
+        """Counts the records and the number of times each choice was chosen ("yes" for the multiple answers).
 
-    def _convert_bitarray_to_indices(self, value: bytes) -> List[int]:
-        """Converts the argument to list of set bits.
+        Args:
+            records: Array of records read from the file.
+            size: Number of possible choices.
+            pk_range: If set, only the records with pk in the range (inclusive) are counted.
+            pks: If set, only the records with pk in the sorted array are counted.
+
+        Returns:
+            A tuple with the number of records and an array of counts indexed by the choice.
+        """
+        if pk_range is not None or pks is not None:
+            records = records[self._pk_mask(records["pk"], pk_range, pks)]
+        if isinstance(self._records_file, MultiValueDataFile):
+            return len(records), self._records_file._count(records)
+        return len(records), SingleValueDataFile._count(records, size)
+
+    def select_pks(self, records: np.ndarray, choice: int, yes: bool = True) -> np.ndarray:
+        """Returns the pks of the records which have chosen the answer.
 
         Args:
-            value: Array of bytes.
+            records: Array of records read from the file.
+            choice: Index of the choice.
+            yes: For the multiple answers, if True, the records with "yes" answer are selected,
+                 otherwise the records with "no" answer.
 
         Returns:
-            A sorted list of integers containing numbers of positions
-            with set bits in the value.
+            Sorted array of the pks.
         """
-        res = []
-        bits = bitarray(endian=self.BYTEORDER)
-        bits.frombytes(value)
+        if isinstance(self._records_file, MultiValueDataFile):
+            selected = self._records_file._select(records, choice, yes)
+        else:
+            selected = records["value"] == choice
+        return np.sort(records["pk"][selected].astype(np.int64))
 
-        for n in range(0, self.size):
-            if bits[n]:
-                res.append(n)
+    def decode(self, records: np.ndarray) -> List[Any]:
+        """Converts the records read from the file to the values.
 
-        return res
+        Args:
+            records: Array of records read from the file.
 
-    def read(self) -> Generator[MultiValue, None, None]:
-        """Yields a value from the data file.
+        Returns:
+            List of the values.
+        """
+        return list(self._records_file._decode(records))
 
-        Yields:
-            Value read from the file.
+
+class SampleDataFile(RecordsDataFile):
+    """Class for reading and writing a sample of the records of a collection.
+
+    The sample contains the records with the `max_records` smallest hashes of their pks (a bottom-k sample).
+    The hash mixes the bits of the pk, so the sample is a uniform random sample of the records.
+    As the same pk has the same hash in all the collections, the samples of different collections
+    contain the answers of the same people, so they can be joined by pk.
+
+    The records are stored in the format of the `records_file` (`SingleValueDataFile` or `MultiValueDataFile`).
+    Until the sample is full, the new records are appended, then the records with the largest hashes
+    are overwritten in place with the new records with smaller hashes.
+
+    Args:
+        file_path: Path of the data file.
+        records_file: Data file defining the format of the records.
+        max_records: Maximum number of the records in the sample.
+
+    Attributes:
+        file_path: Path of the data file.
+        max_records: Maximum number of the records in the sample.
+    """
+
+    def __init__(self, file_path: str, records_file: DataFile, max_records: int):
+        super().__init__(file_path, records_file)
+        self.max_records = max_records
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Numpy type describing one record stored in the data file."""
+        return self._records_file.dtype
+
+    @staticmethod
+    def pk_hash(pks: np.ndarray) -> np.ndarray:
+        """Calculates the hashes of the pks, with the finalizer of the splitmix64 generator.
+
+        The pks are multiplied by the golden ratio constant first, without it the hashes
+        of the small sequential pks are not uniform enough (e.g. too many multiples of 10 have small hashes).
+
+        Args:
+            pks: Array of pks.
+
+        Returns:
+            Array of the hashes.
         """
-        if not os.path.exists(self.file_path):
+        x = np.asarray(pks, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            x = x * np.uint64(0x9E3779B97F4A7C15)
+            x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+    def threshold(self) -> Optional[int]:
+        """Returns the largest hash in the full sample.
+
+        Returns:
+            The largest hash, None if the sample is not full, so it contains all the records.
+        """
+        records = self.view()
+        if len(records) < self.max_records:
+            return None
+        return int(self.pk_hash(records["pk"]).max())
+
+    def read_records(self, threshold: Optional[int] = None) -> np.ndarray:
+        """Reads the records of the sample.
+
+        Args:
+            threshold: If set, only the records with the hash of the pk up to the threshold (inclusive) are read.
+
+        Returns:
+            Array of records with the `dtype` type.
+        """
+        records = np.array(self.view())
+        if threshold is not None:
+            records = records[self.pk_hash(records["pk"]) <= np.uint64(threshold)]
+        return records
+
+    def write_many(self, values: List[Any]) -> None:
+        """Adds the values to the sample, the values which are already in the sample are skipped.
+
+        Args:
+            values: Values to add.
+        """
+        records = np.array(self.view())
+        if len(records) >= self.max_records and values:
+            # only the values with smaller hashes than the largest one in the full sample can be added to it
+            threshold = self.pk_hash(records["pk"]).max()
+            smaller = self.pk_hash(np.array([value.pk for value in values])) < threshold
+            values = [value for value, is_smaller in zip(values, smaller.tolist()) if is_smaller]
+        new_records = self._records_file._encode(values)
+        new_records = new_records[~np.isin(new_records["pk"], records["pk"])]
+        if not len(new_records):
             return
 
-        with open(self.file_path, "rb") as f:
-            while True:
-                pk = f.read(4)
-                yes_value = f.read(self.size_in_bytes)
-                no_value = f.read(self.size_in_bytes)
-
-                if pk and yes_value and no_value:
-                    yield MultiValue(
-                        pk=self._from_bytes(pk),
-                        yes_choices=self._convert_bitarray_to_indices(yes_value),
-                        no_choices=self._convert_bitarray_to_indices(no_value),
-                    )
-                else:
-                    break
+        free = self.max_records - len(records)
+        if free > 0:
+            appended, new_records = new_records[:free], new_records[free:]
+            self._append(appended.tobytes())
+            records = np.concatenate([records, appended])
+        if not len(new_records):
+            return
+
+        # the records with the smallest hashes of both the sample and the new records are kept
+        hashes = self.pk_hash(np.concatenate([records["pk"], new_records["pk"]]))
+        kept = np.zeros(len(hashes), dtype=bool)
+        kept[np.argsort(hashes, kind="stable")[: self.max_records]] = True
+        kept_records, kept_new_records = np.split(kept, [len(records)])
+        removed = np.flatnonzero(~kept_records)
+        added = new_records[kept_new_records]
+        if not len(added):
+            return
+
+        data = np.memmap(self.file_path, dtype=self.dtype, mode="r+", shape=(len(records),))
+        data[removed] = added
+        data.flush()
+        del data
+
+    def remove_many(self, pks: List[int]) -> None:
+        """Removes the records with the pks from the sample.
+
+        The kept records replace the file with `atomic_write()`.
+
+        Args:
+            pks: Pks of the records to remove.
+        """
+        if not pks:
+            return
+        records = np.array(self.view())
+        removed = np.isin(records["pk"], pks)
+        if not removed.any():
+            return
+
+        atomic_write(self.file_path, records[~removed].tobytes())
+
+    def replace_all(self, values: List[Any]) -> None:
+        """Replaces all the records of the sample with the values, e.g. with the records of another format.
+
+        The file is replaced with `atomic_write()`.
+
+        Args:
+            values: Values of the sample, at most `max_records` of them.
+        """
+        atomic_write(self.file_path, self._records_file._encode(values).tobytes())
+
+
+class TombstonesDataFile(RecordsDataFile):
+    """Class for reading and writing the removed (updated or deleted) records of a collection.
+
+    A removed record stays in the data files, and it's also appended to this file, together with
+    its position in the collection (the same as the position of its pk in the ids files):
+
+        ----------------------------------------------
+        |    4B    |             varies              |
+        | position | record in `records_file` format |
+        ----------------------------------------------
+
+    The counts of the data files are corrected by subtracting the counts of the removed records,
+    so an update doesn't rewrite the large compacted files. The compaction drops the removed records.
+
+    Args:
+        file_path: Path of the data file.
+        records_file: Data file defining the format of the records.
+
+    Attributes:
+        file_path: Path of the data file.
+    """
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Numpy type describing one record stored in the data file."""
+        return np.dtype([("position", ">u4"), ("record", self._records_file.dtype)])
+
+    def write_many(self, values: List[Tuple[int, Any]]) -> None:
+        """Writes the removed values to the data file.
+
+        Args:
+            values: Tuples with the position of the removed record, and its value.
+        """
+        if not values:
+            return
+        data = np.zeros(len(values), dtype=self.dtype)
+        data["position"] = [position for position, _ in values]
+        data["record"] = self._records_file._encode([value for _, value in values])
+        self._append(data.tobytes())
+
+    def read(self) -> Generator[Tuple[int, Any], None, None]:
+        """Yields a removed value from the data file.
+
+        Yields:
+            Tuples with the position of the removed record, and its value.
+        """
+        data = self.view()
+        yield from zip(data["position"].tolist(), self._records_file._decode(data["record"]))
+
+    def records_count(self) -> int:
+        """Returns the number of the removed records.
+
+        Returns:
+            Number of records, zero for a missing file.
+        """
+        return len(self.view())
+
+    def positions(self) -> np.ndarray:
+        """Returns the positions of the removed records.
+
+        Returns:
+            Sorted array of the positions.
+        """
+        return np.sort(self.view()["position"].astype(np.int64))
+
+    def records(self) -> np.ndarray:
+        """Returns the removed records.
+
+        Returns:
+            Array of records in the `records_file` format.
+        """
+        return np.array(self.view()["record"])
+
+
+class VersionDataFile(DataFile):
+    """Class for reading and writing the version of the data of a collection.
+
+    The version is increased after each change of the stored answers, so the results computed
+    for an older version can be recognized as outdated. The file stores exactly one 8 byte number.
+
+    Args:
+        file_path: Path of the data file.
+
+    Attributes:
+        file_path: Path of the data file.
+    """
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Numpy type describing one record stored in the data file."""
+        return np.dtype(">u8")
+
+    def read_version(self) -> int:
+        """Reads the version.
+
+        Returns:
+            The stored version, 0 for a missing or an incomplete file.
+        """
+        if not os.path.exists(self.file_path) or os.path.getsize(self.file_path) != self.dtype.itemsize:
+            return 0
+
+        with open(self.file_path, "rb") as f:
+            return self._from_bytes(f.read())
+
+    def write_version(self, version: int) -> None:
+        """Writes the version, the file is replaced with `atomic_write()`.
+
+        Args:
+            version: Version to store.
+        """
+        atomic_write(self.file_path, version.to_bytes(self.dtype.itemsize, self.BYTEORDER))
+
+
+@dataclass
+class Cooccurrence:
+    """Structure of data stored in the CooccurrenceDataFile.
+
+    Attributes:
+        tails: Generations of the tail files of both collections, when the counts were calculated.
+        tail_records: Numbers of the counted records of the tail files of both collections.
+        tombstones: Numbers of the removed records of both collections, when the counts were calculated.
+        records: Number of the counted pks stored in both collections.
+        counts: 2-D array of counts, indexed by the choice of the first and the second collection.
+    """
+
+    tails: Tuple[int, int]
+    tail_records: Tuple[int, int]
+    tombstones: Tuple[int, int]
+    records: int
+    counts: np.ndarray
+
+
+class CooccurrenceDataFile(DataFile):
+    """Class for reading and writing the co-occurrence counts of the choices of two collections.
+
+    The file stores exactly one record, which is replaced as a whole with each write:
+
+        ------------------------------------------------------------------------------
+        |  2 * 8B  |    2 * 8B    |   2 * 8B   |    8B   |    size_a * size_b * 8B    |
+        |  tails   | tail records | tombstones | records |           counts           |
+        ------------------------------------------------------------------------------
+
+    Args:
+        file_path: Path of the data file.
+        size_a: Number of choices of the first collection.
+        size_b: Number of choices of the second collection.
+
+    Attributes:
+        file_path: Path of the data file.
+        size_a: Number of choices of the first collection.
+        size_b: Number of choices of the second collection.
+    """
+
+    def __init__(self, file_path: str, size_a: int, size_b: int):
+        super().__init__(file_path)
+        self.size_a = size_a
+        self.size_b = size_b
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Numpy type describing one record stored in the data file."""
+        return np.dtype(
+            [
+                ("tails", ">u8", (2,)),
+                ("tail_records", ">u8", (2,)),
+                ("tombstones", ">u8", (2,)),
+                ("records", ">u8"),
+                ("counts", ">u8", (self.size_a, self.size_b)),
+            ]
+        )
+
+    def read_cooccurrence(self) -> Optional[Cooccurrence]:
+        """Reads the counts.
+
+        Returns:
+            The stored counts, None for a missing file, or a file with another size.
+        """
+        if not os.path.exists(self.file_path) or os.path.getsize(self.file_path) != self.dtype.itemsize:
+            return None
+
+        record = np.fromfile(self.file_path, dtype=self.dtype)[0]
+        return Cooccurrence(
+            tails=tuple(record["tails"].tolist()),
+            tail_records=tuple(record["tail_records"].tolist()),
+            tombstones=tuple(record["tombstones"].tolist()),
+            records=int(record["records"]),
+            counts=record["counts"].astype(np.int64),
+        )
+
+    def write_cooccurrence(self, cooccurrence: Cooccurrence) -> None:
+        """Writes the counts, the file is replaced with `atomic_write()`.
+
+        Args:
+            cooccurrence: Counts to store.
+        """
+        record = np.zeros(1, dtype=self.dtype)
+        record["tails"] = cooccurrence.tails
+        record["tail_records"] = cooccurrence.tail_records
+        record["tombstones"] = cooccurrence.tombstones
+        record["records"] = cooccurrence.records
+        record["counts"] = cooccurrence.counts
+
+        atomic_write(self.file_path, record.tobytes())
+
+
+class SingleValueDataFile(DataFile):
+    """Class for reading and writing SingleValue one by one.
+
+    Args:
+        BYTEORDER: Order of the bytes used in the data files.
+        file_path: Path of the data file.
+
+    Attributes:
+        BYTEORDER: Order of the bytes used in the data files.
+        file_path: Path of the data file.
+    """
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Numpy type describing one record stored in the data file."""
+        return np.dtype([("pk", ">u4"), ("value", ">u2")])
+
+    def _encode(self, values: List[SingleValue]) -> np.ndarray:
+        """Converts the values to the records stored in the file.
+
+        Args:
+            values: Values to convert.
+
+        Returns:
+            Array of records with the `dtype` type.
+        """
+        data = np.zeros(len(values), dtype=self.dtype)
+        data["pk"] = [value.pk for value in values]
+        data["value"] = [value.value for value in values]
+        return data
+
+    def _decode(self, records: np.ndarray) -> Generator[SingleValue, None, None]:
+        """Converts the records stored in the file to the values.
+
+        Args:
+            records: Array of records with the `dtype` type.
+
+        Yields:
+            Values stored in the records.
+        """
+        for pk, value in zip(records["pk"].tolist(), records["value"].tolist()):
+            yield SingleValue(pk=pk, value=value)
+
+    @staticmethod
+    def _count(records: np.ndarray, size: int) -> np.ndarray:
+        """Counts the number of times each value was chosen in the records.
+
+        Args:
+            records: Array of records with the `dtype` type.
+            size: Number of possible values.
+
+        Returns:
+            Array of counts indexed by the value.
+        """
+        return np.bincount(records["value"], minlength=size).astype(np.int64)
+
+    def write_many(self, values: List[SingleValue]) -> None:
+        """Writes the values to the data file.
+
+        Args:
+            values: Values to store in the file.
+        """
+        self._append(self._encode(values).tobytes())
+
+    def read(self) -> Generator[SingleValue, None, None]:
+        """Yields a value from the data file.
+
+        Yields:
+            Value read from the file.
+        """
+        for chunk in self._chunks():
+            yield from self._decode(chunk)
+
+    def read_at(self, position: int) -> Optional[SingleValue]:
+        """Reads the value stored at the position in the data file.
+
+        Args:
+            position: Position of the record.
+
+        Returns:
+            The value, None if there is no record at the position.
+        """
+        end = position + 1
+        return next(self._decode(self.view()[position:end]), None)
+
+    def count_values(
+        self, size: int, pk_range: Optional[Tuple[int, int]] = None, pks: Optional[np.ndarray] = None
+    ) -> Tuple[int, np.ndarray]:
+        """Counts the records and the number of times each value was chosen.
+
+        Args:
+            size: Number of possible values.
+            pk_range: If set, only the records with pk in the range (inclusive) are counted.
+            pks: If set, only the records with pk in the sorted array are counted.
+
+        Returns:
+            A tuple with the number of records and an array of counts indexed by the value.
+        """
+        data = self.view()
+        if pk_range is not None or pks is not None:
+            data = data[self._pk_mask(data["pk"], pk_range, pks)]
+        return len(data), self._count(data, size)
+
+    def select_pks(self, value: int) -> np.ndarray:
+        """Returns the pks of the records which have chosen the value.
+
+        Args:
+            value: Index of the value.
+
+        Returns:
+            Array of the pks.
+        """
+        selected = [np.zeros(0, dtype=np.int64)]
+        for chunk in self._chunks():
+            selected.append(chunk["pk"][chunk["value"] == value].astype(np.int64))
+        return np.concatenate(selected)
+
+
+class SingleValuePackedDataFile(UndoDataFile):
+    """Class for reading and writing SingleValue in a compact format.
+
+    The file starts with a header describing the format of the records:
+
+        -------------------------------------------------
+        |   4B   |    2B   |      1B      |      1B     |
+        | magic  | version | value bits   | pk encoding |
+        -------------------------------------------------
+
+    The values are stored with the narrowest width for the number of choices (e.g. 9 bits for 271 choices),
+    and the pks are stored as differences from the previous pk, encoded as zigzag varints.
+    For mostly sequential pks, it's one byte per pk.
+
+    Then there are chunks of up to `MAX_CHUNK_RECORDS` records:
+
+        ---------------------------------------------------------
+        |   4B    |    4B    |       varies      |    varies    |
+        | records | pks size |  values (packed)  |  pks (delta) |
+        ---------------------------------------------------------
+
+    The values are stored before the pks, so counting all the values doesn't read the pks at all.
+    The width stored in the header is used for reading, so the files stay readable when the number of choices changes.
+
+    A write appends a new chunk, and merges it with the last chunks which are not full, like the roaring file
+    (see `write_many()`). So a file has only a few chunks which are not full, and the reads decode a few large
+    chunks instead of one small chunk for each write. The merged chunks are overwritten in place, so their
+    previous content is stored in the undo file first (see `UndoDataFile`).
+
+    Args:
+        BYTEORDER: Order of the bytes used in the data files.
+        file_path: Path of the data file.
+        size: Number of choices.
+
+    Attributes:
+        BYTEORDER: Order of the bytes used in the data files.
+        MAGIC: Bytes identifying the file format.
+        VERSION: Version of the file format written by this class.
+        PK_DELTA_VARINT: Pk encoding with zigzag varint deltas.
+        HEADER_SIZE: Size in bytes of the file header.
+        CHUNK_HEADER_SIZE: Size in bytes of the chunk header.
+        MAX_CHUNK_RECORDS: Maximum number of records in one chunk.
+        file_path: Path of the data file.
+        undo_file_path: Path of the file with the content overwritten by the last write.
+        size: Number of choices.
+    """
+
+    MAGIC = b"CRSV"
+    VERSION = 1
+    PK_DELTA_VARINT = 1
+    HEADER_SIZE = 8
+    CHUNK_HEADER_SIZE = 8
+    MAX_CHUNK_RECORDS = 65536
+
+    def __init__(self, file_path: str, size: int):
+        super().__init__(file_path)
+        self.size = size
+        # width of the values, read from the file header
+        self._bits = self.value_bits(size)
+
+    @staticmethod
+    def value_bits(size: int) -> int:
+        """Returns the number of bits needed for storing the values.
+
+        Args:
+            size: Number of choices.
+
+        Returns:
+            Number of bits, at least one.
+        """
+        return max(1, (size - 1).bit_length())
+
+    def _make_header(self) -> bytes:
+        """Creates the file header for the current number of choices.
+
+        Returns:
+            Bytes of the header.
+        """
+        version = self.VERSION.to_bytes(2, self.BYTEORDER)
+        return self.MAGIC + version + bytes([self.value_bits(self.size), self.PK_DELTA_VARINT])
+
+    def _read_header(self, data: np.ndarray) -> int:
+        """Checks the file header.
+
+        Args:
+            data: Content of the file.
+
+        Returns:
+            Number of bits of the stored values.
+
+        Raises:
+            ValueError: if the file has a different format.
+        """
+        header = data[: self.HEADER_SIZE].tobytes()
+        if header[:4] != self.MAGIC:
+            raise ValueError(f"The file {self.file_path} is not a packed data file.")
+
+        version = self._from_bytes(header[4:6])
+        pk_encoding = header[7]
+        if version > self.VERSION or pk_encoding != self.PK_DELTA_VARINT:
+            raise ValueError(f"Unsupported format of {self.file_path}: version={version}, pk encoding={pk_encoding}.")
+
+        return header[6]
+
+    def _data(self) -> np.ndarray:
+        """Returns a read-only memory-mapped view of the file bytes.
+
+        Returns:
+            Array of bytes, empty for a missing file or a file without the complete header.
+        """
+        if not os.path.exists(self.file_path) or os.path.getsize(self.file_path) < self.HEADER_SIZE:
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(self.file_path, dtype=np.uint8, mode="r")
+
+    def _chunk_headers(self, data: np.ndarray) -> Generator[Tuple[int, int, int], None, None]:
+        """Yields the headers of all the complete chunks.
+
+        Args:
+            data: Content of the file.
+
+        Yields:
+            Tuples with the offset of the chunk, the number of records, and the size of the pks in bytes.
+        """
+        offset = self.HEADER_SIZE
+        while offset + self.CHUNK_HEADER_SIZE <= len(data):
+            end = offset + self.CHUNK_HEADER_SIZE
+            header = data[offset:end].tobytes()
+            records, pks_size = self._from_bytes(header[:4]), self._from_bytes(header[4:])
+            chunk_end = end + self._values_size(records, self._bits) + pks_size
+            if chunk_end > len(data):
+                # this can be only a torn write
+                return
+            yield offset, records, pks_size
+            offset = chunk_end
+
+    @staticmethod
+    def _values_size(records: int, bits: int) -> int:
+        """Returns the size in bytes of the packed values.
+
+        Args:
+            records: Number of values.
+            bits: Number of bits of one value.
+
+        Returns:
+            Number of bytes.
+        """
+        return (records * bits + 7) // 8
+
+    @staticmethod
+    def _pack_values(values: np.ndarray, bits: int) -> bytes:
+        """Packs the values using `bits` bits for each one.
+
+        Args:
+            values: Array of values.
+            bits: Number of bits of one value.
+
+        Returns:
+            Bytes with the packed values.
+        """
+        shifts = np.arange(bits - 1, -1, -1, dtype=np.uint32)
+        value_bits = (np.asarray(values, dtype=np.uint32)[:, np.newaxis] >> shifts) & 1
+        return np.packbits(value_bits.astype(np.uint8).ravel()).tobytes()
+
+    @staticmethod
+    def _unpack_values(data: np.ndarray, records: int, bits: int) -> np.ndarray:
+        """Unpacks the values packed with `_pack_values()`.
+
+        Args:
+            data: Array of bytes with the packed values.
+            records: Number of values.
+            bits: Number of bits of one value.
+
+        Returns:
+            Array of the values.
+        """
+        value_bits = np.unpackbits(data)[: records * bits].reshape(records, bits)
+        weights = 1 << np.arange(bits - 1, -1, -1, dtype=np.int64)
+        return value_bits.astype(np.int64) @ weights
+
+    @staticmethod
+    def _encode_pks(pks: np.ndarray) -> bytes:
+        """Encodes the pks as zigzag varints of the differences from the previous pk.
+
+        Args:
+            pks: Array of pks.
+
+        Returns:
+            Bytes with the encoded pks.
+        """
+        pks = np.asarray(pks, dtype=np.int64)
+        deltas = np.diff(pks, prepend=0)
+        zigzag = ((deltas << 1) ^ (deltas >> 63)).astype(np.uint64)
+
+        # 7 bits in each byte, the lowest ones first, up to 5 bytes for the 33 bits of a zigzag delta
+        shifts = np.arange(5, dtype=np.uint64) * np.uint64(7)
+        parts = ((zigzag[:, np.newaxis] >> shifts) & np.uint64(0x7F)).astype(np.uint8)
+
+        # one byte, and one more for each of the next groups of 7 bits with a bit set
+        lengths = 1 + ((zigzag[:, np.newaxis] >> shifts[1:]) > 0).sum(axis=1)
+        groups = np.arange(5)
+        used = groups < lengths[:, np.newaxis]
+
+        # the highest bit is set for all the bytes but the last one
+        parts[groups + 1 < lengths[:, np.newaxis]] |= 0x80
+        return parts[used].tobytes()
+
+    @staticmethod
+    def _decode_pks(data: np.ndarray) -> np.ndarray:
+        """Decodes the pks encoded with `_encode_pks()`.
+
+        Args:
+            data: Array of bytes with the encoded pks.
+
+        Returns:
+            Array of the pks.
+        """
+        data = np.asarray(data, dtype=np.uint8)
+        if len(data) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        last = data < 0x80
+        starts = np.concatenate(([0], np.flatnonzero(last)[:-1] + 1))
+        values = np.cumsum(last) - last
+        positions = np.arange(len(data)) - starts[values]
+        parts = (data & 0x7F).astype(np.uint64) << (positions.astype(np.uint64) * np.uint64(7))
+        zigzag = np.add.reduceat(parts, starts)
+        deltas = (zigzag >> np.uint64(1)).astype(np.int64) ^ -(zigzag & np.uint64(1)).astype(np.int64)
+        return np.cumsum(deltas)
+
+    def _encode_chunk(self, pks: np.ndarray, values: np.ndarray) -> bytes:
+        """Encodes the records as one chunk.
+
+        Args:
+            pks: Array of the pks.
+            values: Array of the values, one for each pk.
+
+        Returns:
+            Bytes of the whole chunk, including the header.
+
+        Raises:
+            ValueError: if a value doesn't fit in the width stored in the file header.
+        """
+        if len(values) and values.max() >= 1 << self._bits:
+            raise ValueError(f"The value {values.max()} doesn't fit in {self._bits} bits of {self.file_path}.")
+
+        encoded_pks = self._encode_pks(pks)
+        header = self._to_four_bytes(len(values)) + self._to_four_bytes(len(encoded_pks))
+        return header + self._pack_values(values, self._bits) + encoded_pks
+
+    def _read_chunk(self, data: np.ndarray, offset: int, records: int, pks_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Decodes the chunk.
+
+        Args:
+            data: Content of the file.
+            offset: Offset of the chunk.
+            records: Number of records in the chunk.
+            pks_size: Size of the pks in bytes.
+
+        Returns:
+            Tuple with the array of pks and the array of values.
+        """
+        return self._read_pks(data, offset, records, pks_size), self._read_values(data, offset, records)
+
+    def _read_values(self, data: np.ndarray, offset: int, records: int) -> np.ndarray:
+        """Decodes the values of the chunk, without reading the pks.
+
+        Args:
+            data: Content of the file.
+            offset: Offset of the chunk.
+            records: Number of records in the chunk.
+
+        Returns:
+            Array of the values.
+        """
+        start = offset + self.CHUNK_HEADER_SIZE
+        end = start + self._values_size(records, self._bits)
+        return self._unpack_values(data[start:end], records, self._bits)
+
+    def _read_pks(self, data: np.ndarray, offset: int, records: int, pks_size: int) -> np.ndarray:
+        """Decodes the pks of the chunk, without reading the values.
+
+        Args:
+            data: Content of the file.
+            offset: Offset of the chunk.
+            records: Number of records in the chunk.
+            pks_size: Size of the pks in bytes.
+
+        Returns:
+            Array of the pks.
+        """
+        start = offset + self.CHUNK_HEADER_SIZE + self._values_size(records, self._bits)
+        end = start + pks_size
+        return self._decode_pks(data[start:end])
+
+    def _open(self) -> np.ndarray:
+        """Maps the file, and reads the width of the values from the header.
+
+        Returns:
+            Content of the file.
+        """
+        data = self._data()
+        self._bits = self._read_header(data) if len(data) else self.value_bits(self.size)
+        return data
+
+    def write_many(self, values: List[SingleValue]) -> None:
+        """Writes the values to the data file.
+
+        The values are written as a new chunk after the stored ones, with one write. The trailing chunks
+        which are not full are merged like the digits of a binary counter: a chunk is merged with the new records
+        when it doesn't have twice as many records. So there are only about `log2(MAX_CHUNK_RECORDS / batch size)`
+        of them, and each record is decoded and written again only that many times. The full chunks
+        are never rewritten.
+
+        Args:
+            values: Values to store in the file.
+        """
+        if not values:
+            return
+
+        data = self._open()
+        headers = list(self._chunk_headers(data)) if len(data) else []
+        records = len(values)
+        merged = []
+        while headers and headers[-1][1] < min(2 * records, self.MAX_CHUNK_RECORDS):
+            merged.insert(0, headers.pop())
+            records += merged[0][1]
+
+        pks = [np.zeros(0, dtype=np.int64)]
+        int_values = [np.zeros(0, dtype=np.int64)]
+        for offset, chunk_records, pks_size in merged:
+            chunk_pks, chunk_values = self._read_chunk(data, offset, chunk_records, pks_size)
+            pks.append(chunk_pks)
+            int_values.append(chunk_values)
+        pks.append(np.array([value.pk for value in values], dtype=np.int64))
+        int_values.append(np.array([value.value for value in values], dtype=np.int64))
+        pks, int_values = np.concatenate(pks), np.concatenate(int_values)
+
+        if len(data) == 0:
+            buffer, end = self._make_header(), 0
+        elif merged:
+            buffer, end = b"", merged[0][0]
+        elif headers:
+            offset, chunk_records, pks_size = headers[-1]
+            buffer, end = b"", offset + self.CHUNK_HEADER_SIZE + self._values_size(chunk_records, self._bits) + pks_size
+        else:
+            buffer, end = b"", self.HEADER_SIZE
+        del data
+
+        for start in range(0, len(pks), self.MAX_CHUNK_RECORDS):
+            stop = start + self.MAX_CHUNK_RECORDS
+            buffer += self._encode_chunk(pks[start:stop], int_values[start:stop])
+
+        if merged:
+            self._save_undo(end)
+        # a torn write at the end of the file is overwritten
+        with open(self.file_path, "r+b" if os.path.exists(self.file_path) else "wb") as f:
+            f.seek(end)
+            f.write(buffer)
+            f.truncate()
+
+    def truncate(self, records: int) -> None:
+        """Removes all the records stored after the first `records` ones.
+
+        The content overwritten by a not synchronized write is restored from the undo file first.
+
+        Args:
+            records: Number of records to keep.
+        """
+        if not os.path.exists(self.file_path):
+            return
+
+        self._restore_undo()
+        data = self._open()
+        if len(data) == 0:
+            return
+
+        kept, end, rewritten = 0, self.HEADER_SIZE, b""
+        for offset, chunk_records, pks_size in self._chunk_headers(data):
+            if kept + chunk_records <= records:
+                kept += chunk_records
+                end = offset + self.CHUNK_HEADER_SIZE + self._values_size(chunk_records, self._bits) + pks_size
+                continue
+
+            position = records - kept
+            if position > 0:
+                pks, values = self._read_chunk(data, offset, chunk_records, pks_size)
+                end = offset
+                rewritten = self._encode_chunk(pks[:position], values[:position])
+            break
+        del data
+
+        if rewritten:
+            self._save_undo(end)
+        with open(self.file_path, "r+b") as f:
+            f.seek(end)
+            f.write(rewritten)
+            f.truncate()
+
+    def read(self) -> Generator[SingleValue, None, None]:
+        """Yields a value from the data file.
+
+        Yields:
+            Value read from the file.
+        """
+        data = self._open()
+        for offset, records, pks_size in self._chunk_headers(data):
+            pks, values = self._read_chunk(data, offset, records, pks_size)
+            for pk, value in zip(pks.tolist(), values.tolist()):
+                yield SingleValue(pk=pk, value=value)
+
+    def read_at(self, position: int) -> Optional[SingleValue]:
+        """Reads the value stored at the position in the data file.
+
+        The chunks before the record are skipped using their headers, only the chunk with the record is decoded.
+
+        Args:
+            position: Position of the record.
+
+        Returns:
+            The value, None if there is no record at the position.
+        """
+        data = self._open()
+        for offset, records, pks_size in self._chunk_headers(data):
+            if position < records:
+                pks, values = self._read_chunk(data, offset, records, pks_size)
+                return SingleValue(pk=int(pks[position]), value=int(values[position]))
+            position -= records
+        return None
+
+    def records_count(self) -> int:
+        """Returns the number of records stored in the file.
+
+        Returns:
+            Number of records, zero for a missing file.
+        """
+        data = self._open()
+        return sum(records for _, records, _ in self._chunk_headers(data))
+
+    def count_values(
+        self, size: int, pk_range: Optional[Tuple[int, int]] = None, pks: Optional[np.ndarray] = None
+    ) -> Tuple[int, np.ndarray]:
+        """Counts the records and the number of times each value was chosen.
+
+        Without the `pk_range` and the `pks` only the values are read, the pks are skipped.
+
+        Args:
+            size: Number of possible values.
+            pk_range: If set, only the records with pk in the range (inclusive) are counted.
+            pks: If set, only the records with pk in the sorted array are counted.
+
+        Returns:
+            A tuple with the number of records and an array of counts indexed by the value.
+        """
+        data = self._open()
+        counter = 0
+        counts = np.zeros(size, dtype=np.int64)
+        for offset, records, pks_size in self._chunk_headers(data):
+            values = self._read_values(data, offset, records)
+            if pk_range is not None or pks is not None:
+                values = values[self._pk_mask(self._read_pks(data, offset, records, pks_size), pk_range, pks)]
+            counter += len(values)
+            counts += np.bincount(values, minlength=size)[:size]
+        return counter, counts
+
+    def select_pks(self, value: int) -> np.ndarray:
+        """Returns the pks of the records which have chosen the value.
+
+        Args:
+            value: Index of the value.
+
+        Returns:
+            Array of the pks.
+        """
+        data = self._open()
+        selected = [np.zeros(0, dtype=np.int64)]
+        for offset, records, pks_size in self._chunk_headers(data):
+            pks, values = self._read_chunk(data, offset, records, pks_size)
+            selected.append(np.asarray(pks, dtype=np.int64)[values == value])
+        return np.concatenate(selected)
+
+
+class MultiValueDataFile(DataFile):
+    """Class for reading and writing MultiValue one by one.
+
+    Args:
+        BYTEORDER: Order of the bytes used in the data files.
+        file_path: Path of the data file.
+        size: Size in bits of the `yes` and `no` fields.
+
+    Attributes:
+        BYTEORDER: Order of the bytes used in the data files.
+        file_path: Path of the data file.
+        size: Size in bits of the `yes` and `no` fields.
+        size_in_bytes: Size in bytes of the `yes` and `no` fields.
+    """
+
+    def __init__(self, file_path: str, size: int):
+        super().__init__(file_path)
+        self.size = size
+
+        self.size_in_bytes = size // 8
+        if size % 8 != 0:
+            self.size_in_bytes += 1
+
+    def _convert_indices_to_bitfields(self, values: List[List[int]]) -> np.ndarray:
+        """Converts the lists of indices to bitfields.
+
+        Args:
+            values: For each record, a list of positions of the bits to set.
+
+        Returns:
+            2-D array of bytes, each row is one bitfield.
+        """
+        bits = np.zeros((len(values), self.size_in_bytes * 8), dtype=bool)
+        rows = np.repeat(np.arange(len(values)), [len(positions) for positions in values])
+        columns = np.fromiter(chain.from_iterable(values), dtype=np.int64, count=len(rows))
+        bits[rows, columns] = True
+        return np.packbits(bits, axis=1)
+
+    def _encode(self, values: List[MultiValue]) -> np.ndarray:
+        """Converts the values to the records stored in the file.
+
+        Args:
+            values: Values to convert.
+
+        Returns:
+            Array of records with the `dtype` type.
+        """
+        data = np.zeros(len(values), dtype=self.dtype)
+        data["pk"] = [value.pk for value in values]
+        data["yes"] = self._convert_indices_to_bitfields([value.yes_choices for value in values])
+        data["no"] = self._convert_indices_to_bitfields([value.no_choices for value in values])
+        return data
+
+    def _decode(self, records: np.ndarray) -> Generator[MultiValue, None, None]:
+        """Converts the records stored in the file to the values.
+
+        Args:
+            records: Array of records with the `dtype` type.
+
+        Yields:
+            Values stored in the records.
+        """
+        yes_choices = self._convert_bitfields_to_indices(records["yes"])
+        no_choices = self._convert_bitfields_to_indices(records["no"])
+        for pk, yes, no in zip(records["pk"].tolist(), yes_choices, no_choices):
+            yield MultiValue(pk=pk, yes_choices=yes, no_choices=no)
+
+    def _yes_bits(self, records: np.ndarray) -> np.ndarray:
+        """Unpacks the `yes` bitfields of the records.
+
+        Args:
+            records: Array of records with the `dtype` type.
+
+        Returns:
+            2-D array with one row of bits (0 or 1) for each record, and one column for each choice.
+        """
+        return np.unpackbits(records["yes"], axis=1)[:, : self.size]
+
+    def _count(self, records: np.ndarray) -> np.ndarray:
+        """Counts the "yes" answers for each choice in the records.
+
+        Args:
+            records: Array of records with the `dtype` type.
+
+        Returns:
+            Array of "yes" counts indexed by the choice.
+        """
+        return self._yes_bits(records).sum(axis=0, dtype=np.int64)
+
+    def write_many(self, values: List[MultiValue]) -> None:
+        """Writes the values to the data file.
+
+        Args:
+            values: Values to store in the file.
+        """
+        self._append(self._encode(values).tobytes())
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Numpy type describing one record stored in the data file."""
+        return np.dtype([("pk", ">u4"), ("yes", "u1", (self.size_in_bytes,)), ("no", "u1", (self.size_in_bytes,))])
+
+    def _convert_bitfields_to_indices(self, value: np.ndarray) -> List[List[int]]:
+        """Converts the bitfields to lists of set bits.
+
+        Args:
+            value: 2-D array of bytes, each row is one bitfield.
+
+        Returns:
+            For each of the rows, a sorted list of integers containing numbers
+            of positions with set bits in the row.
+        """
+        bits = np.unpackbits(value, axis=1)[:, : self.size]
+        return [np.flatnonzero(row).tolist() for row in bits]
+
+    def read(self) -> Generator[MultiValue, None, None]:
+        """Yields a value from the data file.
+
+        Yields:
+            Value read from the file.
+        """
+        for chunk in self._chunks():
+            yield from self._decode(chunk)
+
+    def read_at(self, position: int) -> Optional[MultiValue]:
+        """Reads the value stored at the position in the data file.
+
+        Args:
+            position: Position of the record.
+
+        Returns:
+            The value, None if there is no record at the position.
+        """
+        end = position + 1
+        return next(self._decode(self.view()[position:end]), None)
+
+    def count_yes_choices(
+        self, pk_range: Optional[Tuple[int, int]] = None, pks: Optional[np.ndarray] = None
+    ) -> Tuple[int, np.ndarray]:
+        """Counts the records and the "yes" answers for each choice.
+
+        Instead of decoding the records one by one, the memory-mapped records are processed
+        in chunks of `READ_CHUNK_SIZE` records. The `yes` columns are unpacked to bits
+        and summed per column, so there is no Python loop over the records nor over the bits.
+
+        Args:
+            pk_range: If set, only the records with pk in the range (inclusive) are counted.
+            pks: If set, only the records with pk in the sorted array are counted.
+
+        Returns:
+            A tuple with the number of records and an array of "yes" counts indexed by the choice.
+        """
+        counts = np.zeros(self.size, dtype=np.int64)
+        records = 0
+
+        for chunk in self._chunks():
+            if pk_range is not None or pks is not None:
+                chunk = chunk[self._pk_mask(chunk["pk"], pk_range, pks)]
+            counts += self._count(chunk)
+            records += len(chunk)
+
+        return records, counts
+
+    def _select(self, records: np.ndarray, choice: int, yes: bool) -> np.ndarray:
+        """Checks which of the records have chosen the answer.
+
+        Args:
+            records: Array of records with the `dtype` type.
+            choice: Index of the choice.
+            yes: If True, the "yes" answers are checked, otherwise the "no" answers.
+
+        Returns:
+            Array of booleans, one for each of the records.
+        """
+        field = "yes" if yes else "no"
+        return (records[field][:, choice // 8] & (0x80 >> (choice % 8))) != 0
+
+    def select_pks(self, choice: int, yes: bool = True) -> np.ndarray:
+        """Returns the pks of the records which have chosen the answer.
+
+        Args:
+            choice: Index of the choice.
+            yes: If True, the records with "yes" answer are selected, otherwise the records with "no" answer.
+
+        Returns:
+            Array of the pks.
+        """
+        selected = [np.zeros(0, dtype=np.int64)]
+        for chunk in self._chunks():
+            selected.append(chunk["pk"][self._select(chunk, choice, yes)].astype(np.int64))
+        return np.concatenate(selected)
+
+    def read_yes_choices(
+        self, start: int = 0, end: Optional[int] = None
+    ) -> Generator[Tuple[np.ndarray, np.ndarray], None, None]:
+        """Yields the pks and the unpacked `yes` bitfields of the records, in chunks of `READ_CHUNK_SIZE` records.
+
+        Args:
+            start: Position of the first record to read.
+            end: Position after the last record to read, by default all the records up to the end are read.
+
+        Yields:
+            Tuples with the array of pks, and the 2-D array with one row of bits (0 or 1) for each record,
+            where the bit of a choice is 1 if the record has "yes" answer for it.
+        """
+        data = self.view()[start:end]
+        for position in range(0, len(data), self.READ_CHUNK_SIZE):
+            chunk_end = position + self.READ_CHUNK_SIZE
+            chunk = data[position:chunk_end]
+            yield chunk["pk"].astype(np.int64), self._yes_bits(chunk)
+
+
+class MultiValueColumnsDataFile(DataFile):
+    """Class for reading and writing MultiValue in a column oriented (transposed) layout.
+
+    The file starts with a header with the number of stored records (4B).
+    Then there are stripes, each stripe stores `STRIPE_SIZE` records as:
+
+        - the pk column (`STRIPE_SIZE` * 4B)
+        - the `yes` bitmap for each choice (`size` * `STRIPE_SIZE` bits)
+        - the `no` bitmap for each choice (`size` * `STRIPE_SIZE` bits)
+
+    Bit `n` of a bitmap is set if the record stored at the position `n` of the stripe has chosen the answer.
+    So counting the "yes" answers for one choice is a popcount of one bitmap in each stripe.
+
+    Args:
+        BYTEORDER: Order of the bytes used in the data files.
+        file_path: Path of the data file.
+        size: Number of choices.
+
+    Attributes:
+        BYTEORDER: Order of the bytes used in the data files.
+        HEADER_SIZE: Size in bytes of the file header.
+        STRIPE_SIZE: Number of records stored in one stripe, must be divisible by 8.
+        READ_CHUNK_SIZE: Number of stripes processed at once.
+        file_path: Path of the data file.
+        size: Number of choices.
+    """
+
+    HEADER_SIZE = 4
+    STRIPE_SIZE = 4096
+    READ_CHUNK_SIZE = 16
+
+    def __init__(self, file_path: str, size: int):
+        super().__init__(file_path)
+        self.size = size
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Numpy type describing one stripe stored in the data file."""
+        bitmap_size_in_bytes = self.STRIPE_SIZE // 8
+        return np.dtype(
+            [
+                ("pk", ">u4", (self.STRIPE_SIZE,)),
+                ("yes", "u1", (self.size, bitmap_size_in_bytes)),
+                ("no", "u1", (self.size, bitmap_size_in_bytes)),
+            ]
+        )
+
+    def records_count(self) -> int:
+        """Returns the number of records stored in the file.
+
+        Returns:
+            Number of records, zero for a missing file.
+        """
+        if not os.path.exists(self.file_path):
+            return 0
+
+        with open(self.file_path, "rb") as f:
+            return self._from_bytes(f.read(self.HEADER_SIZE))
+
+    def view(self) -> np.ndarray:
+        """Returns a read-only view of all the stripes stored in the data file.
+
+        The last stripe can be filled only partially, use `records_count()` to get the number of records.
+
+        Returns:
+            Array of stripes with the `dtype` type, empty for a missing file.
+        """
+        if not os.path.exists(self.file_path):
+            return np.zeros(0, dtype=self.dtype)
+
+        stripes = (os.path.getsize(self.file_path) - self.HEADER_SIZE) // self.dtype.itemsize
+        if stripes <= 0:
+            return np.zeros(0, dtype=self.dtype)
+
+        return np.memmap(self.file_path, dtype=self.dtype, mode="r", offset=self.HEADER_SIZE, shape=(stripes,))
+
+    def write_many(self, values: List[MultiValue]) -> None:
+        """Writes the values to the data file.
+
+        The values are stored at the first free positions of the last stripe, new stripes are created if needed.
+        The header is updated after the bits are set, so an interrupted write is not visible.
+
+        Args:
+            values: Values to store in the file.
+        """
+        if not values:
+            return
+
+        records = self.records_count()
+        stripes = (records + len(values) + self.STRIPE_SIZE - 1) // self.STRIPE_SIZE
+
+        required_size = self.HEADER_SIZE + stripes * self.dtype.itemsize
+        with open(self.file_path, "r+b" if os.path.exists(self.file_path) else "w+b") as f:
+            if os.fstat(f.fileno()).st_size < required_size:
+                f.truncate(required_size)
+
+        data = np.memmap(self.file_path, dtype=self.dtype, mode="r+", offset=self.HEADER_SIZE, shape=(stripes,))
+
+        rows = np.arange(records, records + len(values))
+        data["pk"][rows // self.STRIPE_SIZE, rows % self.STRIPE_SIZE] = [value.pk for value in values]
+
+        for field, choices in [
+            ("yes", [value.yes_choices for value in values]),
+            ("no", [value.no_choices for value in values]),
+        ]:
+            choice_rows = np.repeat(rows, [len(positions) for positions in choices])
+            choice_indices = np.fromiter((position for positions in choices for position in positions), dtype=np.int64)
+            positions = choice_rows % self.STRIPE_SIZE
+            # many records can set bits in the same byte, so the `at` version must be used
+            np.bitwise_or.at(
+                data[field],
+                (choice_rows // self.STRIPE_SIZE, choice_indices, positions // 8),
+                (0x80 >> (positions % 8)).astype(np.uint8),
+            )
+
+        data.flush()
+        del data
+
+        with open(self.file_path, "r+b") as f:
+            f.write(self._to_four_bytes(records + len(values)))
+
+    def truncate(self, records: int) -> None:
+        """Removes all the records stored after the first `records` ones.
+
+        The bits of the removed records are cleared, as an interrupted write could have set them
+        without updating the header.
+
+        Args:
+            records: Number of records to keep.
+        """
+        if not os.path.exists(self.file_path):
+            return
+
+        stripes, position = divmod(records, self.STRIPE_SIZE)
+        if position and len(self.view()) > stripes:
+            data = np.memmap(self.file_path, dtype=self.dtype, mode="r+", offset=self.HEADER_SIZE, shape=(stripes + 1,))
+            byte, rest = position // 8, position // 8 + 1
+            # keep only the bits of the first `position % 8` records in the byte
+            mask = (0xFF << (8 - position % 8)) & 0xFF
+            data["pk"][stripes, position:] = 0
+            for field in ["yes", "no"]:
+                data[field][stripes, :, byte] &= mask
+                data[field][stripes, :, rest:] = 0
+            data.flush()
+            del data
+            stripes += 1
+
+        with open(self.file_path, "r+b") as f:
+            f.write(self._to_four_bytes(records))
+            if os.fstat(f.fileno()).st_size > self.HEADER_SIZE + stripes * self.dtype.itemsize:
+                f.truncate(self.HEADER_SIZE + stripes * self.dtype.itemsize)
+
+    def read(self) -> Generator[MultiValue, None, None]:
+        """Yields a value from the data file.
+
+        Yields:
+            Value read from the file.
+        """
+        records = self.records_count()
+        for index, stripe in enumerate(self.view()):
+            count = min(self.STRIPE_SIZE, records - index * self.STRIPE_SIZE)
+            if count <= 0:
+                break
+            # transpose the bitmaps, so there is one row of bits for each record
+            yes_bits = np.unpackbits(stripe["yes"], axis=1)[:, :count].T
+            no_bits = np.unpackbits(stripe["no"], axis=1)[:, :count].T
+            for pk, yes, no in zip(stripe["pk"][:count].tolist(), yes_bits, no_bits):
+                yield MultiValue(
+                    pk=pk, yes_choices=np.flatnonzero(yes).tolist(), no_choices=np.flatnonzero(no).tolist(),
+                )
+
+    def read_at(self, position: int) -> Optional[MultiValue]:
+        """Reads the value stored at the position in the data file.
+
+        Only one column of bits of the stripe with the record is read.
+
+        Args:
+            position: Position of the record.
+
+        Returns:
+            The value, None if there is no record at the position.
+        """
+        if position >= self.records_count():
+            return None
+        stripe = self.view()[position // self.STRIPE_SIZE]
+        row = position % self.STRIPE_SIZE
+        bit = 0x80 >> (row % 8)
+        return MultiValue(
+            pk=int(stripe["pk"][row]),
+            yes_choices=np.flatnonzero(stripe["yes"][:, row // 8] & bit).tolist(),
+            no_choices=np.flatnonzero(stripe["no"][:, row // 8] & bit).tolist(),
+        )
+
+    def count_yes_choice(self, choice: int) -> int:
+        """Counts the "yes" answers for one choice.
+
+        Only the bitmaps of the choice are read from the file.
+
+        Args:
+            choice: Index of the choice.
+
+        Returns:
+            Number of records with "yes" answer for the choice.
+        """
+        return int(sum(_POPCOUNT[chunk["yes"][:, choice]].sum(dtype=np.int64) for chunk in self._chunks()))
+
+    def count_yes_choices(
+        self, pk_range: Optional[Tuple[int, int]] = None, pks: Optional[np.ndarray] = None
+    ) -> Tuple[int, np.ndarray]:
+        """Counts the records and the "yes" answers for each choice.
+
+        With the `pk_range` or the `pks`, the pk column of each stripe is converted to a bitmap
+        of the selected records, which is combined with the `yes` bitmaps before counting.
+
+        Args:
+            pk_range: If set, only the records with pk in the range (inclusive) are counted.
+            pks: If set, only the records with pk in the sorted array are counted.
+
+        Returns:
+            A tuple with the number of records and an array of "yes" counts indexed by the choice.
+        """
+        counts = np.zeros(self.size, dtype=np.int64)
+        records = self.records_count()
+
+        if pk_range is None and pks is None:
+            for chunk in self._chunks():
+                counts += _POPCOUNT[chunk["yes"]].sum(axis=(0, 2), dtype=np.int64)
+            return records, counts
+
+        selected = 0
+        for index, stripe in enumerate(self.view()):
+            count = min(self.STRIPE_SIZE, records - index * self.STRIPE_SIZE)
+            if count <= 0:
+                break
+            mask = np.zeros(self.STRIPE_SIZE, dtype=bool)
+            mask[:count] = self._pk_mask(stripe["pk"][:count], pk_range, pks)
+            counts += _POPCOUNT[stripe["yes"] & np.packbits(mask)].sum(axis=1, dtype=np.int64)
+            selected += int(mask.sum())
+
+        return selected, counts
+
+    def select_pks(self, choice: int, yes: bool = True) -> np.ndarray:
+        """Returns the pks of the records which have chosen the answer.
+
+        Only the pk column and the bitmap of the choice are read from each stripe.
+
+        Args:
+            choice: Index of the choice.
+            yes: If True, the records with "yes" answer are selected, otherwise the records with "no" answer.
+
+        Returns:
+            Array of the pks.
+        """
+        field = "yes" if yes else "no"
+        records = self.records_count()
+        selected = [np.zeros(0, dtype=np.int64)]
+        for index, stripe in enumerate(self.view()):
+            count = min(self.STRIPE_SIZE, records - index * self.STRIPE_SIZE)
+            if count <= 0:
+                break
+            mask = np.unpackbits(stripe[field][choice])[:count].astype(bool)
+            selected.append(stripe["pk"][:count][mask].astype(np.int64))
+        return np.concatenate(selected)
+
+    def read_yes_choices(
+        self, start: int = 0, end: Optional[int] = None
+    ) -> Generator[Tuple[np.ndarray, np.ndarray], None, None]:
+        """Yields the pks and the transposed `yes` bitmaps of the records, one stripe at once.
+
+        Args:
+            start: Position of the first record to read.
+            end: Position after the last record to read, by default all the records up to the end are read.
+
+        Yields:
+            Tuples with the array of pks, and the 2-D array with one row of bits (0 or 1) for each record,
+            where the bit of a choice is 1 if the record has "yes" answer for it.
+        """
+        records = self.records_count() if end is None else min(end, self.records_count())
+        for index, stripe in enumerate(self.view()):
+            first = index * self.STRIPE_SIZE
+            lo, hi = max(start - first, 0), min(records - first, self.STRIPE_SIZE)
+            if hi <= 0:
+                break
+            if lo >= hi:
+                continue
+            yield stripe["pk"][lo:hi].astype(np.int64), np.unpackbits(stripe["yes"], axis=1)[:, lo:hi].T
+
+
+class MultiValueRoaringDataFile(UndoDataFile):
+    """Class for reading and writing MultiValue as compressed bitmaps.
+
+    The file is a list of chunks, each chunk stores up to `CONTAINER_SIZE` records as:
+
+        - the chunk header: size of the chunk in bytes (4B), number of records (4B)
+        - the pk column (records * 4B)
+        - the directory, an entry for the `yes` container of each choice,
+          then an entry for the `no` container of each choice,
+          each entry is: container type (1B), cardinality (4B), container size in bytes (4B)
+        - the serialized containers, in the directory order
+
+    The container of a choice stores the positions of the records in the chunk which have chosen the answer.
+    The counts are calculated from the directory only, without reading the containers.
+
+    A write appends a new chunk, and merges it only with the last few chunks which are not full
+    (see `write_many()`), the full chunks are never rewritten. The compaction writes all the records in full chunks.
+    As the merged chunks are overwritten in place, their previous content is stored in the undo file first.
+    The undo file is removed by `sync()`, until then `truncate()` can restore the previous content.
+
+    Args:
+        BYTEORDER: Order of the bytes used in the data files.
+        file_path: Path of the data file.
+        size: Number of choices.
+
+    Attributes:
+        BYTEORDER: Order of the bytes used in the data files.
+        CHUNK_HEADER_SIZE: Size in bytes of the chunk header.
+        DIRECTORY_DTYPE: Numpy type describing one directory entry.
+        file_path: Path of the data file.
+        undo_file_path: Path of the file with the content overwritten by the last write.
+        size: Number of choices.
+    """
+
+    CHUNK_HEADER_SIZE = 8
+    DIRECTORY_DTYPE = np.dtype([("type", "u1"), ("cardinality", ">u4"), ("length", ">u4")])
+
+    def __init__(self, file_path: str, size: int):
+        super().__init__(file_path)
+        self.size = size
+
+    def truncate(self, records: int) -> None:
+        """Removes all the records stored after the first `records` ones.
+
+        The content overwritten by a not synchronized write is restored from the undo file first.
+
+        Args:
+            records: Number of records to keep.
+        """
+        if not os.path.exists(self.file_path):
+            return
+
+        self._restore_undo()
+
+        kept, end = 0, 0
+        for offset, chunk_size, chunk_records in list(self._chunk_headers()):
+            if kept + chunk_records <= records and offset + chunk_size <= os.path.getsize(self.file_path):
+                kept, end = kept + chunk_records, offset + chunk_size
+                continue
+
+            end = offset
+            position = records - kept
+            if position > 0:
+                pks, containers = self._read_chunk(offset, chunk_size, chunk_records)
+                containers = [Container.from_values(c.values()[c.values() < position]) for c in containers]
+                data = self._encode_chunk(pks[:position], containers)
+                end += len(data)
+
+                self._save_undo(offset)
+                with open(self.file_path, "r+b") as f:
+                    f.seek(offset)
+                    f.write(data)
+            break
+
+        with open(self.file_path, "r+b") as f:
+            f.truncate(end)
+
+    def _chunk_headers(self) -> Generator[Tuple[int, int, int], None, None]:
+        """Yields the headers of all the chunks.
+
+        Yields:
+            Tuples with the offset of the chunk in the file, the chunk size in bytes, and the number of records.
+        """
+        if not os.path.exists(self.file_path):
+            return
+
+        file_size = os.path.getsize(self.file_path)
+        offset = 0
+        with open(self.file_path, "rb") as f:
+            while offset + self.CHUNK_HEADER_SIZE <= file_size:
+                f.seek(offset)
+                header = f.read(self.CHUNK_HEADER_SIZE)
+                chunk_size, records = self._from_bytes(header[:4]), self._from_bytes(header[4:])
+                if chunk_size < self.CHUNK_HEADER_SIZE:
+                    # this can be only a torn write
+                    return
+                yield offset, chunk_size, records
+                offset += chunk_size
+
+    def _read_directory(self, f, offset: int, records: int) -> np.ndarray:
+        """Reads the directory of the chunk.
+
+        Args:
+            f: Opened data file.
+            offset: Offset of the chunk in the file.
+            records: Number of records in the chunk.
+
+        Returns:
+            Array of `2 * size` directory entries.
+        """
+        f.seek(offset + self.CHUNK_HEADER_SIZE + 4 * records)
+        return np.frombuffer(f.read(2 * self.size * self.DIRECTORY_DTYPE.itemsize), dtype=self.DIRECTORY_DTYPE)
+
+    def _read_chunk(self, offset: int, chunk_size: int, records: int) -> Tuple[np.ndarray, List[Container]]:
+        """Reads and decodes the chunk.
+
+        Args:
+            offset: Offset of the chunk in the file.
+            chunk_size: Size of the chunk in bytes.
+            records: Number of records in the chunk.
+
+        Returns:
+            Tuple with the array of pks, and the list of `2 * size` containers (the `yes` ones, then the `no` ones).
+        """
+        with open(self.file_path, "rb") as f:
+            f.seek(offset)
+            data = f.read(chunk_size)
+
+        position = self.CHUNK_HEADER_SIZE
+        pks = np.frombuffer(data, dtype=">u4", count=records, offset=position)
+        position += 4 * records
+
+        directory = np.frombuffer(data, dtype=self.DIRECTORY_DTYPE, count=2 * self.size, offset=position)
+        position += directory.nbytes
+
+        containers = []
+        for container_type, length in zip(directory["type"].tolist(), directory["length"].tolist()):
+            end = position + length
+            containers.append(Container.from_bytes(ContainerType(container_type), data[position:end]))
+            position = end
+
+        return pks, containers
+
+    def _encode_chunk(self, pks: np.ndarray, containers: List[Container]) -> bytes:
+        """Encodes the chunk.
+
+        Args:
+            pks: Array of pks of the records.
+            containers: List of `2 * size` containers (the `yes` ones, then the `no` ones).
+
+        Returns:
+            Bytes of the whole chunk, including the header.
+        """
+        payloads = [container.to_bytes() for container in containers]
+
+        directory = np.zeros(len(containers), dtype=self.DIRECTORY_DTYPE)
+        directory["type"] = [container.TYPE for container in containers]
+        directory["cardinality"] = [container.cardinality for container in containers]
+        directory["length"] = [len(payload) for payload in payloads]
+
+        body = np.asarray(pks, dtype=">u4").tobytes() + directory.tobytes() + b"".join(payloads)
+        return self._to_four_bytes(self.CHUNK_HEADER_SIZE + len(body)) + self._to_four_bytes(len(pks)) + body
+
+    def records_count(self) -> int:
+        """Returns the number of records stored in the file.
+
+        Returns:
+            Number of records, zero for a missing file.
+        """
+        return sum(records for _, _, records in self._chunk_headers())
+
+    def _choice_positions(self, values: List[MultiValue], first_position: int) -> List[np.ndarray]:
+        """Groups the positions of the values by the chosen answers.
+
+        Args:
+            values: Values to group.
+            first_position: Position of the first value.
+
+        Returns:
+            List of `2 * size` sorted arrays of positions (for the `yes` answers, then for the `no` answers).
+        """
+        positions = np.arange(first_position, first_position + len(values))
+        indices = [
+            np.fromiter((choice for value in values for choice in value.yes_choices), dtype=np.int64),
+            np.fromiter((self.size + choice for value in values for choice in value.no_choices), dtype=np.int64),
+        ]
+        value_positions = [
+            np.repeat(positions, [len(value.yes_choices) for value in values]),
+            np.repeat(positions, [len(value.no_choices) for value in values]),
+        ]
+        indices = np.concatenate(indices)
+        value_positions = np.concatenate(value_positions)
+
+        # group the positions by the container index
+        order = np.lexsort((value_positions, indices))
+        indices, value_positions = indices[order], value_positions[order]
+        bounds = np.flatnonzero(np.diff(indices)) + 1
+
+        grouped = [np.zeros(0, dtype=np.int64)] * (2 * self.size)
+        for group_indices, group_positions in zip(np.split(indices, bounds), np.split(value_positions, bounds)):
+            if len(group_indices):
+                grouped[int(group_indices[0])] = group_positions
+        return grouped
+
+    def _encode_chunks(self, pks: np.ndarray, positions: List[np.ndarray]) -> bytes:
+        """Encodes the records into chunks of up to `CONTAINER_SIZE` records.
+
+        Args:
+            pks: Array of pks of the records.
+            positions: List of `2 * size` sorted arrays of positions of the records which have chosen the answers.
+
+        Returns:
+            Bytes of all the chunks.
+        """
+        chunks = []
+        for start in range(0, len(pks), CONTAINER_SIZE):
+            end = start + CONTAINER_SIZE
+            containers = []
+            for choice_positions in positions:
+                lo, hi = np.searchsorted(choice_positions, [start, end]).tolist()
+                containers.append(Container.from_values(choice_positions[lo:hi] - start))
+            chunks.append(self._encode_chunk(pks[start:end], containers))
+        return b"".join(chunks)
+
+    def write_many(self, values: List[MultiValue]) -> None:
+        """Writes the values to the data file.
+
+        The values are written as a new chunk after the stored ones, so the stored chunks are not decoded.
+        The trailing chunks which are not full are merged like the digits of a binary counter: a chunk is merged
+        with the new records when it doesn't have twice as many records. So there are only a few of them
+        (about `log2(CONTAINER_SIZE / batch size)`), and each record is rewritten only that many times.
+        The compaction merges all the records into the full chunks.
+
+        Args:
+            values: Values to store in the file.
+        """
+        if not values:
+            return
+
+        headers = list(self._chunk_headers())
+        records = len(values)
+        merged = []
+        while headers and headers[-1][2] < min(2 * records, CONTAINER_SIZE):
+            merged.insert(0, headers.pop())
+            records += merged[0][2]
+        offset = sum(chunk_size for _, chunk_size, _ in headers)
+
+        pks = [np.zeros(0, dtype=np.uint32)]
+        positions = [[np.zeros(0, dtype=np.int64)] for _ in range(2 * self.size)]
+        first_position = 0
+        for chunk_offset, chunk_size, chunk_records in merged:
+            chunk_pks, containers = self._read_chunk(chunk_offset, chunk_size, chunk_records)
+            pks.append(chunk_pks)
+            for choice_positions, container in zip(positions, containers):
+                choice_positions.append(container.values().astype(np.int64) + first_position)
+            first_position += chunk_records
+        pks.append(np.array([value.pk for value in values], dtype=np.uint32))
+        for choice_positions, new_positions in zip(positions, self._choice_positions(values, first_position)):
+            choice_positions.append(new_positions)
+
+        data = self._encode_chunks(np.concatenate(pks), [np.concatenate(p) for p in positions])
+        if merged:
+            self._save_undo(offset)
+        with open(self.file_path, "r+b" if os.path.exists(self.file_path) else "wb") as f:
+            f.seek(offset)
+            f.write(data)
+            f.truncate()
+
+    def read(self) -> Generator[MultiValue, None, None]:
+        """Yields a value from the data file.
+
+        Yields:
+            Value read from the file.
+        """
+        for offset, chunk_size, records in self._chunk_headers():
+            pks, containers = self._read_chunk(offset, chunk_size, records)
+            yes_choices = [[] for _ in range(records)]
+            no_choices = [[] for _ in range(records)]
+            for choice in range(self.size):
+                for position in containers[choice].values().tolist():
+                    yes_choices[position].append(choice)
+                for position in containers[self.size + choice].values().tolist():
+                    no_choices[position].append(choice)
+
+            for pk, yes, no in zip(pks.tolist(), yes_choices, no_choices):
+                yield MultiValue(pk=pk, yes_choices=yes, no_choices=no)
+
+    def read_at(self, position: int) -> Optional[MultiValue]:
+        """Reads the value stored at the position in the data file.
+
+        The chunks before the record are skipped using their headers, only the chunk with the record is decoded.
+
+        Args:
+            position: Position of the record.
+
+        Returns:
+            The value, None if there is no record at the position.
+        """
+        for offset, chunk_size, records in self._chunk_headers():
+            if position < records:
+                pks, containers = self._read_chunk(offset, chunk_size, records)
+                chosen = [bool(container.contains(np.array([position]))[0]) for container in containers]
+                return MultiValue(
+                    pk=int(pks[position]),
+                    yes_choices=[choice for choice in range(self.size) if chosen[choice]],
+                    no_choices=[choice for choice in range(self.size) if chosen[self.size + choice]],
+                )
+            position -= records
+        return None
+
+    def bitmap(self, choice: int, yes: bool = True) -> RoaringBitmap:
+        """Returns the positions of the records which have chosen the answer.
+
+        The containers of the chunks starting at a multiple of `CONTAINER_SIZE` (all the full ones) are not decoded,
+        they're used with the key `position // CONTAINER_SIZE`. The positions of the other chunks are added as values.
+
+        Args:
+            choice: Index of the choice.
+            yes: If True, the positions with "yes" answer are returned, otherwise the positions with "no" answer.
+
+        Returns:
+            Compressed bitmap with the positions of the records in the file.
+        """
+        index = choice if yes else self.size + choice
+        containers = dict()
+        positions = []
+        start = 0
+        for offset, chunk_size, records in self._chunk_headers():
+            _, chunk_containers = self._read_chunk(offset, chunk_size, records)
+            if start % CONTAINER_SIZE == 0:
+                containers[start // CONTAINER_SIZE] = chunk_containers[index]
+            else:
+                positions.append(chunk_containers[index].values().astype(np.int64) + start)
+            start += records
+
+        bitmap = RoaringBitmap.from_containers(containers)
+        if positions:
+            bitmap.add_many(np.concatenate(positions))
+        return bitmap
+
+    def count_yes_choices(
+        self, pk_range: Optional[Tuple[int, int]] = None, pks: Optional[np.ndarray] = None
+    ) -> Tuple[int, np.ndarray]:
+        """Counts the records and the "yes" answers for each choice.
+
+        Only the chunk headers and the directories are read, the counts are the stored cardinalities.
+        With the `pk_range` or the `pks`, the pks of each chunk are read too. Only the chunks with some
+        of the records selected are decoded, their selected positions make a container which is intersected
+        with the containers of the choices, without expanding them to positions.
+
+        Args:
+            pk_range: If set, only the records with pk in the range (inclusive) are counted.
+            pks: If set, only the records with pk in the sorted array are counted.
+
+        Returns:
+            A tuple with the number of records and an array of "yes" counts indexed by the choice.
+        """
+        counts = np.zeros(self.size, dtype=np.int64)
+        records_count = 0
+
+        headers = list(self._chunk_headers())
+        if not headers:
+            return records_count, counts
+
+        if pk_range is not None or pks is not None:
+            with open(self.file_path, "rb") as f:
+                for offset, chunk_size, records in headers:
+                    f.seek(offset + self.CHUNK_HEADER_SIZE)
+                    mask = self._pk_mask(np.frombuffer(f.read(4 * records), dtype=">u4"), pk_range, pks)
+                    selected_records = int(mask.sum())
+                    if selected_records == records:
+                        counts += self._read_directory(f, offset, records)["cardinality"][: self.size]
+                    elif selected_records:
+                        _, containers = self._read_chunk(offset, chunk_size, records)
+                        selected = Container.from_values(np.flatnonzero(mask))
+                        counts += [selected.and_cardinality(containers[choice]) for choice in range(self.size)]
+                    records_count += selected_records
+            return records_count, counts
+
+        with open(self.file_path, "rb") as f:
+            for offset, _, records in headers:
+                directory = self._read_directory(f, offset, records)
+                counts += directory["cardinality"][: self.size]
+                records_count += records
+
+        return records_count, counts
+
+    def select_pks(self, choice: int, yes: bool = True) -> np.ndarray:
+        """Returns the pks of the records which have chosen the answer.
+
+        Args:
+            choice: Index of the choice.
+            yes: If True, the records with "yes" answer are selected, otherwise the records with "no" answer.
+
+        Returns:
+            Array of the pks.
+        """
+        index = choice if yes else self.size + choice
+        selected = [np.zeros(0, dtype=np.int64)]
+        for offset, chunk_size, records in self._chunk_headers():
+            pks, containers = self._read_chunk(offset, chunk_size, records)
+            selected.append(np.asarray(pks, dtype=np.int64)[containers[index].values()])
+        return np.concatenate(selected)
+
+    def read_yes_choices(
+        self, start: int = 0, end: Optional[int] = None
+    ) -> Generator[Tuple[np.ndarray, np.ndarray], None, None]:
+        """Yields the pks and the `yes` containers of the records converted to rows of bits, one chunk at once.
+
+        Args:
+            start: Position of the first record to read.
+            end: Position after the last record to read, by default all the records up to the end are read.
+
+        Yields:
+            Tuples with the array of pks, and the 2-D array with one row of bits (0 or 1) for each record,
+            where the bit of a choice is 1 if the record has "yes" answer for it.
+        """
+        first = 0
+        for offset, chunk_size, records in self._chunk_headers():
+            lo, hi = max(start - first, 0), records if end is None else min(end - first, records)
+            first += records
+            if hi <= 0:
+                break
+            if lo >= hi:
+                continue
+            pks, containers = self._read_chunk(offset, chunk_size, records)
+            bits = np.zeros((records, self.size), dtype=np.uint8)
+            for choice in range(self.size):
+                bits[containers[choice].values(), choice] = 1
+            yield np.asarray(pks[lo:hi], dtype=np.int64), bits[lo:hi]
+
+
+class BlocksDataFile(DataFile):
+    """Base class for the block structured data files.
+
+    The file is a list of blocks of the same size, each block has a header with:
+
+        - the number of records stored in the block (4B)
+        - the minimum and the maximum pk of the records (4B each)
+        - the precomputed counts for each choice (`size` * 4B)
+
+    and then space for `BLOCK_SIZE` records, encoded the same way as in the `records_file` format.
+
+    The counts of whole blocks are taken from the headers, without decoding the records.
+    The blocks which don't contain any of the pks from a given range, or from a given set of pks, are skipped.
+
+    Args:
+        BYTEORDER: Order of the bytes used in the data files.
+        file_path: Path of the data file.
+        size: Number of choices.
+        records_file: Data file defining the format of the records in the blocks.
+
+    Attributes:
+        BYTEORDER: Order of the bytes used in the data files.
+        BLOCK_SIZE: Maximum number of records stored in one block.
+        READ_CHUNK_SIZE: Number of blocks processed at once.
+        file_path: Path of the data file.
+        size: Number of choices.
+    """
+
+    BLOCK_SIZE = 4096
+    READ_CHUNK_SIZE = 16
+
+    def __init__(self, file_path: str, size: int, records_file: DataFile):
+        super().__init__(file_path)
+        self.size = size
+        self._records_file = records_file
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Numpy type describing one block stored in the data file."""
+        return np.dtype(
+            [
+                ("records_count", ">u4"),
+                ("min_pk", ">u4"),
+                ("max_pk", ">u4"),
+                ("counts", ">u4", (self.size,)),
+                ("records", self._records_file.dtype, (self.BLOCK_SIZE,)),
+            ]
+        )
+
+    def _count_records(self, records: np.ndarray) -> np.ndarray:
+        """Counts the choices in the records, the same way as the counts stored in the block headers.
+
+        Args:
+            records: Array of records.
+
+        Returns:
+            Array of counts indexed by the choice.
+        """
+        raise NotImplementedError
+
+    def write_many(self, values: List[Any]) -> None:
+        """Writes the values to the data file.
+
+        The values are stored in the free space of the last block, new blocks are created if needed.
+        The block headers are updated after the records are stored.
+
+        Args:
+            values: Values to store in the file.
+        """
+        if not values:
+            return
+
+        blocks = self.view()
+        if len(blocks) and blocks["records_count"][-1] < self.BLOCK_SIZE:
+            block, position = len(blocks) - 1, int(blocks["records_count"][-1])
+        else:
+            block, position = len(blocks), 0
+        del blocks
+
+        required_blocks = block + (position + len(values) + self.BLOCK_SIZE - 1) // self.BLOCK_SIZE
+        required_size = required_blocks * self.dtype.itemsize
+        with open(self.file_path, "r+b" if os.path.exists(self.file_path) else "w+b") as f:
+            if os.fstat(f.fileno()).st_size < required_size:
+                f.truncate(required_size)
+
+        data = np.memmap(self.file_path, dtype=self.dtype, mode="r+", shape=(required_blocks,))
+        records = self._records_file._encode(values)
+        while len(records):
+            free = self.BLOCK_SIZE - position
+            part, records = records[:free], records[free:]
+            end = position + len(part)
+            data["records"][block, position:end] = part
+
+            min_pk, max_pk = int(part["pk"].min()), int(part["pk"].max())
+            if position:
+                min_pk = min(min_pk, int(data["min_pk"][block]))
+                max_pk = max(max_pk, int(data["max_pk"][block]))
+            data["min_pk"][block] = min_pk
+            data["max_pk"][block] = max_pk
+            data["counts"][block] += self._count_records(part).astype(np.uint32)
+            data["records_count"][block] = end
+
+            block, position = block + 1, 0
+
+        data.flush()
+
+    def truncate(self, records: int) -> None:
+        """Removes all the records stored after the first `records` ones.
+
+        The header of the last kept block is calculated again from its records,
+        as an interrupted write could have changed it.
+
+        Args:
+            records: Number of records to keep.
+        """
+        if not os.path.exists(self.file_path):
+            return
+
+        block, position = divmod(records, self.BLOCK_SIZE)
+        if position and len(self.view()) > block:
+            data = np.memmap(self.file_path, dtype=self.dtype, mode="r+", shape=(block + 1,))
+            kept = data["records"][block, :position]
+            data["records_count"][block] = position
+            data["min_pk"][block] = kept["pk"].min()
+            data["max_pk"][block] = kept["pk"].max()
+            data["counts"][block] = self._count_records(kept)
+            data["records"][block, position:] = np.zeros(1, dtype=self._records_file.dtype)
+            data.flush()
+            del data
+            block += 1
+
+        with open(self.file_path, "r+b") as f:
+            if os.fstat(f.fileno()).st_size > block * self.dtype.itemsize:
+                f.truncate(block * self.dtype.itemsize)
+
+    def read(self) -> Generator[Any, None, None]:
+        """Yields a value from the data file.
+
+        Yields:
+            Value read from the file.
+        """
+        for block in self.view():
+            yield from self._records_file._decode(block["records"][: block["records_count"]])
+
+    def read_at(self, position: int) -> Optional[Any]:
+        """Reads the value stored at the position in the data file.
+
+        All the blocks except the last one are full, so the block with the record is found without reading anything.
+
+        Args:
+            position: Position of the record.
+
+        Returns:
+            The value, None if there is no record at the position.
+        """
+        blocks = self.view()
+        block, row = divmod(position, self.BLOCK_SIZE)
+        if block >= len(blocks) or row >= blocks["records_count"][block]:
+            return None
+        end = row + 1
+        return next(self._records_file._decode(blocks["records"][block, row:end]))
+
+    def _count_blocks(
+        self, pk_range: Optional[Tuple[int, int]] = None, pks: Optional[np.ndarray] = None
+    ) -> Tuple[int, np.ndarray]:
+        """Counts the records and the choices.
+
+        The blocks with all the pks in the `pk_range` are counted using only the headers,
+        the blocks with none of the pks in the range are skipped,
+        the records of all the other blocks are filtered and counted.
+        With the `pks`, the blocks which range of pks doesn't contain any of the `pks` are skipped,
+        and the records of all the other blocks are filtered and counted.
+
+        Args:
+            pk_range: If set, only the records with pk in the range (inclusive) are counted.
+            pks: If set, only the records with pk in the sorted array are counted.
+
+        Returns:
+            A tuple with the number of records and an array of counts indexed by the choice.
+        """
+        blocks = self.view()
+        records_counts = blocks["records_count"].astype(np.int64)
+        used = records_counts > 0
+
+        min_pks, max_pks = blocks["min_pk"].astype(np.int64), blocks["max_pk"].astype(np.int64)
+        if pk_range is None:
+            whole, partial = used, np.zeros(len(blocks), dtype=bool)
+        else:
+            whole = used & (min_pks >= pk_range[0]) & (max_pks <= pk_range[1])
+            partial = used & ~whole & (min_pks <= pk_range[1]) & (max_pks >= pk_range[0])
+
+        if pks is not None:
+            # there is a selected pk between the minimum and the maximum pk of the block
+            overlapping = np.searchsorted(pks, min_pks, side="left") < np.searchsorted(pks, max_pks, side="right")
+            partial = (whole | partial) & overlapping
+            whole = np.zeros(len(blocks), dtype=bool)
+
+        records = int(records_counts[whole].sum())
+        counts = blocks["counts"][whole].sum(axis=0, dtype=np.int64)
+
+        for index in np.flatnonzero(partial).tolist():
+            block_records = blocks["records"][index, : records_counts[index]]
+            block_records = block_records[self._pk_mask(block_records["pk"], pk_range, pks)]
+            records += len(block_records)
+            counts += self._count_records(block_records)
+
+        return records, counts
+
+    def _select(self, records: np.ndarray, choice: int, yes: bool) -> np.ndarray:
+        """Checks which of the records have chosen the answer.
+
+        Args:
+            records: Array of records.
+            choice: Index of the choice.
+            yes: If True, the "yes" answers are checked, otherwise the "no" answers.
+
+        Returns:
+            Array of booleans, one for each of the records.
+        """
+        raise NotImplementedError
+
+    def _select_pks(self, choice: int, yes: bool) -> np.ndarray:
+        """Returns the pks of the records which have chosen the answer.
+
+        Args:
+            choice: Index of the choice.
+            yes: If True, the "yes" answers are checked, otherwise the "no" answers.
+
+        Returns:
+            Array of the pks.
+        """
+        selected = [np.zeros(0, dtype=np.int64)]
+        for block in self.view():
+            records = block["records"][: block["records_count"]]
+            selected.append(records["pk"][self._select(records, choice, yes)].astype(np.int64))
+        return np.concatenate(selected)
+
+
+class SingleValueBlocksDataFile(BlocksDataFile):
+    """Class for reading and writing SingleValue in blocks with precomputed counts of the values.
+
+    Args:
+        BYTEORDER: Order of the bytes used in the data files.
+        file_path: Path of the data file.
+        size: Number of possible values.
+
+    Attributes:
+        BYTEORDER: Order of the bytes used in the data files.
+        file_path: Path of the data file.
+        size: Number of possible values.
+    """
+
+    def __init__(self, file_path: str, size: int):
+        super().__init__(file_path, size, SingleValueDataFile(file_path))
+
+    def _count_records(self, records: np.ndarray) -> np.ndarray:
+        return SingleValueDataFile._count(records, self.size)
+
+    def _select(self, records: np.ndarray, choice: int, yes: bool) -> np.ndarray:
+        return records["value"] == choice
+
+    def count_values(
+        self, size: int, pk_range: Optional[Tuple[int, int]] = None, pks: Optional[np.ndarray] = None
+    ) -> Tuple[int, np.ndarray]:
+        """Counts the records and the number of times each value was chosen.
+
+        Args:
+            size: Number of possible values, at least the one used for creating the file,
+                  the counts of the values appended later are zeros.
+            pk_range: If set, only the records with pk in the range (inclusive) are counted.
+            pks: If set, only the records with pk in the sorted array are counted.
+
+        Returns:
+            A tuple with the number of records and an array of counts indexed by the value.
+        """
+        if size < self.size:
+            raise ValueError(f"The file stores counts for {self.size} values, not for {size}.")
+        records, counts = self._count_blocks(pk_range, pks)
+        return records, np.pad(counts, (0, size - self.size))
+
+    def select_pks(self, value: int) -> np.ndarray:
+        """Returns the pks of the records which have chosen the value.
+
+        Args:
+            value: Index of the value.
+
+        Returns:
+            Array of the pks.
+        """
+        return self._select_pks(value, True)
+
+
+class MultiValueBlocksDataFile(BlocksDataFile):
+    """Class for reading and writing MultiValue in blocks with precomputed counts of the "yes" answers.
+
+    Args:
+        BYTEORDER: Order of the bytes used in the data files.
+        file_path: Path of the data file.
+        size: Number of choices.
+
+    Attributes:
+        BYTEORDER: Order of the bytes used in the data files.
+        file_path: Path of the data file.
+        size: Number of choices.
+    """
+
+    def __init__(self, file_path: str, size: int):
+        super().__init__(file_path, size, MultiValueDataFile(file_path, size))
+
+    def _count_records(self, records: np.ndarray) -> np.ndarray:
+        return self._records_file._count(records)
+
+    def _select(self, records: np.ndarray, choice: int, yes: bool) -> np.ndarray:
+        return self._records_file._select(records, choice, yes)
+
+    def count_yes_choices(
+        self, pk_range: Optional[Tuple[int, int]] = None, pks: Optional[np.ndarray] = None
+    ) -> Tuple[int, np.ndarray]:
+        """Counts the records and the "yes" answers for each choice.
+
+        Args:
+            pk_range: If set, only the records with pk in the range (inclusive) are counted.
+            pks: If set, only the records with pk in the sorted array are counted.
+
+        Returns:
+            A tuple with the number of records and an array of "yes" counts indexed by the choice.
+        """
+        return self._count_blocks(pk_range, pks)
+
+    def select_pks(self, choice: int, yes: bool = True) -> np.ndarray:
+        """Returns the pks of the records which have chosen the answer.
+
+        Args:
+            choice: Index of the choice.
+            yes: If True, the records with "yes" answer are selected, otherwise the records with "no" answer.
+
+        Returns:
+            Array of the pks.
+        """
+        return self._select_pks(choice, yes)
+
+    def read_yes_choices(
+        self, start: int = 0, end: Optional[int] = None
+    ) -> Generator[Tuple[np.ndarray, np.ndarray], None, None]:
+        """Yields the pks and the unpacked `yes` bitfields of the records, one block at once.
+
+        Args:
+            start: Position of the first record to read.
+            end: Position after the last record to read, by default all the records up to the end are read.
+
+        Yields:
+            Tuples with the array of pks, and the 2-D array with one row of bits (0 or 1) for each record,
+            where the bit of a choice is 1 if the record has "yes" answer for it.
+        """
+        first = 0
+        for block in self.view():
+            records = int(block["records_count"])
+            lo, hi = max(start - first, 0), records if end is None else min(end - first, records)
+            first += records
+            if hi <= 0:
+                break
+            if lo >= hi:
+                continue
+            block_records = block["records"][lo:hi]
+            yield block_records["pk"].astype(np.int64), self._records_file._yes_bits(block_records)
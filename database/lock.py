@@ -0,0 +1,65 @@
+import fcntl
+import threading
+from typing import Optional, TextIO
+
+
+class WriterLock:
+    """Lock for the writers of the database, both the threads of one process and the processes.
+
+    The threads are synchronized with a reentrant lock, the processes with an exclusive `flock()` of the lock file.
+    The file is locked only by the outermost acquisition of the thread, so the lock is reentrant as a whole.
+    The OS releases the file lock when the process dies, so a crashed writer never blocks the other ones.
+
+    Args:
+        file_path: Path of the lock file, if None, then only the threads are synchronized.
+
+    Attributes:
+        file_path: Path of the lock file.
+    """
+
+    def __init__(self, file_path: Optional[str] = None):
+        self.file_path = file_path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file: Optional[TextIO] = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Acquires the lock.
+
+        Args:
+            blocking: If False, then the lock is not acquired when it's held by another thread or process.
+
+        Returns:
+            True if the lock was acquired.
+        """
+        if not self._lock.acquire(blocking):
+            return False
+
+        if self._depth == 0 and self.file_path is not None:
+            lock_file = open(self.file_path, "a")
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                self._lock.release()
+                return False
+            self._file = lock_file
+
+        self._depth += 1
+        return True
+
+    def release(self) -> None:
+        """Releases the lock, the file is unlocked by the outermost release."""
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+    def __enter__(self) -> "WriterLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.release()
@@ -0,0 +1,160 @@
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+class PkIndex:
+    """Index of the pks stored in a collection, used for skipping the answers which are already stored.
+
+    The pks are kept in a sorted array, which is searched with binary search, and in a set of the pks
+    added later. When the set grows, it's merged into the array, so both checking and adding a pk
+    take (amortized) constant or logarithmic time, regardless of the number of the stored pks.
+
+    Args:
+        pks: Sorted array of unique pks, it can be a memory-mapped file.
+        recent: Pks which are not in the array.
+        indexed: Number of the records of the collection in the index (including the records of the updated pks).
+
+    Attributes:
+        MIN_MERGE_SIZE: Minimal number of pks in the set to merge it into the array.
+        MERGE_RATIO: The set is merged when it's larger than `1 / MERGE_RATIO` of the array.
+        indexed: Number of the records of the collection in the index.
+        merged: True if the array was changed since the index was loaded or stored.
+    """
+
+    MIN_MERGE_SIZE = 65536
+    MERGE_RATIO = 64
+
+    def __init__(self, pks: np.ndarray, recent: Iterable[int] = (), indexed: int = 0):
+        self._pks = pks
+        self._recent = set(recent)
+        self.indexed = indexed
+        self.merged = False
+
+    def __len__(self) -> int:
+        return len(self._pks) + len(self._recent)
+
+    def __contains__(self, pk: int) -> bool:
+        if pk in self._recent:
+            return True
+        if pk < 0 or pk > 0xFFFFFFFF:
+            return False
+        position = int(np.searchsorted(self._pks, np.uint32(pk)))
+        return position < len(self._pks) and int(self._pks[position]) == pk
+
+    def add_many(self, pks: Iterable[int]) -> None:
+        """Adds the pks of the records stored after the indexed ones.
+
+        Args:
+            pks: Pks of the records.
+        """
+        pks = list(pks)
+        self._recent.update(pks)
+        self.indexed += len(pks)
+        if len(self._recent) >= max(self.MIN_MERGE_SIZE, len(self._pks) // self.MERGE_RATIO):
+            self.merge()
+
+    def merge(self) -> None:
+        """Merges the set of the added pks into the sorted array."""
+        if not self._recent:
+            return
+        recent = np.fromiter(self._recent, dtype=np.uint32, count=len(self._recent))
+        self._pks = np.union1d(np.asarray(self._pks, dtype=np.uint32), recent)
+        self._recent = set()
+        self.merged = True
+
+    def sorted_pks(self) -> np.ndarray:
+        """Returns all the pks, the added ones are merged first.
+
+        Returns:
+            Sorted array of all the pks.
+        """
+        self.merge()
+        return self._pks
+
+
+class OffsetIndex:
+    """Index of the positions of the records stored in a collection, by their pks.
+
+    The position of a record is the position of its pk in the ids files of the collection (the compacted files first),
+    the same as the position of the record in the data files. Like in `PkIndex`, the pks with the positions
+    are kept in a sorted array, which is searched with binary search, and in a dictionary of the pks added later,
+    which is merged into the array when it grows.
+
+    An updated pk has many records, only the position of the last one is kept.
+
+    Args:
+        records: Array of records with the `pk` and `position` fields, sorted by pk, it can be a memory-mapped file.
+        indexed: Number of the records of the collection in the array (including the records of the updated pks).
+
+    Attributes:
+        MIN_MERGE_SIZE: Minimal number of records in the dictionary to merge it into the array.
+        MERGE_RATIO: The dictionary is merged when it's larger than `1 / MERGE_RATIO` of the array.
+        indexed: Number of the records of the collection in the index.
+        merged: True if the array was changed since the index was loaded or stored.
+    """
+
+    MIN_MERGE_SIZE = 65536
+    MERGE_RATIO = 64
+
+    def __init__(self, records: np.ndarray, indexed: int):
+        self._records = records
+        self._recent: Dict[int, int] = dict()
+        self.indexed = indexed
+        self.merged = False
+
+    def get(self, pk: int) -> Optional[int]:
+        """Finds the position of the last record with the pk.
+
+        Args:
+            pk: Pk of the record.
+
+        Returns:
+            Position of the record, None if there is no record with the pk.
+        """
+        position = self._recent.get(pk)
+        if position is not None:
+            return position
+        if pk < 0 or pk > 0xFFFFFFFF:
+            return None
+        pks = self._records["pk"]
+        row = int(np.searchsorted(pks, np.uint32(pk)))
+        if row < len(pks) and int(pks[row]) == pk:
+            return int(self._records["position"][row])
+        return None
+
+    def add_many(self, pks: List[int]) -> None:
+        """Adds the pks of the records stored after the indexed ones.
+
+        Args:
+            pks: Pks of the records, in the order of the records.
+        """
+        self._recent.update((pk, position) for position, pk in enumerate(pks, self.indexed))
+        self.indexed += len(pks)
+        if len(self._recent) >= max(self.MIN_MERGE_SIZE, len(self._records) // self.MERGE_RATIO):
+            self.merge()
+
+    def merge(self) -> None:
+        """Merges the dictionary of the added records into the sorted array.
+
+        The positions from the dictionary replace the positions of the same pks in the array, as they are newer.
+        """
+        if not self._recent:
+            return
+        recent = np.zeros(len(self._recent), dtype=self._records.dtype)
+        recent["pk"] = list(self._recent.keys())
+        recent["position"] = list(self._recent.values())
+        records = np.asarray(self._records)
+        records = np.concatenate([records[~np.isin(records["pk"], recent["pk"])], recent])
+        self._records = records[np.argsort(records["pk"], kind="stable")]
+        self._recent = dict()
+        self.merged = True
+
+    def sorted_records(self) -> np.ndarray:
+        """Returns all the records, the added ones are merged first.
+
+        Returns:
+            Array of all the records sorted by pk.
+        """
+        self.merge()
+        return self._records
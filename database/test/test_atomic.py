@@ -0,0 +1,65 @@
+import os
+from unittest import mock
+
+import pytest
+
+from .common import temp_dir
+from ..atomic import atomic_write
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_dir
+
+
+def test_replacing_file(temp_dir):
+    """The file should be created and replaced, without leaving the temporary files."""
+    file_path = os.path.join(temp_dir, "data")
+    atomic_write(file_path, b"old")
+    atomic_write(file_path, b"new")
+
+    with open(file_path, "rb") as f:
+        assert b"new" == f.read()
+    assert ["data"] == os.listdir(temp_dir)
+
+
+def test_synchronizing_file_and_directory(temp_dir):
+    """Both the temporary file and the directory should be synchronized, the file before the replacement."""
+    file_path = os.path.join(temp_dir, "data")
+    replace = os.replace
+    events = []
+
+    def fsync(fd):
+        events.append(("fsync", os.path.isdir(f"/proc/self/fd/{fd}")))
+
+    def replace_file(source, destination):
+        events.append(("replace", destination))
+        replace(source, destination)
+
+    with mock.patch("os.fsync", side_effect=fsync), mock.patch("os.replace", side_effect=replace_file):
+        atomic_write(file_path, b"data")
+
+    assert [("fsync", False), ("replace", file_path), ("fsync", True)] == events
+
+
+def test_replacing_without_synchronization(temp_dir):
+    """Without the synchronization, the file should be replaced without any `fsync()`."""
+    file_path = os.path.join(temp_dir, "data")
+    with mock.patch("os.fsync") as fsync:
+        atomic_write(file_path, b"data", sync=False)
+
+    fsync.assert_not_called()
+    with open(file_path, "rb") as f:
+        assert b"data" == f.read()
+
+
+def test_failed_write_keeps_old_content(temp_dir):
+    """When the new content can't be written, the old file should not be changed, and there is no temporary file."""
+    file_path = os.path.join(temp_dir, "data")
+    atomic_write(file_path, b"old")
+
+    with mock.patch("os.fsync", side_effect=OSError("disk full")):
+        with pytest.raises(OSError):
+            atomic_write(file_path, b"new")
+
+    with open(file_path, "rb") as f:
+        assert b"old" == f.read()
+    assert ["data"] == os.listdir(temp_dir)
@@ -0,0 +1,87 @@
+from random import randrange
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from ..bitmap import ArrayContainer, BitmapContainer, Container, ContainerType, RoaringBitmap, RunContainer
+
+
+def test_container_type_is_chosen_by_size():
+    """The smallest container should be chosen for the values."""
+    assert isinstance(Container.from_values([]), ArrayContainer)
+    assert isinstance(Container.from_values([1, 5, 1000]), ArrayContainer)
+    assert isinstance(Container.from_values(range(100, 5000)), RunContainer)
+    assert isinstance(Container.from_values(range(0, 65536, 2)), BitmapContainer)
+
+
+def test_container_is_abstract():
+    """The base container should not be created, only its subclasses with all the methods."""
+    with pytest.raises(TypeError):
+        Container()
+
+
+def test_container_serialization():
+    """The containers should be the same after serialization."""
+    for values in [[], [1, 5, 1000], list(range(100, 5000)), list(range(0, 65536, 2))]:
+        container = Container.from_values(values)
+        restored = Container.from_bytes(ContainerType(container.TYPE), container.to_bytes())
+        assert container == restored
+        assert values == restored.values().tolist()
+        assert len(values) == restored.cardinality
+
+
+def test_container_operations():
+    """The union and intersection should work for all the container types."""
+    sets = [
+        {1, 5, 1000},
+        set(range(100, 5000)) | set(range(7000, 7010)),
+        set(range(0, 65536, 2)),
+        {randrange(0, 65536) for _ in range(0, 3000)},
+    ]
+    for first in sets:
+        for second in sets:
+            a = Container.from_values(sorted(first))
+            b = Container.from_values(sorted(second))
+            assert sorted(first & second) == (a & b).values().tolist()
+            assert sorted(first | second) == (a | b).values().tolist()
+            assert len(first & second) == (a & b).cardinality
+            assert len(first & second) == a.and_cardinality(b)
+            values = np.array(sorted(second), dtype=np.uint16)
+            assert [value in first for value in sorted(second)] == a.contains(values).tolist()
+
+
+def test_run_operations_keep_runs():
+    """The runs should be intersected and joined without expanding them to values or bitmaps."""
+    a = Container.from_values(list(range(100, 5000)) + list(range(7000, 9000)))
+    b = Container.from_values(list(range(0, 200)) + list(range(4990, 8000)))
+
+    with mock.patch.object(RunContainer, "values", side_effect=AssertionError("values expanded")):
+        with mock.patch.object(RunContainer, "bitmap", side_effect=AssertionError("bitmap expanded")):
+            assert [[100, 99], [4990, 9], [7000, 999]] == (a & b).runs().tolist()
+            assert [[0, 8999]] == (a | b).runs().tolist()
+            assert 100 + 10 + 1000 == a.and_cardinality(b)
+
+    assert isinstance(a & b, RunContainer)
+    assert isinstance(a | Container.from_values(range(0, 65536, 2)), BitmapContainer)
+    assert isinstance(a & Container.from_values(range(0, 65536, 2)), ArrayContainer)
+
+
+def test_roaring_bitmap():
+    """The roaring bitmap should store values spread over many containers."""
+    first = {randrange(0, 2 ** 20) for _ in range(0, 5000)} | set(range(2 ** 18, 2 ** 18 + 70000))
+    second = {randrange(0, 2 ** 20) for _ in range(0, 5000)}
+
+    a = RoaringBitmap(first)
+    b = RoaringBitmap(sorted(second))
+
+    assert len(first) == len(a)
+    assert sorted(first) == a.to_array().tolist()
+    assert sorted(first & second) == (a & b).to_array().tolist()
+    assert sorted(first | second) == (a | b).to_array().tolist()
+    assert 2 ** 18 + 5 in a
+    assert 2 ** 21 not in a
+
+    a.add_many([2 ** 21])
+    assert 2 ** 21 in a
+    assert RoaringBitmap(first | {2 ** 21}) == a
@@ -0,0 +1,126 @@
+import os
+from random import randrange
+
+import numpy as np
+
+from .common import temp_file
+from .test_multiple_value_file import make_unique_int_list
+from ..file_format import MultiValueBlocksDataFile, MultiValue, SingleValueBlocksDataFile, SingleValue
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_file
+
+
+def test_non_existing_file():
+    """For non existing file, we should get an empty list when reading the values."""
+    data_file = SingleValueBlocksDataFile("akjdhakjdhas", 10)
+    assert [] == list(data_file.read())
+    records, counts = data_file.count_values(10)
+    assert 0 == records
+    assert [0] * 10 == list(counts)
+
+    data_file = MultiValueBlocksDataFile("akjdhakjdhas", 10)
+    assert [] == list(data_file.read())
+    records, counts = data_file.count_yes_choices()
+    assert 0 == records
+    assert [0] * 10 == list(counts)
+
+
+def test_writing_one_value(temp_file):
+    """We should be able to write and read one value, the file should have one block."""
+    data_file = SingleValueBlocksDataFile(temp_file, 10)
+    data_file.BLOCK_SIZE = 16
+    value = SingleValue(pk=123, value=4)
+    data_file.write(value)
+
+    # the expected size is:
+    #   header  [4B + 4B + 4B + 10 * 4B]
+    #   records [16 * 6B]
+    assert 4 + 4 + 4 + 10 * 4 + 16 * 6 == os.path.getsize(temp_file)
+    assert [value] == list(data_file.read())
+
+
+def test_single_values_in_many_blocks(temp_file):
+    """The counts from the block headers should be the same as the counts of the records."""
+    size = 10
+    data_file = SingleValueBlocksDataFile(temp_file, size)
+    data_file.BLOCK_SIZE = 16
+
+    values = [SingleValue(pk=pk, value=randrange(0, size)) for pk in range(0, randrange(50, 100))]
+    data_file.write_many(values[:7])
+    data_file.write_many(values[7:40])
+    data_file.write(values[40])
+    data_file.write_many(values[41:])
+
+    assert values == list(data_file.read())
+
+    records, counts = data_file.count_values(size)
+    assert len(values) == records
+    assert [sum(1 for v in values if v.value == n) for n in range(0, size)] == list(counts)
+
+    # the range covers whole blocks, and parts of the first and the last one
+    selected = [v for v in values if 10 <= v.pk <= 37]
+    records, counts = data_file.count_values(size, pk_range=(10, 37))
+    assert len(selected) == records
+    assert [sum(1 for v in selected if v.value == n) for n in range(0, size)] == list(counts)
+
+
+def test_multiple_values_in_many_blocks(temp_file):
+    """The counts from the block headers should be the same as the counts of the records."""
+    size = 100
+    data_file = MultiValueBlocksDataFile(temp_file, size)
+    data_file.BLOCK_SIZE = 16
+
+    values = [
+        MultiValue(
+            pk=pk, yes_choices=make_unique_int_list(0, size, size), no_choices=make_unique_int_list(0, size, size),
+        )
+        for pk in range(0, randrange(50, 100))
+    ]
+    data_file.write_many(values[:7])
+    data_file.write_many(values[7:])
+
+    assert values == list(data_file.read())
+
+    for pk_range, selected in [(None, values), ((10, 37), [v for v in values if 10 <= v.pk <= 37])]:
+        expected = [0] * size
+        for value in selected:
+            for position in value.yes_choices:
+                expected[position] += 1
+
+        records, counts = data_file.count_yes_choices(pk_range)
+        assert len(selected) == records
+        assert expected == list(counts)
+
+
+def test_selecting_pks_in_blocks(temp_file):
+    """The selected pks should be the ones with the chosen answer, and only they should be counted."""
+    size = 10
+    data_file = SingleValueBlocksDataFile(temp_file, size)
+    data_file.BLOCK_SIZE = 16
+
+    values = [SingleValue(pk=pk, value=randrange(0, size)) for pk in range(0, randrange(50, 100))]
+    data_file.write_many(values)
+
+    assert [v.pk for v in values if v.value == 3] == data_file.select_pks(3).tolist()
+
+    # the pks are only in the first and the last block, the other blocks are skipped
+    pks = np.array([2, 5, len(values) - 1])
+    selected = [v for v in values if v.pk in pks]
+    for pk_range, expected in [(None, selected), ((3, len(values)), selected[1:])]:
+        records, counts = data_file.count_values(size, pk_range=pk_range, pks=pks)
+        assert len(expected) == records
+        assert [sum(1 for v in expected if v.value == n) for n in range(0, size)] == list(counts)
+
+    multi_data_file = MultiValueBlocksDataFile(temp_file + ".multi", size)
+    multi_data_file.BLOCK_SIZE = 16
+    values = [MultiValue(pk=pk, yes_choices=[pk % size], no_choices=[(pk + 1) % size]) for pk in range(0, 40)]
+    multi_data_file.write_many(values)
+    try:
+        assert [3, 13, 23, 33] == multi_data_file.select_pks(3).tolist()
+        assert [2, 12, 22, 32] == multi_data_file.select_pks(3, yes=False).tolist()
+        records, counts = multi_data_file.count_yes_choices(pks=np.array([3, 13, 14]))
+        assert 3 == records
+        assert [0, 0, 0, 2, 1, 0, 0, 0, 0, 0] == list(counts)
+    finally:
+        os.remove(multi_data_file.file_path)
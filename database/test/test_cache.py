@@ -0,0 +1,97 @@
+import os
+
+from .common import temp_dir
+from ..cache import QueryCache
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_dir
+
+
+def test_memory_cache():
+    """The value should be returned only for the version it was stored for."""
+    cache = QueryCache()
+    assert cache.get("key", 1) is None
+
+    cache.put("key", 1, {"a": [1, 2]})
+    assert {"a": [1, 2]} == cache.get("key", 1)
+    assert cache.get("key", 2) is None
+    assert cache.get("other", 1) is None
+
+    cache.put("key", 2, "new")
+    assert cache.get("key", 1) is None
+    assert "new" == cache.get("key", 2)
+
+    cache.clear()
+    assert cache.get("key", 2) is None
+
+
+def test_max_entries():
+    """The oldest entries should be removed first."""
+    cache = QueryCache(max_entries=2)
+    cache.put("one", 1, 1)
+    cache.put("two", 1, 2)
+    cache.put("one", 2, 1)
+    cache.put("three", 1, 3)
+
+    assert cache.get("two", 1) is None
+    assert 1 == cache.get("one", 2)
+    assert 3 == cache.get("three", 1)
+
+
+def test_shared_cache(temp_dir):
+    """The entries stored in the file should be visible for the other cache objects."""
+    path = os.path.join(temp_dir, "cache.json")
+    first = QueryCache(path)
+    second = QueryCache(path)
+
+    first.put("key", (1, 2), "value")
+    assert "value" == first.get("key", [1, 2])
+    assert second.get("key", [1, 2]) is None
+    first.flush()
+    assert "value" == second.get("key", [1, 2])
+
+    second.put("other", 1, "other value")
+    second.flush()
+    assert "other value" == first.get("other", 1)
+    assert "value" == QueryCache(path).get("key", [1, 2])
+    assert [path] == [os.path.join(temp_dir, name) for name in os.listdir(temp_dir)]
+
+
+def test_broken_cache_file(temp_dir):
+    """A broken cache file should be ignored."""
+    path = os.path.join(temp_dir, "cache.json")
+    with open(path, "w") as f:
+        f.write("{broken")
+
+    cache = QueryCache(path)
+    assert cache.get("key", 1) is None
+    cache.put("key", 1, "value")
+    cache.flush()
+    assert "value" == QueryCache(path).get("key", 1)
+
+
+def test_delayed_write(temp_dir):
+    """The entries put within the interval should be written together, by the timer."""
+    path = os.path.join(temp_dir, "cache.json")
+    cache = QueryCache(path, store_interval=0.05)
+    cache.put("one", 1, 1)
+    cache.put("two", 1, 2)
+    assert not os.path.exists(path)
+
+    cache._timer.join()
+    other = QueryCache(path)
+    assert 1 == other.get("one", 1)
+    assert 2 == other.get("two", 1)
+
+
+def test_read_only_directory(temp_dir, caplog):
+    """When the file can't be written, the entries should be still cached in memory, without an exception."""
+    path = os.path.join(temp_dir, "missing", "cache.json")
+    cache = QueryCache(path)
+    cache.put("key", 1, "value")
+    cache.flush()
+    cache.put("other", 1, "value")
+    cache.flush()
+
+    assert "value" == cache.get("key", 1)
+    assert 1 == len([record for record in caplog.records if record.levelname == "WARNING"])
@@ -0,0 +1,154 @@
+import os
+
+import pytest
+
+from .common import copy_config, temp_dir
+from .test_database import LAYOUT_CONFIGS, read_ids
+from ..compaction import Compactor
+from ..db import Database, Layout, Sorting
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_dir
+
+
+def store_sample_answers(db: Database, pks: list) -> None:
+    """Stores answers with the values depending on the pk."""
+    db.store_answers(
+        [
+            {
+                "pk": str(pk),
+                f"collection_one.singer_{['one', 'two', 'three'][pk % 3]}": "yes",
+                f"collection_one.singer_{['one', 'two', 'three'][(pk + 1) % 3]}": "no",
+                "collection_two": f"brand_{['one', 'two'][pk % 2]}",
+            }
+            for pk in pks
+        ]
+    )
+
+
+def count_all(db: Database, pk_range=None) -> list:
+    """Returns results of counting both collections."""
+    return [
+        (answer.results, answer.data_size)
+        for answer in [
+            db.count("collection_one", sorting=Sorting.ASC, pk_range=pk_range),
+            db.count("collection_two", sorting=Sorting.ASC, pk_range=pk_range),
+        ]
+    ]
+
+
+@pytest.mark.parametrize("config_name", LAYOUT_CONFIGS)
+@pytest.mark.parametrize("layout", [Layout.ROWS, Layout.BLOCKS, Layout.COLUMNS, Layout.ROARING])
+def test_compaction_keeps_the_counts(temp_dir, config_name, layout):
+    """The counts should be the same before and after the compaction, also for the answers stored later."""
+    copy_config(config_name, temp_dir)
+    db = Database(temp_dir)
+    store_sample_answers(db, [5, 3, 9, 1, 7])
+    store_sample_answers(db, [2, 8, 4])
+    expected = count_all(db)
+    expected_range = count_all(db, pk_range=(3, 7))
+
+    assert db.compact("collection_one", layout)
+    single_layout = {Layout.COLUMNS: Layout.BLOCKS, Layout.ROARING: Layout.PACKED}.get(layout, layout)
+    assert db.compact("collection_two", single_layout)
+    assert not db.compact("collection_one", layout)
+
+    assert expected == count_all(db)
+    assert expected_range == count_all(db, pk_range=(3, 7))
+    assert [1, 2, 3, 4, 5, 7, 8, 9] == read_ids(db, "collection_one")
+    assert 0 == db.tail_records("collection_one")
+
+    # the new answers are appended to the new tail files
+    store_sample_answers(db, [6, 3, 10])
+    assert 2 == db.tail_records("collection_one")
+
+    db = Database(temp_dir)
+    assert [1, 2, 3, 4, 5, 7, 8, 9, 6, 10] == read_ids(db, "collection_one")
+
+    expected = count_all(db)
+    db.compact("collection_one", layout)
+    db.compact("collection_two")
+
+    assert expected == count_all(db)
+    assert 10 == expected[0][1]
+
+
+def test_compaction_of_single_collection_into_columns(temp_dir):
+    """The columns layout is available only for the multiple answers collections."""
+    copy_config("good_sample_config", temp_dir)
+    db = Database(temp_dir)
+    store_sample_answers(db, [1, 2])
+
+    with pytest.raises(ValueError) as e:
+        db.compact("collection_two", Layout.COLUMNS)
+
+    assert "available only for multiple answers" in str(e)
+
+
+def test_compaction_removes_obsolete_files(temp_dir):
+    """The files replaced by a compaction should be removed by the next compaction."""
+    copy_config("good_sample_config", temp_dir)
+    db = Database(temp_dir)
+
+    store_sample_answers(db, [1, 2, 3])
+    db.compact("collection_one")
+    assert os.path.exists(os.path.join(temp_dir, "collection_one.multi.data"))
+    assert os.path.exists(os.path.join(temp_dir, "collection_one.1.multi.blocks"))
+
+    store_sample_answers(db, [4, 5])
+    db.compact("collection_one")
+
+    files = sorted(name for name in os.listdir(temp_dir) if name.startswith("collection_one"))
+    assert [
+        "collection_one.1.ids",
+        "collection_one.1.multi.blocks",
+        "collection_one.2.ids",
+        "collection_one.2.multi.data",
+        "collection_one.3.ids",
+        "collection_one.3.multi.blocks",
+        "collection_one.compaction.lock",
+        "collection_one.counts",
+        "collection_one.offsets",
+        "collection_one.pks",
+        "collection_one.sample",
+        "collection_one.version",
+    ] == files
+    assert 5 == db.count("collection_one").data_size
+
+
+def test_reader_switches_to_compacted_files(temp_dir):
+    """A database opened before the compaction should read the new files after the manifest is replaced."""
+    copy_config("good_sample_config", temp_dir)
+    writer = Database(temp_dir)
+    reader = Database(temp_dir)
+
+    store_sample_answers(writer, [1, 2, 3, 4])
+    expected = count_all(reader)
+
+    writer.compact("collection_one")
+    store_sample_answers(writer, [5, 6])
+    writer.compact("collection_one")
+
+    assert 4 == expected[0][1]
+    assert 6 == reader.count("collection_one").data_size
+
+
+def test_compactor(temp_dir):
+    """The compactor should compact only the collections with enough appended records."""
+    copy_config("good_sample_config", temp_dir)
+    db = Database(temp_dir)
+    store_sample_answers(db, [1, 2, 3])
+
+    compactor = Compactor(db, interval=60, min_records=3, layouts={"collection_one": Layout.COLUMNS})
+    compactor.compact()
+    assert 0 == db.tail_records("collection_one")
+    assert Layout.COLUMNS == db._segments["collection_one"].base_layout
+    assert Layout.BLOCKS == db._segments["collection_two"].base_layout
+
+    store_sample_answers(db, [4, 5])
+    compactor.compact()
+    assert 2 == db.tail_records("collection_one")
+
+    compactor.start()
+    compactor.stop()
+    assert not compactor.is_alive()
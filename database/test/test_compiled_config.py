@@ -0,0 +1,42 @@
+from .common import temp_file
+from ..compiled_config import CompiledConfig, CompiledConfigFile
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_file
+
+
+def make_config() -> CompiledConfig:
+    """Creates the compiled config for one collection."""
+    return CompiledConfig.build(
+        choices={"singers": ["abba", "10cc"]},
+        collections={"known_singers": (True, "singers", "rows")},
+        routes={"known_singers.abba": ("known_singers", 0), "known_singers.10cc": ("known_singers", 1)},
+    )
+
+
+def test_non_existing_file():
+    """For non existing file, there should be no compiled config."""
+    assert CompiledConfigFile("akjdhakjdhas").read(b"{}") is None
+
+
+def test_writing_and_reading(temp_file):
+    """The config should be read for the same config file only."""
+    compiled_file = CompiledConfigFile(temp_file)
+    config = make_config()
+    compiled_file.write(b'{"a": 1}', config)
+
+    read_config = compiled_file.read(b'{"a": 1}')
+    assert (config.choices, config.collections) == (read_config.choices, read_config.collections)
+    assert {"known_singers.abba": ("known_singers", 0), "known_singers.10cc": ("known_singers", 1)} == (
+        read_config.routes
+    )
+    assert compiled_file.read(b'{"a": 2}') is None
+
+
+def test_broken_file(temp_file):
+    """A broken file should be ignored."""
+    compiled_file = CompiledConfigFile(temp_file)
+    compiled_file.write(b"{}", make_config())
+    with open(temp_file, "r+b") as f:
+        f.truncate(20)
+    assert compiled_file.read(b"{}") is None
@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+
+from .common import temp_file
+from ..file_format import Counters, CountersDataFile, VersionDataFile
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_file
+
+
+def test_non_existing_file():
+    """For non existing file, there should be no counters."""
+    assert CountersDataFile("akjdhakjdhas", 10).read_counters() is None
+
+
+def test_writing_counters(temp_file):
+    """The written counters should replace the previous ones."""
+    data_file = CountersDataFile(temp_file, 3)
+    counters = Counters(records=5, yes=np.array([1, 2, 3]), no=np.array([0, 4, 2 ** 40]))
+    data_file.write_counters(counters)
+    assert 8 + 2 * 3 * 8 == os.path.getsize(temp_file)
+    assert counters == data_file.read_counters()
+
+    counters += Counters(records=1, yes=np.array([1, 0, 0]), no=np.array([0, 0, 1]))
+    data_file.write_counters(counters)
+    assert Counters(records=6, yes=np.array([2, 2, 3]), no=np.array([0, 4, 2 ** 40 + 1])) == data_file.read_counters()
+    assert not os.path.exists(temp_file + ".tmp")
+
+
+def test_counters_for_other_number_of_choices(temp_file):
+    """The counters written for another number of choices should be ignored."""
+    CountersDataFile(temp_file, 3).write_counters(Counters(records=1, yes=np.array([1, 0, 0]), no=np.zeros(3)))
+    assert CountersDataFile(temp_file, 4).read_counters() is None
+
+
+def test_version_file(temp_file):
+    """The version should be 0 for a missing file, and the written one otherwise."""
+    assert 0 == VersionDataFile("akjdhakjdhas").read_version()
+
+    version_file = VersionDataFile(temp_file)
+    assert 0 == version_file.read_version()
+    version_file.write_version(2 ** 40)
+    assert 2 ** 40 == version_file.read_version()
+    assert not os.path.exists(temp_file + ".tmp")
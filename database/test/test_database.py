@@ -1,7 +1,27 @@
+import json
+import multiprocessing
+import os
+
+import numpy as np
 import pytest
 
 from .common import copy_config, temp_dir
-from ..db import Database, AggregatedAnswer, Sorting, SearchAnswer
+from ..db import (
+    Database,
+    AggregatedAnswer,
+    CountQuery,
+    DatabaseConfigException,
+    DatabaseReadOnlyException,
+    Filter,
+    FileType,
+    Layout,
+    Sorting,
+    SearchAnswer,
+)
+from ..file_format import MultiValue, SampleDataFile, SingleValue
+from ..lock import WriterLock
+from ..pk_index import OffsetIndex, PkIndex
+from ..wal import Operation, WalRecord
 
 # this is a workaround, so the automated tools won't remove the import as unused
 temp_dir
@@ -29,6 +49,21 @@ The sample config file is:
 """
 
 
+# configs with the same collections, stored in all the possible layouts
+LAYOUT_CONFIGS = [
+    "good_sample_config",
+    "good_columns_config",
+    "good_roaring_config",
+    "good_blocks_config",
+    "good_packed_config",
+]
+
+
+def read_ids(db: Database, collection_name: str) -> list:
+    """Returns all the ids stored for the collection, in the order of the records."""
+    return db._read_ids(db._collections[collection_name]).tolist()
+
+
 def assert_answer(expected_answer: SearchAnswer, current_answer: SearchAnswer):
     """Function asserts that both answers are the same for the fields: `results`, `data_size`.
 
@@ -137,14 +172,15 @@ def test_count_for_empty_collection_for_multiple_choices(temp_dir):
     assert_answer(expected, db.count("collection_one", sorting=Sorting.ASC, limit=2))
 
 
-def test_database_with_simple_data(temp_dir):
+@pytest.mark.parametrize("config_name", LAYOUT_CONFIGS)
+def test_database_with_simple_data(temp_dir, config_name):
     """Check the values read from a good sample config.
 
     This is a very simple example, there is not too much data.
     However, it's great for debugging a simple happy path.
 
     """
-    copy_config("good_sample_config", temp_dir)
+    copy_config(config_name, temp_dir)
     db = Database(temp_dir)
 
     answer = {
@@ -176,12 +212,13 @@ def test_database_with_simple_data(temp_dir):
     assert_answer(expected, db.count("collection_two"))
 
 
-def test_database_with_complicated_data(temp_dir):
+@pytest.mark.parametrize("config_name", LAYOUT_CONFIGS)
+def test_database_with_complicated_data(temp_dir, config_name):
     """Check the values read from a good sample config.
 
     This is a a little bit more complicated case.
     """
-    copy_config("good_sample_config", temp_dir)
+    copy_config(config_name, temp_dir)
     db = Database(temp_dir)
 
     """
@@ -347,3 +384,909 @@ def test_database_with_complicated_data(temp_dir):
 
     expected = SearchAnswer(results=[AggregatedAnswer(value="brand_one", count=2)], time=0.0, data_size=5,)
     assert_answer(expected, db.count("collection_two", sorting=Sorting.ASC, limit=1))
+
+
+@pytest.mark.parametrize("config_name", LAYOUT_CONFIGS)
+def test_storing_answers_in_batch(temp_dir, config_name):
+    """Storing a batch of answers should skip the repeated pks, also the ones repeated in the batch."""
+    copy_config(config_name, temp_dir)
+    db = Database(temp_dir)
+
+    db.store_answer({"pk": "1", "collection_one.singer_one": "yes", "collection_two": "brand_one"})
+    db.store_answers(
+        [
+            {"pk": "1", "collection_one.singer_two": "yes", "collection_two": "brand_two"},
+            {"pk": "2", "collection_one.singer_two": "yes", "collection_two": "brand_two"},
+            {
+                "pk": "3",
+                "collection_one.singer_two": "yes",
+                "collection_one.singer_three": "no",
+                "collection_two": "brand_two",
+            },
+            {"pk": "2", "collection_one.singer_three": "yes", "collection_two": "brand_one"},
+        ]
+    )
+
+    expected = SearchAnswer(
+        results=[
+            AggregatedAnswer(value="singer_two", count=2),
+            AggregatedAnswer(value="singer_one", count=1),
+            AggregatedAnswer(value="singer_three", count=0),
+        ],
+        time=0.0,
+        data_size=3,
+    )
+    assert_answer(expected, db.count("collection_one"))
+
+    expected = SearchAnswer(
+        results=[AggregatedAnswer(value="brand_two", count=2), AggregatedAnswer(value="brand_one", count=1)],
+        time=0.0,
+        data_size=3,
+    )
+    assert_answer(expected, db.count("collection_two"))
+
+    # the data should be the same after reopening the database
+    assert [1, 2, 3] == read_ids(Database(temp_dir), "collection_one")
+
+
+@pytest.mark.parametrize("config_name", LAYOUT_CONFIGS)
+def test_count_with_pk_range(temp_dir, config_name):
+    """Only the answers with pk in the range should be counted."""
+    copy_config(config_name, temp_dir)
+    db = Database(temp_dir)
+
+    db.store_answers(
+        [
+            {"pk": str(pk), f"collection_one.singer_{name}": "yes", "collection_two": f"brand_{name}"}
+            for pk, name in [(1, "one"), (2, "two"), (3, "two"), (4, "one"), (5, "two")]
+        ]
+    )
+
+    expected = SearchAnswer(
+        results=[AggregatedAnswer(value="singer_two", count=2), AggregatedAnswer(value="singer_one", count=1)],
+        time=0.0,
+        data_size=3,
+    )
+    assert_answer(expected, db.count("collection_one", limit=2, pk_range=(2, 4)))
+
+    expected = SearchAnswer(
+        results=[AggregatedAnswer(value="brand_two", count=2), AggregatedAnswer(value="brand_one", count=1)],
+        time=0.0,
+        data_size=3,
+    )
+    assert_answer(expected, db.count("collection_two", pk_range=(2, 4)))
+
+    expected = SearchAnswer(results=[AggregatedAnswer(value="brand_two", count=0)], time=0.0, data_size=0)
+    assert_answer(expected, db.count("collection_two", limit=1, pk_range=(10, 20)))
+
+
+@pytest.mark.parametrize("config_name", LAYOUT_CONFIGS)
+def test_recovery_of_interrupted_batch(temp_dir, config_name):
+    """A batch which was logged, but written only partially, should be applied again when the database is opened."""
+    copy_config(config_name, temp_dir)
+    db = Database(temp_dir)
+
+    first_batch = [
+        {"pk": "1", "collection_one.singer_one": "yes", "collection_two": "brand_one"},
+        {"pk": "2", "collection_one.singer_two": "yes", "collection_two": "brand_two"},
+    ]
+    second_batch = [
+        {"pk": "3", "collection_one.singer_two": "yes", "collection_two": "brand_two"},
+        {"pk": "4", "collection_one.singer_three": "yes", "collection_two": "brand_two"},
+    ]
+    db.store_answers(first_batch)
+
+    # simulate a crash: the batch is in the log, but only a part of it is written to the files
+    db._wal.append(WalRecord(records={"collection_one": 2, "collection_two": 2}, answers=second_batch))
+    collection = db._collections["collection_one"]
+    db._get_data_file(collection).write_many([db._make_values(second_batch[:1])[collection.name][0]])
+    with open(db._get_file_name(collection, FileType.IDS), "ab") as f:
+        f.write(b"\x00\x00")
+
+    db = Database(temp_dir)
+
+    expected = SearchAnswer(
+        results=[
+            AggregatedAnswer(value="singer_two", count=2),
+            AggregatedAnswer(value="singer_three", count=1),
+            AggregatedAnswer(value="singer_one", count=1),
+        ],
+        time=0.0,
+        data_size=4,
+    )
+    assert_answer(expected, db.count("collection_one"))
+
+    expected = SearchAnswer(
+        results=[AggregatedAnswer(value="brand_two", count=3), AggregatedAnswer(value="brand_one", count=1)],
+        time=0.0,
+        data_size=4,
+    )
+    assert_answer(expected, db.count("collection_two"))
+    assert [1, 2, 3, 4] == read_ids(db, "collection_one")
+    assert [] == db._wal.read()
+
+
+@pytest.mark.parametrize("config_name", LAYOUT_CONFIGS)
+def test_counters(temp_dir, config_name):
+    """The counters should be updated with each batch, and counted again when they don't match the data files."""
+    copy_config(config_name, temp_dir)
+    db = Database(temp_dir)
+    collection = db._collections["collection_one"]
+
+    db.store_answers(
+        [
+            {
+                "pk": "1",
+                "collection_one.singer_one": "yes",
+                "collection_one.singer_two": "no",
+                "collection_two": "brand_one",
+            },
+            {
+                "pk": "2",
+                "collection_one.singer_one": "yes",
+                "collection_one.singer_three": "no",
+                "collection_two": "brand_two",
+            },
+        ]
+    )
+    counters = db._get_counters_file(collection).read_counters()
+    assert 2 == counters.records
+    assert [2, 0, 0] == counters.yes.tolist()
+    assert [0, 1, 1] == counters.no.tolist()
+    assert db.verify_counters("collection_one")
+
+    # simulate a crash: the whole batch was written with the counters, but the log wasn't cleared
+    batch = [{"pk": "3", "collection_one.singer_two": "yes", "collection_two": "brand_one"}]
+    db._wal.append(WalRecord(records={"collection_one": 2, "collection_two": 2}, answers=batch))
+    db._apply_answers(batch)
+
+    db = Database(temp_dir)
+    assert 3 == db._get_counters_file(collection).read_counters().records
+    assert db.verify_counters("collection_one")
+    assert db.verify_counters("collection_two")
+
+    # wrong counters are found, and repaired
+    counters = db._get_counters_file(collection).read_counters()
+    counters.yes[0] = 100
+    db._get_counters_file(collection).write_counters(counters)
+    assert 100 == db.count("collection_one", limit=1).results[0].count
+    assert not db.verify_counters("collection_one", repair=True)
+    assert db.verify_counters("collection_one")
+    assert 2 == db.count("collection_one", limit=1).results[0].count
+
+    # without the counters file the data files are scanned, and the next batch counts all the answers again
+    os.remove(db._get_file_name(collection, FileType.COUNTS))
+    assert 3 == db.count("collection_one").data_size
+    db.store_answer({"pk": "4", "collection_one.singer_two": "yes", "collection_two": "brand_one"})
+    assert [2, 2, 0] == db._get_counters_file(collection).read_counters().yes.tolist()
+
+
+def test_pk_index_file(temp_dir, monkeypatch):
+    """The pk index should be stored when the added pks are merged, and used after reopening the database."""
+    monkeypatch.setattr(PkIndex, "MIN_MERGE_SIZE", 3)
+    copy_config("good_sample_config", temp_dir)
+    db = Database(temp_dir)
+    collection = db._collections["collection_one"]
+
+    db.store_answers([{"pk": str(pk), "collection_two": "brand_one"} for pk in [5, 1, 3]])
+    db.store_answers([{"pk": str(pk), "collection_two": "brand_one"} for pk in [7, 3]])
+    assert [1, 3, 5] == db._get_pk_index_file(collection).read_pks(0).tolist()
+
+    db = Database(temp_dir)
+    index = db._get_pk_index(collection)
+    assert [1, 3, 5] == index._pks.tolist()
+    assert 7 in index
+
+    db.store_answers([{"pk": str(pk), "collection_two": "brand_two"} for pk in [1, 7, 8, 9]])
+    assert [1, 3, 5, 7, 8, 9] == db._get_pk_index_file(collection).read_pks(0).tolist()
+    assert [5, 1, 3, 7, 8, 9] == read_ids(db, "collection_one")
+    assert 6 == db.count("collection_two").data_size
+
+    # the index file written for the removed records is not used
+    db._get_pk_index_file(collection).write_pks(0, np.array([1, 3, 5, 7, 8, 9, 10], dtype=np.uint32))
+    db = Database(temp_dir)
+    assert 10 not in db._get_pk_index(collection)
+
+
+def test_lazy_loading_and_read_only_mode(temp_dir):
+    """The collection state should be loaded on the first use, and the read only database shouldn't write."""
+    copy_config("good_sample_config", temp_dir)
+    db = Database(temp_dir)
+    assert {} == db._pk_indexes
+
+    db.store_answer({"pk": "1", "collection_one.singer_one": "yes", "collection_two": "brand_one"})
+    assert {"collection_one", "collection_two"} == set(db._pk_indexes)
+
+    # a batch which is being written by another process
+    batch = [{"pk": "2", "collection_one.singer_two": "yes", "collection_two": "brand_two"}]
+    db._wal.append(WalRecord(records={"collection_one": 1, "collection_two": 1}, answers=batch))
+
+    reader = Database(temp_dir, read_only=True)
+    assert 1 == reader.count("collection_one").data_size
+    assert {} == reader._pk_indexes
+    assert 1 == len(reader._wal.read())
+
+    with pytest.raises(DatabaseReadOnlyException):
+        reader.store_answers(batch)
+    with pytest.raises(DatabaseReadOnlyException):
+        reader.compact("collection_one")
+
+    assert 2 == Database(temp_dir).count("collection_one").data_size
+
+
+def test_routes_for_answer_keys(temp_dir):
+    """The answer keys of the multiple answers collections should be routed to the collection and the choice index."""
+    copy_config("good_sample_config", temp_dir)
+    db = Database(temp_dir)
+
+    assert {
+        "collection_one.singer_one": ("collection_one", 0),
+        "collection_one.singer_two": ("collection_one", 1),
+        "collection_one.singer_three": ("collection_one", 2),
+    } == db._routes
+
+    # the keys without a route, and the values other than yes/no are ignored
+    db.store_answers(
+        [
+            {
+                "pk": "1",
+                "collection_one.singer_one": "yes",
+                "collection_one.singer_two": "not_answered",
+                "collection_one.missing": "yes",
+                "missing.singer_one": "yes",
+                "collection_two": "brand_one",
+            }
+        ]
+    )
+    expected = SearchAnswer(
+        results=[
+            AggregatedAnswer(value="singer_one", count=1),
+            AggregatedAnswer(value="singer_two", count=0),
+            AggregatedAnswer(value="singer_three", count=0),
+        ],
+        time=0.0,
+        data_size=1,
+    )
+    assert_answer(expected, db.count("collection_one"))
+
+
+def test_query_cache(temp_dir, monkeypatch):
+    """The repeated queries should be answered from the cache until the collection is changed."""
+    copy_config("good_sample_config", temp_dir)
+    db = Database(temp_dir)
+    db.store_answer({"pk": "1", "collection_one.singer_one": "yes", "collection_two": "brand_one"})
+    expected = db.count("collection_two", pk_range=(0, 10))
+
+    scans = []
+    scan_data_files = db._scan_data_files
+    monkeypatch.setattr(db, "_scan_data_files", lambda *args: scans.append(args) or scan_data_files(*args))
+
+    assert_answer(expected, db.count("collection_two", pk_range=(0, 10)))
+    assert [] == scans
+
+    # another query, and another collection are not cached yet
+    db.count("collection_two", pk_range=(0, 5))
+    db.count("collection_one", pk_range=(0, 10))
+    assert 2 == len(scans)
+
+    db.store_answer({"pk": "2", "collection_one.singer_one": "yes", "collection_two": "brand_two"})
+    assert 2 == db.count("collection_two", pk_range=(0, 10)).data_size
+    assert 3 == len(scans)
+
+    # the cache file is shared by the processes
+    writer = Database(temp_dir, shared_cache=True)
+    reader = Database(temp_dir, read_only=True, shared_cache=True)
+    expected = writer.count("collection_one", pk_range=(0, 10))
+    writer._cache.flush()
+    monkeypatch.setattr(reader, "_scan_data_files", lambda *args: scans.append(args))
+    assert_answer(expected, reader.count("collection_one", pk_range=(0, 10)))
+    assert 3 == len(scans)
+
+    writer.store_answer({"pk": "3", "collection_one.singer_two": "yes", "collection_two": "brand_two"})
+    assert expected != writer.count("collection_one", pk_range=(0, 10))
+    writer._cache.flush()
+    assert 3 == reader.count("collection_one", pk_range=(0, 10)).data_size
+
+
+@pytest.mark.parametrize("config_name", LAYOUT_CONFIGS)
+def test_count_many(temp_dir, config_name):
+    """The answers should be the same as for the separate counts, in the order of the queries."""
+    copy_config(config_name, temp_dir)
+    db = Database(temp_dir)
+    db.store_answers(
+        [
+            {"pk": "1", "collection_one.singer_one": "yes", "collection_two": "brand_one"},
+            {"pk": "2", "collection_one.singer_two": "yes", "collection_two": "brand_two"},
+            {"pk": "3", "collection_one.singer_two": "yes", "collection_two": "brand_two"},
+        ]
+    )
+
+    queries = [
+        CountQuery("collection_two", limit=1),
+        CountQuery("collection_one", sorting=Sorting.ASC),
+        CountQuery("collection_one", pk_range=(2, 3)),
+    ]
+    answers = db.count_many(queries)
+    assert 3 == len(answers)
+    for query, answer in zip(queries, answers):
+        assert_answer(db.count(query.collection_name, query.limit, query.sorting, query.pk_range), answer)
+
+    assert [] == db.count_many([])
+
+    with pytest.raises(ValueError) as e:
+        db.count_many([CountQuery("collection_one"), CountQuery("BAD_COLLECTION")])
+    assert "Bad collection name" in str(e)
+
+
+@pytest.mark.parametrize("config_name", LAYOUT_CONFIGS)
+@pytest.mark.parametrize("compacted", [False, True])
+def test_count_with_filters(temp_dir, config_name, compacted):
+    """Only the answers of the people matching all the filters should be counted."""
+    copy_config(config_name, temp_dir)
+    db = Database(temp_dir)
+    db.store_answers(
+        [
+            {"pk": "1", "collection_one.singer_one": "yes", "collection_two": "brand_one"},
+            {"pk": "2", "collection_one.singer_two": "yes", "collection_two": "brand_two"},
+            {
+                "pk": "3",
+                "collection_one.singer_two": "yes",
+                "collection_one.singer_three": "no",
+                "collection_two": "brand_one",
+            },
+            {"pk": "4", "collection_one.singer_three": "yes", "collection_two": "brand_one"},
+        ]
+    )
+    if compacted:
+        db.compact("collection_one")
+        db.compact("collection_two")
+        db.store_answer({"pk": "5", "collection_one.singer_two": "yes", "collection_two": "brand_one"})
+
+    brand_one = [Filter("collection_two", "brand_one")]
+    expected = SearchAnswer(
+        results=[
+            AggregatedAnswer(value="singer_two", count=2 if compacted else 1),
+            AggregatedAnswer(value="singer_three", count=1),
+            AggregatedAnswer(value="singer_one", count=1),
+        ],
+        time=0.0,
+        data_size=4 if compacted else 3,
+    )
+    assert_answer(expected, db.count("collection_one", filters=brand_one))
+
+    # the filters are intersected, and combined with the pk range
+    filters = [Filter("collection_two", "brand_one"), Filter("collection_one", "singer_two")]
+    assert (2 if compacted else 1) == db.count("collection_one", filters=filters, pk_range=(1, 10)).data_size
+    assert 1 == db.count("collection_one", filters=filters, pk_range=(1, 3)).data_size
+
+    expected = SearchAnswer(
+        results=[AggregatedAnswer(value="brand_one", count=1), AggregatedAnswer(value="brand_two", count=0)],
+        time=0.0,
+        data_size=1,
+    )
+    assert_answer(expected, db.count("collection_two", filters=[Filter("collection_one", "singer_three", yes=False)]))
+
+    # nobody matches the filters
+    filters = [Filter("collection_two", "brand_two"), Filter("collection_one", "singer_one")]
+    assert 0 == db.count("collection_two", filters=filters).data_size
+
+    # the cached answer should be changed by a write to the filter collection
+    filters = [Filter("collection_one", "singer_one")]
+    assert 1 == db.count("collection_two", filters=filters).data_size
+    db.store_answer({"pk": "6", "collection_one.singer_one": "yes", "collection_two": "brand_two"})
+    assert 2 == db.count("collection_two", filters=filters).data_size
+
+    answers = db.count_many([CountQuery("collection_two", filters=filters), CountQuery("collection_two")])
+    assert [2, 6 if compacted else 5] == [answer.data_size for answer in answers]
+
+
+def test_count_with_bad_filters(temp_dir):
+    """The filters with a bad collection name or a bad choice should raise an exception."""
+    copy_config("good_sample_config", temp_dir)
+    db = Database(temp_dir)
+
+    for query_filter, message in [
+        (Filter("BAD_COLLECTION", "brand_one"), "Bad collection name"),
+        (Filter("collection_two", "BAD_CHOICE"), "Bad choice"),
+        (Filter("collection_two", "brand_one", yes=False), "store the answers"),
+    ]:
+        with pytest.raises(ValueError) as e:
+            db.count("collection_one", filters=[query_filter])
+        assert message in str(e)
+
+        with pytest.raises(ValueError) as e:
+            db.count_many([CountQuery("collection_one", filters=[query_filter])])
+        assert message in str(e)
+
+
+@pytest.mark.parametrize(
+    "config_name", ["good_sample_config", "good_columns_config", "good_roaring_config", "good_blocks_config"]
+)
+def test_cooccurrence(temp_dir, config_name, monkeypatch):
+    """The counts should be the same as counted by the naive loops, also after appending and compaction."""
+    copy_config(config_name, temp_dir)
+    db = Database(temp_dir)
+    singers = ["singer_one", "singer_two", "singer_three"]
+
+    def make_answer(pk: int) -> dict:
+        """The bits of the pk are the answers for the singers."""
+        answer = {"pk": str(pk), "collection_two": "brand_one"}
+        for index, name in enumerate(singers):
+            answer[f"collection_one.{name}"] = "yes" if (pk >> index) & 1 else "no"
+        return answer
+
+    def expected(pks: range) -> list:
+        return [[sum(1 for pk in pks if (pk >> a) & 1 and (pk >> b) & 1) for b in range(3)] for a in range(3)]
+
+    answer = db.cooccurrence("collection_one", "collection_one")
+    assert singers == answer.choices_a == answer.choices_b
+    assert 0 == answer.data_size
+    assert expected(range(0)) == answer.counts.tolist()
+
+    db.store_answers([make_answer(pk) for pk in range(1, 20)])
+    answer = db.cooccurrence("collection_one", "collection_one")
+    assert 19 == answer.data_size
+    assert expected(range(1, 20)) == answer.counts.tolist()
+
+    # only the appended records are joined, and nothing when nothing was appended
+    joined = []
+    join_yes_choices = db._join_yes_choices
+    monkeypatch.setattr(db, "_join_yes_choices", lambda *args: joined.append(join_yes_choices(*args)) or joined[-1])
+    db.store_answers([make_answer(pk) for pk in range(20, 30)])
+    for _ in range(2):
+        answer = db.cooccurrence("collection_one", "collection_one")
+        assert 29 == answer.data_size
+        assert expected(range(1, 30)) == answer.counts.tolist()
+    assert [10] == [records for records, _ in joined]
+
+    # the stored counts are used by the other processes, and all the records are counted after a compaction
+    db.compact("collection_one")
+    db.store_answers([make_answer(pk) for pk in range(30, 35)])
+    cooccurrence_path = os.path.join(temp_dir, "collection_one.collection_one.cooc")
+    with open(cooccurrence_path, "rb") as f:
+        stored_data = f.read()
+    answer = Database(temp_dir, read_only=True).cooccurrence("collection_one", "collection_one")
+    assert 34 == answer.data_size
+    assert expected(range(1, 35)) == answer.counts.tolist()
+
+    # the database opened only for the queries doesn't store the counts
+    with open(cooccurrence_path, "rb") as f:
+        assert stored_data == f.read()
+
+    # the compacted records are not counted again, when the empty tail is followed by the appended ones
+    db.compact("collection_one")
+    assert 34 == db.cooccurrence("collection_one", "collection_one").data_size
+    db.store_answers([make_answer(pk) for pk in range(35, 40)])
+    answer = db.cooccurrence("collection_one", "collection_one")
+    assert 39 == answer.data_size
+    assert expected(range(1, 40)) == answer.counts.tolist()
+
+    with pytest.raises(ValueError) as e:
+        db.cooccurrence("collection_one", "collection_two")
+    assert "only for multiple answers" in str(e)
+
+
+def test_approximate_count(temp_dir, monkeypatch, caplog):
+    """The approximate counts should be estimated from the samples only when they are precise enough."""
+    copy_config("good_sample_config", temp_dir)
+    db = Database(temp_dir)
+    monkeypatch.setattr(db, "SAMPLE_SIZE", 200)
+
+    def make_answer(pk: int) -> dict:
+        return {
+            "pk": str(pk),
+            "collection_one.singer_one": "yes" if pk % 2 == 0 else "no",
+            "collection_one.singer_two": "yes" if pk % 2 == 1 else "no",
+            "collection_two": "brand_one" if pk % 5 else "brand_two",
+        }
+
+    # the sample contains all the records, so the answer is exact
+    db.store_answers([make_answer(pk) for pk in range(1, 101)])
+    filters = [Filter("collection_one", "singer_one")]
+    answer = db.count("collection_two", filters=filters, approx=True)
+    assert not answer.approximate
+    assert [("brand_one", 40), ("brand_two", 10)] == [(result.value, result.count) for result in answer.results]
+    assert 50 == answer.data_size
+
+    db.store_answers([make_answer(pk) for pk in range(101, 2001)])
+    answer = db.count("collection_two", filters=filters, approx=True, max_error=0.1)
+    assert answer.approximate
+    assert ["brand_one", "brand_two"] == [result.value for result in answer.results]
+    for result, expected in zip(answer.results, [800, 200]):
+        assert result.interval[0] <= result.count <= result.interval[1]
+        assert result.interval[0] <= expected <= result.interval[1]
+
+    # the answer is counted exactly when the intervals are too wide, or the order of the results is not known
+    for collection_name, max_error in [("collection_two", 0.001), ("collection_one", 0.1)]:
+        answer = db.count(collection_name, pk_range=(1, 2000), approx=True, max_error=max_error)
+        assert not answer.approximate
+        assert 2000 == answer.data_size
+        assert all(result.interval is None for result in answer.results)
+
+    # without the pk range and the filters the counters are used
+    assert not db.count("collection_two", approx=True).approximate
+
+    # the missing sample is created again on the next write
+    os.remove(os.path.join(temp_dir, "collection_two.sample"))
+    assert not db.count("collection_two", filters=filters, approx=True, max_error=0.1).approximate
+    db.store_answer(make_answer(2001))
+    assert "Sampling again all the answers of collection_two" in caplog.text
+    assert db.count("collection_two", filters=filters, approx=True, max_error=0.1).approximate
+
+
+@pytest.mark.parametrize("config_name", LAYOUT_CONFIGS)
+def test_get_answer(temp_dir, config_name, monkeypatch):
+    """The values stored for the pk should be read from all the layouts, also after compaction and appending."""
+    monkeypatch.setattr(OffsetIndex, "MIN_MERGE_SIZE", 4)
+    copy_config(config_name, temp_dir)
+    db = Database(temp_dir)
+
+    def make_answer(pk: int) -> dict:
+        return {
+            "pk": str(pk),
+            "collection_one.singer_one": "yes" if pk % 2 else "no",
+            "collection_one.singer_three": "yes",
+            "collection_two": "brand_one" if pk % 3 else "brand_two",
+        }
+
+    def expected(pk: int) -> dict:
+        if pk % 2:
+            singers = MultiValue(pk=pk, yes_choices=[0, 2], no_choices=[])
+        else:
+            singers = MultiValue(pk=pk, yes_choices=[2], no_choices=[0])
+        return {"collection_one": singers, "collection_two": SingleValue(pk=pk, value=0 if pk % 3 else 1)}
+
+    assert {} == db.get_answer(1)
+
+    db.store_answers([make_answer(pk) for pk in [5, 2, 9, 1, 7]])
+    for pk in [5, 2, 9, 1, 7]:
+        assert expected(pk) == db.get_answer(pk)
+    assert {} == db.get_answer(3)
+    # the merged positions are stored, for the tail generation
+    indexed, positions = db._get_offset_index_file(db._collections["collection_two"]).read_positions(0)
+    assert (5, 5) == (indexed, len(positions))
+
+    # the compacted records are sorted, and the records appended later are found in the tail files
+    db.compact("collection_one")
+    db.compact("collection_two", Layout.PACKED if config_name == "good_packed_config" else Layout.BLOCKS)
+    db.store_answers([make_answer(pk) for pk in [4, 3]])
+    for pk in [1, 2, 3, 4, 5, 7, 9]:
+        assert expected(pk) == db.get_answer(pk)
+
+    # the reader sees the records appended by another process
+    reader = Database(temp_dir, read_only=True)
+    assert expected(4) == reader.get_answer(4)
+    db.store_answer(make_answer(6))
+    assert expected(6) == reader.get_answer(6)
+
+
+@pytest.mark.parametrize("config_name", LAYOUT_CONFIGS)
+def test_upsert_and_delete(temp_dir, config_name, monkeypatch):
+    """The updated and deleted answers should not be counted, nor found, also after compaction and recovery."""
+    copy_config(config_name, temp_dir)
+    monkeypatch.setattr(Database, "SAMPLE_SIZE", 4)
+    db = Database(temp_dir)
+    singers = ["singer_one", "singer_two", "singer_three"]
+    brands = ["brand_one", "brand_two"]
+
+    def make_answer(pk: int, version: int = 0) -> dict:
+        """The bits of the pk plus the version are the answers for the singers."""
+        answer = {"pk": str(pk), "collection_two": brands[(pk + version) % 2]}
+        for index, name in enumerate(singers):
+            answer[f"collection_one.{name}"] = "yes" if ((pk + version) >> index) & 1 else "no"
+        return answer
+
+    def check(db: Database, stored: dict):
+        """Compares the results with the answers counted from the stored answers."""
+        for pk_range in [None, (2, 8)]:
+            answers = [a for pk, a in stored.items() if pk_range is None or pk_range[0] <= pk <= pk_range[1]]
+            expected = {name: sum(a[f"collection_one.{name}"] == "yes" for a in answers) for name in singers}
+            answer = db.count("collection_one", pk_range=pk_range)
+            assert (expected, len(answers)) == ({a.value: a.count for a in answer.results}, answer.data_size)
+            expected = {name: sum(a["collection_two"] == name for a in answers) for name in brands}
+            answer = db.count("collection_two", pk_range=pk_range)
+            assert (expected, len(answers)) == ({a.value: a.count for a in answer.results}, answer.data_size)
+
+        answers = [a for a in stored.values() if a["collection_one.singer_two"] == "yes"]
+        expected = {name: sum(a["collection_two"] == name for a in answers) for name in brands}
+        answer = db.count("collection_two", filters=[Filter("collection_one", "singer_two")])
+        assert (expected, len(answers)) == ({a.value: a.count for a in answer.results}, answer.data_size)
+        answers = [a for a in stored.values() if a["collection_two"] == "brand_one"]
+        assert len(answers) == db.count("collection_one", filters=[Filter("collection_two", "brand_one")]).data_size
+
+        for pk in range(12):
+            answer = db.get_answer(pk)
+            if pk not in stored:
+                assert {} == answer
+                continue
+            yes = [index for index, name in enumerate(singers) if stored[pk][f"collection_one.{name}"] == "yes"]
+            assert yes == sorted(answer["collection_one"].yes_choices)
+            assert brands.index(stored[pk]["collection_two"]) == answer["collection_two"].value
+
+        if config_name != "good_packed_config":
+            yes = [[a[f"collection_one.{name}"] == "yes" for name in singers] for a in stored.values()]
+            expected = [[sum(bits[x] and bits[y] for bits in yes) for y in range(3)] for x in range(3)]
+            assert expected == db.cooccurrence("collection_one", "collection_one").counts.tolist()
+
+        # the samples contain the stored pks with the smallest hashes
+        pks = np.array(sorted(stored))
+        expected = sorted(pks[np.argsort(SampleDataFile.pk_hash(pks), kind="stable")[:4]].tolist())
+        for collection in db._collections.values():
+            assert expected == sorted(db._get_sample_file(collection).read_records()["pk"].tolist())
+            assert db.verify_counters(collection.name)
+
+    stored = {pk: make_answer(pk) for pk in range(1, 9)}
+    db.store_answers(list(stored.values()))
+    check(db, stored)
+
+    # the last answer for the pk is used, an answer without changes is skipped
+    db.upsert_answers([make_answer(2, 1), make_answer(3), make_answer(2, 3), make_answer(10, 1)])
+    stored.update({2: make_answer(2, 3), 10: make_answer(10, 1)})
+    assert 1 == db._get_tombstones_file(db._collections["collection_one"]).records_count()
+    check(db, stored)
+
+    db.delete_answers([4, 2, 11])
+    del stored[4], stored[2]
+    check(db, stored)
+
+    # the deleted pk can be stored again, the stored one is skipped
+    db.store_answers([make_answer(4, 5), make_answer(5, 5)])
+    stored[4] = make_answer(4, 5)
+    check(db, stored)
+
+    # the compaction drops the removed records
+    db.compact("collection_one")
+    db.compact("collection_two", Layout.PACKED if config_name == "good_packed_config" else Layout.BLOCKS)
+    assert 0 == db._get_tombstones_file(db._collections["collection_one"]).records_count()
+    assert len(stored) == db._segments["collection_one"].base_records
+    check(db, stored)
+
+    db.upsert_answers([make_answer(1, 2), make_answer(6, 1)])
+    db.delete_answers([7])
+    stored.update({1: make_answer(1, 2), 6: make_answer(6, 1)})
+    del stored[7]
+    check(db, stored)
+    check(Database(temp_dir, read_only=True), stored)
+
+    # simulate a crash: the update is in the log, but it's written to the files only partially
+    collection = db._collections["collection_one"]
+    records = {name: db.tail_records(name) for name in db._collections}
+    tombstones = {name: db._get_tombstones_file(c).records_count() for name, c in db._collections.items()}
+    batch = [make_answer(3, 4), make_answer(8, 2)]
+    db._wal.append(WalRecord(records=records, answers=batch, tombstones=tombstones, operation=Operation.UPSERT))
+    value = db._make_values(batch[:1])[collection.name][0]
+    db._write_values(collection, [value], list(db._find_live_records(collection, [3]).values()))
+    stored.update({3: make_answer(3, 4), 8: make_answer(8, 2)})
+    check(Database(temp_dir), stored)
+    assert [] == db._wal.read()
+
+
+def append_choices(directory: str, name: str, values: list) -> None:
+    """Appends the values to the choices in the config file of the database."""
+    config_path = os.path.join(directory, Database.CONFIG_FILE_NAME)
+    with open(config_path) as f:
+        config = json.load(f)
+    config["choices"][name].extend(values)
+    with open(config_path, "w") as f:
+        json.dump(config, f)
+
+
+@pytest.mark.parametrize("config_name", LAYOUT_CONFIGS)
+def test_appending_choices(temp_dir, config_name):
+    """The appended choices should be counted without rewriting the compacted files."""
+    copy_config(config_name, temp_dir)
+    db = Database(temp_dir)
+    reader = Database(temp_dir, read_only=True)
+    singers = ["singer_one", "singer_two", "singer_three"]
+    brands = ["brand_one", "brand_two"]
+
+    def make_answer(pk: int) -> dict:
+        """The bits of the pk are the answers for the singers."""
+        answer = {"pk": str(pk), "collection_two": brands[pk % len(brands)]}
+        for index, name in enumerate(singers):
+            answer[f"collection_one.{name}"] = "yes" if (pk >> index) & 1 else "no"
+        return answer
+
+    def check(db: Database, stored: dict):
+        """Compares the results with the answers counted from the stored answers."""
+        for pk_range in [None, (2, 12)]:
+            answers = [a for pk, a in stored.items() if pk_range is None or pk_range[0] <= pk <= pk_range[1]]
+            expected = {name: sum(a.get(f"collection_one.{name}") == "yes" for a in answers) for name in singers}
+            answer = db.count("collection_one", limit=len(singers), pk_range=pk_range)
+            assert (expected, len(answers)) == ({a.value: a.count for a in answer.results}, answer.data_size)
+            expected = {name: sum(a["collection_two"] == name for a in answers) for name in brands}
+            answer = db.count("collection_two", pk_range=pk_range)
+            assert (expected, len(answers)) == ({a.value: a.count for a in answer.results}, answer.data_size)
+
+        for singer in [singers[1], singers[-1]]:
+            answers = [a for a in stored.values() if a.get(f"collection_one.{singer}") == "yes"]
+            expected = {name: sum(a["collection_two"] == name for a in answers) for name in brands}
+            answer = db.count("collection_two", filters=[Filter("collection_one", singer)])
+            assert (expected, len(answers)) == ({a.value: a.count for a in answer.results}, answer.data_size)
+        answers = [a for a in stored.values() if a["collection_two"] == brands[-1]]
+        assert len(answers) == db.count("collection_one", filters=[Filter("collection_two", brands[-1])]).data_size
+
+        for pk, stored_answer in stored.items():
+            yes = [index for index, name in enumerate(singers) if stored_answer.get(f"collection_one.{name}") == "yes"]
+            assert yes == sorted(db.get_answer(pk)["collection_one"].yes_choices)
+
+        if config_name != "good_packed_config":
+            yes = [[a.get(f"collection_one.{name}") == "yes" for name in singers] for a in stored.values()]
+            size = len(singers)
+            expected = [[sum(bits[x] and bits[y] for bits in yes) for y in range(size)] for x in range(size)]
+            assert expected == db.cooccurrence("collection_one", "collection_one").counts.tolist()
+
+    # the collections which were never written have no counters files
+    for name in db._collections:
+        assert db.verify_counters(name)
+
+    stored = {pk: make_answer(pk) for pk in range(1, 9)}
+    db.store_answers(list(stored.values()))
+    db.compact("collection_one")
+    db.compact("collection_two", Layout.PACKED if config_name == "good_packed_config" else Layout.BLOCKS)
+    stored.update({pk: make_answer(pk) for pk in [9, 10]})
+    db.store_answers([stored[9], stored[10]])
+    db.delete_answers([2, 9])
+    del stored[2], stored[9]
+    check(db, stored)
+
+    base_files = {
+        name: db._get_data_file(collection, db._segments[name].base, db._segments[name].base_layout).file_path
+        for name, collection in db._collections.items()
+    }
+    base_stats = {name: os.stat(path) for name, path in base_files.items()}
+    tails = {name: segments.tail for name, segments in db._segments.items()}
+
+    # the number of singers crosses the size of one byte of the bitfields
+    new_singers = [f"new_singer_{index}" for index in range(6)]
+    append_choices(temp_dir, "singers", new_singers)
+    append_choices(temp_dir, "carbrands", ["brand_three"])
+    singers.extend(new_singers)
+    brands.append("brand_three")
+
+    # the stored answers are read with the appended choices, before the collection files are converted
+    check(reader, stored)
+    # the writer reads the appended choices with a query, the counters are converted before they're verified
+    db.count("collection_one")
+    for name in db._collections:
+        assert db.verify_counters(name, repair=True)
+
+    new_answer = {"pk": "11", "collection_two": "brand_three", "collection_one.new_singer_5": "yes"}
+    new_answer.update({"collection_one.singer_two": "yes", "collection_one.new_singer_0": "no"})
+    stored[11] = new_answer
+    stored[3] = dict(new_answer, pk="3")
+    db.store_answers([new_answer])
+    db.upsert_answers([stored[3]])
+    for name, path in base_files.items():
+        stat = os.stat(path)
+        assert (base_stats[name].st_ino, base_stats[name].st_mtime_ns) == (stat.st_ino, stat.st_mtime_ns)
+        assert tails[name] != db._segments[name].tail
+    check(db, stored)
+    check(reader, stored)
+    check(Database(temp_dir), stored)
+    for name in db._collections:
+        assert db.verify_counters(name)
+    sample_file = db._get_sample_file(db._collections["collection_one"])
+    sample = {value.pk: sorted(value.yes_choices) for value in sample_file.decode(sample_file.read_records())}
+    assert {pk: sorted(db.get_answer(pk)["collection_one"].yes_choices) for pk in stored} == sample
+
+    with open(os.path.join(temp_dir, Database.CATALOG_FILE_NAME)) as f:
+        catalog = json.load(f)
+    assert (2, singers, brands) == (catalog["version"], catalog["choices"]["singers"], catalog["choices"]["carbrands"])
+
+    db.compact("collection_one")
+    db.compact("collection_two", Layout.PACKED if config_name == "good_packed_config" else Layout.BLOCKS)
+    check(db, stored)
+
+
+def test_changing_stored_choices(temp_dir):
+    """The stored choices can't be removed nor reordered, only new ones can be appended."""
+    copy_config("good_sample_config", temp_dir)
+    Database(temp_dir).store_answers([{"pk": "1", "collection_one.singer_two": "yes", "collection_two": "brand_one"}])
+
+    config_path = os.path.join(temp_dir, Database.CONFIG_FILE_NAME)
+    with open(config_path) as f:
+        config = json.load(f)
+    config["choices"]["carbrands"] = ["brand_two", "brand_one"]
+    with open(config_path, "w") as f:
+        json.dump(config, f)
+
+    for read_only in [False, True]:
+        with pytest.raises(DatabaseConfigException) as e:
+            Database(temp_dir, read_only=read_only)
+        assert "carbrands" in str(e.value)
+
+
+def store_in_process(directory: str, pks: list) -> None:
+    """Stores the answers for the pks in batches of two, with a separate database object."""
+    db = Database(directory)
+    for start in range(0, len(pks), 2):
+        end = start + 2
+        db.store_answers(
+            [
+                {"pk": str(pk), "collection_one.singer_two": "yes", "collection_two": "brand_one"}
+                for pk in pks[start:end]
+            ]
+        )
+
+
+def test_concurrent_writers(temp_dir):
+    """The writers should see the answers, the compactions and the interrupted batches of each other."""
+    copy_config("good_sample_config", temp_dir)
+    writer_a, writer_b = Database(temp_dir), Database(temp_dir)
+
+    def make_answers(pks: list) -> list:
+        return [{"pk": str(pk), "collection_one.singer_one": "yes", "collection_two": "brand_two"} for pk in pks]
+
+    # the pk index of the second writer is loaded before the first one writes
+    writer_b.store_answers(make_answers([10]))
+    writer_a.store_answers(make_answers([1, 2, 3]))
+    writer_b.store_answers(make_answers([2, 3, 4]))
+    assert [10, 1, 2, 3, 4] == read_ids(writer_a, "collection_one")
+    assert 5 == writer_a.count("collection_one").data_size
+
+    # the second writer appends to the tail files of the new generation
+    writer_a.compact("collection_one")
+    writer_b.store_answers(make_answers([5, 1]))
+    assert [1, 2, 3, 4, 10, 5] == read_ids(Database(temp_dir), "collection_one")
+    assert 6 == writer_b.count("collection_one").data_size
+
+    # simulate a crash of the first writer: the batch is in the log, but only a part of it is written to the files
+    batch = make_answers([6])
+    records = {name: writer_a.tail_records(name) for name in writer_a._collections}
+    writer_a._wal.append(WalRecord(records=records, answers=batch))
+    collection = writer_a._collections["collection_one"]
+    writer_a._get_data_file(collection).write_many([writer_a._make_values(batch)[collection.name][0]])
+
+    writer_b.store_answers(make_answers([7]))
+    assert [1, 2, 3, 4, 10, 5, 6, 7] == read_ids(writer_b, "collection_one")
+    assert 8 == writer_b.count("collection_one").data_size
+    assert [] == writer_b._wal.read()
+
+    # the compaction is skipped while the collection is compacted by another writer
+    with WriterLock(os.path.join(temp_dir, "collection_one.compaction.lock")):
+        assert not writer_b.compact("collection_one")
+    assert writer_b.compact("collection_one")
+
+
+def test_converting_answers_out_of_lock(temp_dir, monkeypatch):
+    """The answers should be converted and encoded for the log before the writer lock is acquired."""
+    copy_config("good_sample_config", temp_dir)
+    db = Database(temp_dir)
+    locked = []
+
+    def record_lock(function):
+        def wrapper(*args, **kwargs):
+            locked.append((function.__name__, db._lock._depth > 0))
+            return function(*args, **kwargs)
+
+        return wrapper
+
+    monkeypatch.setattr(db, "_make_values", record_lock(db._make_values))
+    monkeypatch.setattr(db._wal, "encode_answers", record_lock(db._wal.encode_answers))
+    db.store_answers([{"pk": "1", "collection_one.singer_one": "yes", "collection_two": "brand_one"}])
+    assert [("_make_values", False), ("encode_answers", False)] == locked
+    assert 1 == db.count("collection_two").data_size
+
+
+def test_concurrent_writer_processes(temp_dir):
+    """The answers stored by many processes at once should be stored once, and counted."""
+    copy_config("good_sample_config", temp_dir)
+    Database(temp_dir)
+
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=store_in_process, args=(temp_dir, list(range(start, start + 40))))
+        for start in [0, 20, 40, 60]
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert 0 == process.exitcode
+
+    db = Database(temp_dir, read_only=True)
+    for name in ["collection_one", "collection_two"]:
+        assert list(range(100)) == sorted(read_ids(db, name))
+        assert db.verify_counters(name)
+    assert 100 == db.count("collection_one").data_size
@@ -1,8 +1,10 @@
+import json
+import os
 from shutil import rmtree
 from tempfile import mkdtemp
 
 from .common import temp_dir, copy_config
-from ..db import Database, DatabaseConfigException, Choice, Collection
+from ..db import Database, DatabaseConfigException, Choice, Collection, Layout
 
 # this is a workaround, so the automated tools won't remove the import as unused
 temp_dir
@@ -27,6 +29,9 @@ def test_parsing_file():
         ("collection_with_bad_multiple_answers", "Multiple_answers field should have values of true/false."),
         ("collection_without_choices", "There should be the choices field for one."),
         ("collection_with_bad_choice_value", "The choices field should have one of the choices as value."),
+        ("collection_with_bad_layout", "Unknown layout 'xxx' for one."),
+        ("single_collection_with_columns_layout", "The columns layout is available only for multiple answers"),
+        ("multi_collection_with_packed_layout", "The packed layout is available only for single answers (one)."),
     ]
     for config_name, expected_message in params:
 
@@ -113,3 +118,45 @@ def test_good_production_config(temp_dir):
         "owned_cars",
         "voted_candidate",
     ] == list(collections)
+
+
+def test_columns_layout_config(temp_dir):
+    """The layout of a collection should be read from the config, with rows layout as the default."""
+    copy_config("good_columns_config", temp_dir)
+    db = Database(temp_dir)
+
+    collections = db._collections
+    assert collections["collection_one"] == Collection(
+        name="collection_one", multiple_answers=True, choices_name="singers", layout=Layout.COLUMNS
+    )
+    assert collections["collection_two"] == Collection(
+        name="collection_two", multiple_answers=False, choices_name="carbrands", layout=Layout.ROWS
+    )
+
+
+def test_compiled_config(temp_dir, monkeypatch):
+    """The config should be loaded from the compiled file, until the config file is changed."""
+    copy_config("good_production_config", temp_dir)
+    db = Database(temp_dir)
+    assert os.path.exists(os.path.join(temp_dir, Database.COMPILED_CONFIG_FILE_NAME))
+
+    def compile_config(*args):
+        raise AssertionError("The config file should not be compiled again.")
+
+    with monkeypatch.context() as m:
+        m.setattr(Database, "_compile_config", compile_config)
+        compiled_db = Database(temp_dir, read_only=True)
+        assert db._choices == compiled_db._choices
+        assert db._collections == compiled_db._collections
+        assert db._routes == compiled_db._routes
+
+    # the choices can be appended to the config file
+    config_path = os.path.join(temp_dir, Database.CONFIG_FILE_NAME)
+    with open(config_path) as f:
+        config = json.load(f)
+    config["choices"]["singers"].append("new_singer")
+    with open(config_path, "w") as f:
+        json.dump(config, f)
+    db = Database(temp_dir, read_only=True)
+    assert "new_singer" == db._choices["singers"].values[-1]
+    assert ("listened_singers", 556) == db._routes["listened_singers.new_singer"]
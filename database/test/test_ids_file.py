@@ -49,3 +49,27 @@ def test_writing_multiple_values(temp_file):
 
     assert 4 * len(values) == os.path.getsize(temp_file)
     assert values == list(data_file.read())
+
+
+def test_view(temp_file):
+    """The memory-mapped view should contain all the values."""
+    data_file = IdsDataFile(temp_file)
+    assert [] == data_file.view().tolist()
+
+    values = [randrange(0, 2 ** 32) for _ in range(0, randrange(10, 100))]
+    for value in values:
+        data_file.write(value)
+
+    assert values == data_file.view().tolist()
+
+
+def test_writing_many_values(temp_file):
+    """Writing the values in batches should give the same file as writing them one by one."""
+    data_file = IdsDataFile(temp_file)
+    values = [randrange(0, 2 ** 32) for _ in range(0, randrange(10, 100))]
+    data_file.write_many(values[:7])
+    data_file.write_many([])
+    data_file.write_many(values[7:])
+
+    assert 4 * len(values) == os.path.getsize(temp_file)
+    assert values == list(data_file.read())
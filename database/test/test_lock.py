@@ -0,0 +1,43 @@
+import multiprocessing
+
+from .common import temp_file
+from ..lock import WriterLock
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_file
+
+
+def try_acquire(file_path: str) -> bool:
+    """Tries to acquire the lock without waiting."""
+    lock = WriterLock(file_path)
+    acquired = lock.acquire(blocking=False)
+    if acquired:
+        lock.release()
+    return acquired
+
+
+def test_lock_is_reentrant(temp_file):
+    """The lock should be acquired many times by the same thread, and released by the outermost release."""
+    lock = WriterLock(temp_file)
+    with lock:
+        with lock:
+            assert not try_acquire(temp_file)
+        assert not try_acquire(temp_file)
+    assert try_acquire(temp_file)
+
+
+def test_lock_excludes_other_processes(temp_file):
+    """Another process should not acquire the lock while it's held."""
+    context = multiprocessing.get_context("fork")
+    with context.Pool(1) as pool:
+        with WriterLock(temp_file):
+            assert not pool.apply(try_acquire, (temp_file,))
+        assert pool.apply(try_acquire, (temp_file,))
+
+
+def test_lock_without_file():
+    """Without the file, only the threads should be synchronized."""
+    lock = WriterLock()
+    with lock:
+        assert lock.acquire(blocking=False)
+        lock.release()
@@ -0,0 +1,90 @@
+import os
+from random import randrange
+
+from .common import temp_file
+from .test_multiple_value_file import make_unique_int_list
+from ..file_format import MultiValueColumnsDataFile, MultiValue
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_file
+
+
+def test_non_existing_file():
+    """For non existing file, we should get an empty list when reading the values."""
+    data_file = MultiValueColumnsDataFile("akjdhakjdhas", 10)
+    assert [] == list(data_file.read())
+    assert 0 == data_file.records_count()
+    records, counts = data_file.count_yes_choices()
+    assert 0 == records
+    assert [0] * 10 == list(counts)
+
+
+def test_writing_one_value(temp_file):
+    """We should be able to write and read one value, the file should have one stripe."""
+    data_file = MultiValueColumnsDataFile(temp_file, 10)
+    data_file.STRIPE_SIZE = 16
+    value = MultiValue(pk=123, yes_choices=[0, 1, 2, 3], no_choices=[7, 8, 9])
+    data_file.write(value)
+
+    # the expected size is:
+    #   header              [4B]
+    #   pk column           [16 * 4B]
+    #   yes bitmaps         [10 * 16b = 20B]
+    #   no bitmaps          [10 * 16b = 20B]
+    assert 4 + 16 * 4 + 20 + 20 == os.path.getsize(temp_file)
+    assert 1 == data_file.records_count()
+    assert [value] == list(data_file.read())
+
+
+def test_writing_multiple_values(temp_file):
+    """We should be able to write and read values stored in many stripes, and count them."""
+    size = 556
+    data_file = MultiValueColumnsDataFile(temp_file, size)
+    data_file.STRIPE_SIZE = 32
+    data_file.READ_CHUNK_SIZE = 2
+
+    values = [
+        MultiValue(
+            pk=randrange(0, 2 ** 32),
+            yes_choices=make_unique_int_list(0, size, size),
+            no_choices=make_unique_int_list(0, size, size),
+        )
+        for _ in range(0, randrange(100, 200))
+    ]
+    for value in values:
+        data_file.write(value)
+
+    assert len(values) == data_file.records_count()
+    assert values == list(data_file.read())
+
+    expected = [0] * size
+    for value in values:
+        for position in value.yes_choices:
+            expected[position] += 1
+
+    records, counts = data_file.count_yes_choices()
+    assert len(values) == records
+    assert expected == list(counts)
+    assert expected[17] == data_file.count_yes_choice(17)
+
+
+def test_writing_many_values(temp_file):
+    """Writing the values in batches should work across the stripe boundaries."""
+    size = 100
+    data_file = MultiValueColumnsDataFile(temp_file, size)
+    data_file.STRIPE_SIZE = 16
+
+    values = [
+        MultiValue(
+            pk=pk, yes_choices=make_unique_int_list(0, size, size), no_choices=make_unique_int_list(0, size, size),
+        )
+        for pk in range(0, randrange(50, 100))
+    ]
+    data_file.write_many(values[:7])
+    data_file.write_many([])
+    data_file.write_many(values[7:40])
+    data_file.write(values[40])
+    data_file.write_many(values[41:])
+
+    assert len(values) == data_file.records_count()
+    assert values == list(data_file.read())
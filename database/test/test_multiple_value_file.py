@@ -83,3 +83,63 @@ def test_writing_multiple_values(temp_file):
     #   no  [1998b rounded to 2000b = 250B]
     assert (4 + 250 + 250) * len(values) == os.path.getsize(temp_file)
     assert values == list(data_file.read())
+
+
+def test_counting_yes_choices_for_non_existing_file():
+    """For non existing file, there should be no records and zero counts."""
+    data_file = MultiValueDataFile("akjdhakjdhas", 10)
+    records, counts = data_file.count_yes_choices()
+    assert 0 == records
+    assert [0] * 10 == list(counts)
+
+
+def test_counting_yes_choices(temp_file):
+    """The vectorized counts should be the same as the counts calculated from the decoded records."""
+    size = 556
+    data_file = MultiValueDataFile(temp_file, size)
+    # make the chunks small, so the data is counted in many chunks
+    data_file.READ_CHUNK_SIZE = 7
+
+    values = [
+        MultiValue(
+            pk=pk, yes_choices=make_unique_int_list(0, size, size), no_choices=make_unique_int_list(0, size, size),
+        )
+        for pk in range(0, randrange(20, 100))
+    ]
+    for value in values:
+        data_file.write(value)
+
+    expected = [0] * size
+    for value in values:
+        for position in value.yes_choices:
+            expected[position] += 1
+
+    records, counts = data_file.count_yes_choices()
+    assert len(values) == records
+    assert expected == list(counts)
+
+
+def test_writing_many_values(temp_file):
+    """Writing the values in batches should give the same file as writing them one by one."""
+    size = 556
+    values = [
+        MultiValue(
+            pk=pk, yes_choices=make_unique_int_list(0, size, size), no_choices=make_unique_int_list(0, size, size),
+        )
+        for pk in range(0, randrange(20, 100))
+    ]
+
+    data_file = MultiValueDataFile(temp_file, size)
+    data_file.write_many(values[:7])
+    data_file.write_many([])
+    data_file.write_many(values[7:])
+    assert values == list(data_file.read())
+
+    with open(temp_file, "rb") as f:
+        batch_content = f.read()
+    os.remove(temp_file)
+
+    for value in values:
+        data_file.write(value)
+    with open(temp_file, "rb") as f:
+        assert batch_content == f.read()
@@ -0,0 +1,150 @@
+import os
+from random import randrange
+
+import numpy as np
+
+from .common import temp_file
+from .test_multiple_value_file import make_unique_int_list
+from ..file_format import MultiValueRoaringDataFile, MultiValue
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_file
+
+
+def test_non_existing_file():
+    """For non existing file, we should get an empty list when reading the values."""
+    data_file = MultiValueRoaringDataFile("akjdhakjdhas", 10)
+    assert [] == list(data_file.read())
+    assert 0 == data_file.records_count()
+    records, counts = data_file.count_yes_choices()
+    assert 0 == records
+    assert [0] * 10 == list(counts)
+
+
+def test_writing_one_value(temp_file):
+    """We should be able to write and read one value."""
+    data_file = MultiValueRoaringDataFile(temp_file, 10)
+    value = MultiValue(pk=123, yes_choices=[0, 1, 2, 3], no_choices=[7, 8, 9])
+    data_file.write(value)
+
+    # the expected size is:
+    #   chunk header        [8B]
+    #   pk column           [4B]
+    #   directory           [2 * 10 * 9B]
+    #   array containers    [7 * 2B]
+    assert 8 + 4 + 180 + 14 == os.path.getsize(temp_file)
+    assert 1 == data_file.records_count()
+    assert [value] == list(data_file.read())
+
+
+def test_writing_multiple_values(temp_file):
+    """We should be able to write, read, and count multiple values."""
+    size = 556
+    data_file = MultiValueRoaringDataFile(temp_file, size)
+
+    values = [
+        MultiValue(
+            pk=randrange(0, 2 ** 32),
+            yes_choices=make_unique_int_list(0, size, size // 10),
+            no_choices=make_unique_int_list(0, size, size // 10),
+        )
+        for _ in range(0, randrange(20, 50))
+    ]
+    for value in values:
+        data_file.write(value)
+
+    assert len(values) == data_file.records_count()
+    assert values == list(data_file.read())
+
+    expected = [0] * size
+    for value in values:
+        for position in value.yes_choices:
+            expected[position] += 1
+
+    records, counts = data_file.count_yes_choices()
+    assert len(values) == records
+    assert expected == list(counts)
+
+    yes_rows = [row for row, value in enumerate(values) if 17 in value.yes_choices]
+    no_rows = [row for row, value in enumerate(values) if 17 in value.no_choices]
+    assert yes_rows == data_file.bitmap(17).to_array().tolist()
+    assert no_rows == data_file.bitmap(17, yes=False).to_array().tolist()
+
+
+def test_writing_many_values_in_many_chunks(temp_file):
+    """Writing the values in batches should merge them with the last small chunk, up to the full chunk."""
+    size = 20
+    data_file = MultiValueRoaringDataFile(temp_file, size)
+
+    values = [MultiValue(pk=pk, yes_choices=[pk % size], no_choices=[(pk + 1) % size]) for pk in range(0, 70000)]
+    data_file.write_many(values[:7])
+    data_file.write_many([])
+    data_file.write_many(values[7:69000])
+    data_file.write_many(values[69000:])
+
+    assert [65536, 3464, 1000] == [records for _, _, records in data_file._chunk_headers()]
+    assert len(values) == data_file.records_count()
+    assert values == list(data_file.read())
+
+    records, counts = data_file.count_yes_choices()
+    assert len(values) == records
+    assert [3500] * size == list(counts)
+    assert list(range(3, 70000, size)) == data_file.bitmap(3).to_array().tolist()
+
+
+def test_merging_small_chunks(temp_file):
+    """The small chunks should be merged, so there are only a few of them, and a merge should be undone."""
+    size = 10
+    data_file = MultiValueRoaringDataFile(temp_file, size)
+
+    values = [MultiValue(pk=pk, yes_choices=[pk % size], no_choices=[]) for pk in range(0, 5000)]
+    for start in range(0, 4950, 50):
+        end = start + 50
+        data_file.write_many(values[start:end])
+        data_file.sync()
+    # the chunks are like the digits of the binary number of the batches: 99 = 64 + 32 + 2 + 1
+    assert [3200, 1600, 100, 50] == [records for _, _, records in data_file._chunk_headers()]
+    assert values[:4950] == list(data_file.read())
+
+    # the last batch is merged with the small chunks, the truncate restores them
+    data_file.write_many(values[4950:])
+    assert [3200, 1600, 200] == [records for _, _, records in data_file._chunk_headers()]
+    data_file.truncate(4950)
+    assert [3200, 1600, 100, 50] == [records for _, _, records in data_file._chunk_headers()]
+    assert values[:4950] == list(data_file.read())
+
+    data_file.write_many(values[4950:])
+    data_file.sync()
+    assert not os.path.exists(data_file.undo_file_path)
+    assert values == list(data_file.read())
+    assert list(range(3, 5000, size)) == data_file.bitmap(3).to_array().tolist()
+
+
+def test_counting_selected_pks(temp_file):
+    """Only the records with the selected pks should be counted, in the full, partial, and skipped chunks."""
+    size = 20
+    data_file = MultiValueRoaringDataFile(temp_file, size)
+
+    values = [MultiValue(pk=pk, yes_choices=[pk % size, (pk + 1) % size], no_choices=[]) for pk in range(0, 70000)]
+    data_file.write_many(values[:69000])
+    data_file.write_many(values[69000:])
+    assert [65536, 3464, 1000] == [records for _, _, records in data_file._chunk_headers()]
+
+    pks = np.array([3, 70, 65535, 65536, 69999])
+    for pk_range, selected_pks in [
+        ((65000, 69500), None),
+        ((69600, 80000), None),
+        ((0, 80000), None),
+        (None, pks),
+        ((65536, 80000), pks),
+    ]:
+        selected = [value for value in values if selected_pks is None or value.pk in selected_pks]
+        selected = [value for value in selected if pk_range is None or pk_range[0] <= value.pk <= pk_range[1]]
+        expected = [0] * size
+        for value in selected:
+            for position in value.yes_choices:
+                expected[position] += 1
+
+        records, counts = data_file.count_yes_choices(pk_range, selected_pks)
+        assert len(selected) == records
+        assert expected == list(counts)
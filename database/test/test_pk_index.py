@@ -0,0 +1,108 @@
+import numpy as np
+
+from .common import temp_file
+from ..file_format import OffsetIndexDataFile, PkIndexDataFile
+from ..pk_index import OffsetIndex, PkIndex
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_file
+
+
+def test_checking_pks():
+    """The pks from the array and from the set should be found."""
+    index = PkIndex(np.array([1, 5, 2 ** 32 - 1], dtype=np.uint32), [3, 10])
+    assert 5 == len(index)
+    for pk in [1, 3, 5, 10, 2 ** 32 - 1]:
+        assert pk in index
+    for pk in [0, 2, 4, 6, 11, 2 ** 32, -1]:
+        assert pk not in index
+
+
+def test_merging_pks():
+    """The added pks should be merged into the sorted array when there are enough of them."""
+    index = PkIndex(np.zeros(0, dtype=np.uint32))
+    index.MIN_MERGE_SIZE = 4
+
+    index.add_many([7, 3, 5])
+    assert not index.merged
+
+    index.add_many([1])
+    assert index.merged
+    assert [1, 3, 5, 7] == index._pks.tolist()
+
+    index.add_many([4])
+    assert 4 in index
+    assert [1, 3, 4, 5, 7] == index.sorted_pks().tolist()
+
+
+def test_non_existing_index_file():
+    """For non existing file, there should be no pks."""
+    assert PkIndexDataFile("akjdhakjdhas").read_pks(0) is None
+
+
+def test_writing_index_file(temp_file):
+    """The pks should be read only for the same generation of the collection files."""
+    data_file = PkIndexDataFile(temp_file)
+    data_file.write_pks(3, np.array([1, 2, 2 ** 32 - 1], dtype=np.uint32))
+
+    assert [1, 2, 2 ** 32 - 1] == data_file.read_pks(3).tolist()
+    assert data_file.read_pks(4) is None
+
+    data_file.write_pks(4, np.zeros(0, dtype=np.uint32))
+    assert [] == data_file.read_pks(4).tolist()
+
+
+def make_positions(pks: list, positions: list) -> np.ndarray:
+    """Returns the records of the offsets file."""
+    records = np.zeros(len(pks), dtype=OffsetIndexDataFile("").dtype)
+    records["pk"] = pks
+    records["position"] = positions
+    return records
+
+
+def test_finding_positions():
+    """The positions should be found for the pks from the array and from the dictionary, also after merging."""
+    index = OffsetIndex(make_positions([2, 4, 2 ** 32 - 1], [1, 0, 2]), 3)
+    index.MIN_MERGE_SIZE = 3
+
+    index.add_many([9, 1])
+    assert not index.merged
+    assert 5 == index.indexed
+    for pk, position in [(2, 1), (4, 0), (2 ** 32 - 1, 2), (9, 3), (1, 4)]:
+        assert position == index.get(pk)
+    for pk in [0, 3, 5, 10, 2 ** 32, -1]:
+        assert index.get(pk) is None
+
+    index.add_many([3])
+    assert index.merged
+    assert [1, 2, 3, 4, 9, 2 ** 32 - 1] == index.sorted_records()["pk"].tolist()
+    assert [4, 1, 5, 0, 3, 2] == index.sorted_records()["position"].tolist()
+    assert 5 == index.get(3)
+
+
+def test_updating_positions():
+    """A pk stored again should have the position of its last record, also after merging."""
+    index = OffsetIndex(make_positions([2, 4], [1, 0]), 2)
+    index.MIN_MERGE_SIZE = 3
+
+    index.add_many([4, 7])
+    assert 2 == index.get(4)
+    index.add_many([7, 5])
+    assert index.merged
+    assert 6 == index.indexed
+    assert [(2, 1), (4, 2), (5, 5), (7, 4)] == index.sorted_records().tolist()
+
+
+def test_writing_offsets_file(temp_file):
+    """The positions should be read only for the same generation of the collection files."""
+    data_file = OffsetIndexDataFile(temp_file)
+    assert data_file.read_positions(0) is None
+
+    data_file.write_positions(2, 3, make_positions([1, 7], [1, 0]))
+    indexed, positions = data_file.read_positions(2)
+    assert 3 == indexed
+    assert [(1, 1), (7, 0)] == positions.tolist()
+    assert data_file.read_positions(3) is None
+
+    data_file.write_positions(4, 0, make_positions([], []))
+    assert (0, []) == (data_file.read_positions(4)[0], data_file.read_positions(4)[1].tolist())
@@ -0,0 +1,71 @@
+import numpy as np
+
+from .common import temp_file
+from ..file_format import MultiValue, MultiValueDataFile, SampleDataFile, SingleValue, SingleValueDataFile
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_file
+
+
+def test_sample_has_the_smallest_hashes(temp_file):
+    """After each write, the sample should contain the records with the smallest hashes of all the written pks."""
+    sample_file = SampleDataFile(temp_file, SingleValueDataFile(temp_file), 50)
+    assert sample_file.threshold() is None
+
+    written = []
+    for start in [0, 30, 60, 1000, 5000]:
+        values = [SingleValue(pk=pk, value=pk % 3) for pk in range(start, start + 40)]
+        sample_file.write_many(values)
+        # the values already stored are skipped
+        sample_file.write_many(values[:10])
+        written.extend(values)
+
+        records = sample_file.read_records()
+        pks = np.array(sorted({value.pk for value in written}))
+        expected = pks[np.argsort(SampleDataFile.pk_hash(pks), kind="stable")[:50]]
+        assert sorted(expected.tolist()) == sorted(records["pk"].tolist())
+        assert all(value == pk % 3 for pk, value in zip(records["pk"].tolist(), records["value"].tolist()))
+
+    assert int(SampleDataFile.pk_hash(records["pk"]).max()) == sample_file.threshold()
+
+
+def test_counting_and_selecting_in_sample(temp_file):
+    """The records of the sample should be counted and selected like in the records file."""
+    sample_file = SampleDataFile(temp_file, MultiValueDataFile(temp_file, 3), 10)
+    sample_file.write_many(
+        [
+            MultiValue(pk=1, yes_choices=[0, 2], no_choices=[1]),
+            MultiValue(pk=2, yes_choices=[0], no_choices=[]),
+            MultiValue(pk=3, yes_choices=[], no_choices=[0, 2]),
+        ]
+    )
+    records = sample_file.read_records()
+    for expected, pk_range, pks in [
+        ((3, [2, 0, 1]), None, None),
+        ((2, [1, 0, 0]), (2, 5), None),
+        ((1, [1, 0, 1]), None, np.array([1])),
+    ]:
+        records_count, counts = sample_file.count_records(records, 3, pk_range, pks)
+        assert expected == (records_count, counts.tolist())
+    assert [1, 2] == sample_file.select_pks(records, 0).tolist()
+    assert [3] == sample_file.select_pks(records, 0, yes=False).tolist()
+
+    # only the records with the hashes up to the threshold are read
+    threshold = int(SampleDataFile.pk_hash(np.array([2]))[0])
+    expected = [pk for pk in [1, 2, 3] if SampleDataFile.pk_hash(np.array([pk]))[0] <= threshold]
+    assert expected == sample_file.read_records(threshold)["pk"].tolist()
+
+
+def test_removing_from_sample(temp_file):
+    """The removed records should not be in the sample, and the other records should be kept."""
+    sample_file = SampleDataFile(temp_file, SingleValueDataFile(temp_file), 10)
+    sample_file.write_many([SingleValue(pk=pk, value=pk % 2) for pk in range(5)])
+
+    sample_file.remove_many([1, 3, 7])
+    assert [0, 2, 4] == sample_file.read_records()["pk"].tolist()
+    sample_file.remove_many([7])
+    assert [0, 2, 4] == sample_file.read_records()["pk"].tolist()
+
+    # a removed record can be added again, with another value
+    sample_file.write_many([SingleValue(pk=1, value=1)])
+    assert [(0, 0), (2, 0), (4, 0), (1, 1)] == sample_file.read_records().tolist()
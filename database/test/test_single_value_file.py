@@ -49,3 +49,42 @@ def test_writing_multiple_values(temp_file):
 
     assert 6 * len(values) == os.path.getsize(temp_file)
     assert values == list(data_file.read())
+
+
+def test_view_of_non_existing_file():
+    """For non existing file, the view should be empty."""
+    data_file = SingleValueDataFile("akjdhakjdhas")
+    assert 0 == len(data_file.view())
+
+
+def test_view_and_counting_values(temp_file):
+    """The memory-mapped view should contain all the records, and the counts should match them."""
+    data_file = SingleValueDataFile(temp_file)
+    values = [SingleValue(pk=pk, value=randrange(0, 10)) for pk in range(0, randrange(20, 100))]
+    for value in values:
+        data_file.write(value)
+
+    # an incomplete record at the end of the file should be ignored
+    with open(temp_file, "ab") as f:
+        f.write(b"\x00\x01")
+
+    view = data_file.view()
+    assert [v.pk for v in values] == view["pk"].tolist()
+    assert [v.value for v in values] == view["value"].tolist()
+    assert values == list(data_file.read())
+
+    records, counts = data_file.count_values(10)
+    assert len(values) == records
+    assert [sum(1 for v in values if v.value == n) for n in range(0, 10)] == list(counts)
+
+
+def test_writing_many_values(temp_file):
+    """Writing the values in batches should give the same file as writing them one by one."""
+    data_file = SingleValueDataFile(temp_file)
+    values = [SingleValue(randrange(0, 2 ** 32), randrange(0, 2 ** 16)) for _ in range(0, randrange(10, 100))]
+    data_file.write_many(values[:7])
+    data_file.write_many([])
+    data_file.write_many(values[7:])
+
+    assert 6 * len(values) == os.path.getsize(temp_file)
+    assert values == list(data_file.read())
@@ -0,0 +1,190 @@
+import os
+from random import randrange
+
+import numpy as np
+import pytest
+
+from .common import temp_file
+from ..file_format import SingleValuePackedDataFile, SingleValue
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_file
+
+
+def test_non_existing_file():
+    """For non existing file, we should get an empty list when reading the values."""
+    data_file = SingleValuePackedDataFile("akjdhakjdhas", 10)
+    assert [] == list(data_file.read())
+    assert 0 == data_file.records_count()
+
+    records, counts = data_file.count_values(10)
+    assert 0 == records
+    assert [0] * 10 == counts.tolist()
+
+
+def test_value_bits():
+    """The values should be stored with the narrowest width for the number of choices."""
+    assert 1 == SingleValuePackedDataFile.value_bits(1)
+    assert 1 == SingleValuePackedDataFile.value_bits(2)
+    assert 2 == SingleValuePackedDataFile.value_bits(3)
+    assert 9 == SingleValuePackedDataFile.value_bits(271)
+    assert 10 == SingleValuePackedDataFile.value_bits(556)
+
+
+def test_pks_encoding():
+    """The pks should be decoded the same, also for the decreasing and the maximal ones."""
+    pks = np.array([0, 1, 2, 3, 2 ** 32 - 1, 0, 127, 128, 16384, 16383, 2 ** 31, 5], dtype=np.int64)
+    data = SingleValuePackedDataFile._encode_pks(pks)
+    assert pks.tolist() == SingleValuePackedDataFile._decode_pks(np.frombuffer(data, dtype=np.uint8)).tolist()
+
+    # the sequential pks take one byte each
+    assert 100 == len(SingleValuePackedDataFile._encode_pks(np.arange(1, 101)))
+
+
+def test_writing_one_value(temp_file):
+    """We should be able to write and read one value, the file should have good size."""
+    data_file = SingleValuePackedDataFile(temp_file, 271)
+    value = SingleValue(pk=123, value=270)
+    data_file.write(value)
+
+    # header, chunk header, 9 bits of the value, and 2 bytes of the pk
+    assert 8 + 8 + 2 + 2 == os.path.getsize(temp_file)
+    assert [value] == list(data_file.read())
+
+
+def test_writing_many_values(temp_file):
+    """Writing the values in batches should give the same values as writing them one by one."""
+    data_file = SingleValuePackedDataFile(temp_file, 556)
+    values = [SingleValue(randrange(0, 2 ** 32), randrange(0, 556)) for _ in range(0, randrange(10, 100))]
+    data_file.write_many(values[:7])
+    data_file.write_many([])
+    for value in values[7:10]:
+        data_file.write(value)
+    data_file.write_many(values[10:])
+
+    assert values == list(data_file.read())
+    assert len(values) == data_file.records_count()
+
+
+def test_sequential_pks_are_smaller(temp_file):
+    """For sequential pks and 271 choices, a record should take less than half of the rows layout record."""
+    data_file = SingleValuePackedDataFile(temp_file, 271)
+    values = [SingleValue(pk=pk, value=randrange(0, 271)) for pk in range(1000, 11000)]
+    data_file.write_many(values)
+
+    assert os.path.getsize(temp_file) < 6 * len(values) / 2
+    assert values == list(data_file.read())
+
+
+def test_counting_values(temp_file):
+    """The counts should match the values, also for the pk range."""
+    data_file = SingleValuePackedDataFile(temp_file, 10)
+    values = [SingleValue(pk=randrange(0, 1000), value=randrange(0, 10)) for _ in range(0, randrange(50, 200))]
+    data_file.write_many(values[:20])
+    data_file.write_many(values[20:])
+
+    records, counts = data_file.count_values(10)
+    assert len(values) == records
+    assert [sum(1 for v in values if v.value == n) for n in range(0, 10)] == counts.tolist()
+
+    selected = [v for v in values if 100 <= v.pk <= 500]
+    records, counts = data_file.count_values(10, pk_range=(100, 500))
+    assert len(selected) == records
+    assert [sum(1 for v in selected if v.value == n) for n in range(0, 10)] == counts.tolist()
+
+
+def test_truncating_values(temp_file):
+    """Truncating should keep the first records, also in the middle of a chunk, and remove a torn write."""
+    data_file = SingleValuePackedDataFile(temp_file, 10)
+    values = [SingleValue(pk=pk, value=pk % 10) for pk in range(0, 30)]
+    data_file.write_many(values[:10])
+    data_file.write_many(values[10:])
+    data_file.sync()
+    with open(temp_file, "ab") as f:
+        f.write(b"\x00\x00\x00\x05\x00")
+
+    assert values == list(data_file.read())
+
+    data_file.truncate(15)
+    assert values[:15] == list(data_file.read())
+
+    data_file.truncate(10)
+    assert values[:10] == list(data_file.read())
+
+    data_file.sync()
+    data_file.write_many(values[10:12])
+    assert values[:12] == list(data_file.read())
+
+    data_file.truncate(0)
+    assert [] == list(data_file.read())
+    assert 8 == os.path.getsize(temp_file)
+
+
+def test_merging_small_chunks(temp_file):
+    """The small chunks should be merged, so there are only a few of them, and a merge should be undone."""
+    data_file = SingleValuePackedDataFile(temp_file, 10)
+    values = [SingleValue(pk=pk, value=pk % 10) for pk in range(0, 5000)]
+    for start in range(0, 4950, 50):
+        end = start + 50
+        data_file.write_many(values[start:end])
+        data_file.sync()
+    # the chunks are like the digits of the binary number of the batches: 99 = 64 + 32 + 2 + 1
+    assert [3200, 1600, 100, 50] == [records for _, records, _ in data_file._chunk_headers(data_file._open())]
+    assert values[:4950] == list(data_file.read())
+
+    # the last batch is merged with the small chunks, the truncate restores them
+    data_file.write_many(values[4950:])
+    assert [3200, 1600, 200] == [records for _, records, _ in data_file._chunk_headers(data_file._open())]
+    data_file.truncate(4950)
+    assert [3200, 1600, 100, 50] == [records for _, records, _ in data_file._chunk_headers(data_file._open())]
+    assert values[:4950] == list(data_file.read())
+
+    data_file.write_many(values[4950:])
+    data_file.sync()
+    assert not os.path.exists(data_file.undo_file_path)
+    assert values == list(data_file.read())
+    records, counts = data_file.count_values(10)
+    assert 5000 == records
+    assert [500] * 10 == counts.tolist()
+    assert list(range(3, 5000, 10)) == data_file.select_pks(3).tolist()
+
+
+def test_full_chunks(temp_file):
+    """A chunk should not have more than `MAX_CHUNK_RECORDS` records, the full chunks are not merged."""
+    data_file = SingleValuePackedDataFile(temp_file, 10)
+    data_file.MAX_CHUNK_RECORDS = 100
+    values = [SingleValue(pk=pk, value=pk % 10) for pk in range(0, 450)]
+    data_file.write_many(values[:250])
+    for start in range(250, 330, 20):
+        end = start + 20
+        data_file.write_many(values[start:end])
+        data_file.sync()
+    assert [100, 100, 90, 40] == [records for _, records, _ in data_file._chunk_headers(data_file._open())]
+
+    # the merged records are split into the full chunks
+    data_file.write_many(values[330:])
+    assert [100, 100, 100, 100, 50] == [records for _, records, _ in data_file._chunk_headers(data_file._open())]
+    assert values == list(data_file.read())
+
+
+def test_width_from_header(temp_file):
+    """The file should be read with the width from the header, regardless of the current number of choices."""
+    values = [SingleValue(pk=pk, value=pk % 3) for pk in range(0, 10)]
+    SingleValuePackedDataFile(temp_file, 3).write_many(values)
+
+    data_file = SingleValuePackedDataFile(temp_file, 300)
+    assert values == list(data_file.read())
+
+    with pytest.raises(ValueError) as e:
+        data_file.write(SingleValue(pk=11, value=200))
+    assert "doesn't fit in 2 bits" in str(e)
+
+
+def test_reading_file_with_other_format(temp_file):
+    """A file without the header shouldn't be read as the packed file."""
+    with open(temp_file, "wb") as f:
+        f.write(b"\x00" * 12)
+
+    with pytest.raises(ValueError) as e:
+        list(SingleValuePackedDataFile(temp_file, 10).read())
+    assert "is not a packed data file" in str(e)
@@ -0,0 +1,284 @@
+import os
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import pytest
+
+from .common import copy_config, temp_dir
+from ..db import Database
+
+# storage.py needs pymongo
+storage = pytest.importorskip("storage")
+OperationFailure = pytest.importorskip("pymongo.errors").OperationFailure
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_dir
+
+
+class FakeCursor(list):
+    """Cursor returning the found documents."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class ChangesExhausted(Exception):
+    """Raised by the fake change stream after the prepared changes, to stop the watcher."""
+
+
+class FakeChangeStream:
+    """Change stream returning the prepared changes, None stands for an empty batch (nothing changed in time).
+
+    The stream is closed after an invalidate change, like the real one.
+    """
+
+    def __init__(self, changes: List[Optional[dict]]):
+        self.changes = list(changes)
+        self.alive = True
+        self.resume_token = None
+
+    def try_next(self) -> Optional[dict]:
+        if not self.changes:
+            raise ChangesExhausted()
+        change = self.changes.pop(0)
+        if change is not None:
+            self.resume_token = change["_id"]
+            self.alive = change["operationType"] != "invalidate"
+        return change
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.alive = False
+
+
+class FakeCollection:
+    """MongoDB collection with the documents in memory, it records the calls which read or update the documents.
+
+    Only the queries used by storage.py are supported.
+    """
+
+    def __init__(self, documents: List[dict], streams: List[FakeChangeStream] = (), lost_tokens: List[dict] = ()):
+        self.documents = {document["_id"]: {**document, storage.FETCHED_FIELD_NAME: False} for document in documents}
+        self.streams = list(streams)
+        self.lost_tokens = list(lost_tokens)
+        self.find_calls: List[tuple] = []
+        self.updated_ids: List[list] = []
+        self.resume_tokens: List[Optional[dict]] = []
+
+    def find(self, query: dict, projection: dict, sort: list, batch_size: int) -> FakeCursor:
+        self.find_calls.append((query, sort, batch_size))
+        found = [document for _, document in sorted(self.documents.items()) if not document[storage.FETCHED_FIELD_NAME]]
+        return FakeCursor([{k: v for k, v in document.items() if k not in projection} for document in found])
+
+    def update_many(self, query: dict, update: dict) -> SimpleNamespace:
+        ids = query["_id"]["$in"]
+        self.updated_ids.append(ids)
+        updated = [self.documents[_id] for _id in ids if _id in self.documents]
+        for document in updated:
+            document.update(update["$set"])
+        return SimpleNamespace(modified_count=len(updated))
+
+    def watch(self, pipeline: list, resume_after: Optional[dict] = None, max_await_time_ms: int = None):
+        self.resume_tokens.append(resume_after)
+        if resume_after in self.lost_tokens:
+            raise OperationFailure("Resume of change stream was not possible")
+        return self.streams.pop(0)
+
+
+def make_document(pk: int, brand: str = "brand_one") -> dict:
+    """Creates a document with the answer of the `collection_two` of the good_sample_config."""
+    return {"_id": pk, "pk": str(pk), "collection_two": brand}
+
+
+def make_change(token: int, operation: str, document: Optional[dict] = None) -> dict:
+    """Creates a change of the change stream."""
+    change = {"_id": {"_data": str(token)}, "operationType": operation}
+    if document is not None:
+        change["fullDocument"] = document
+    return change
+
+
+def make_session(temp_dir: str, collection: FakeCollection, batch_size: int = 2) -> storage.Session:
+    """Creates the session with the collection and a new database in the directory."""
+    copy_config("good_sample_config", temp_dir)
+    config = storage.Config(
+        db_connection="",
+        db_name="",
+        db_collection="",
+        storage_dir=temp_dir,
+        batch_size=batch_size,
+        compaction_interval=0,
+        compaction_records=0,
+        change_stream=True,
+        max_wait_ms=10,
+        partitions=1,
+        partition=0,
+    )
+    return storage.Session(config=config, collection=collection, storage=Database(temp_dir))
+
+
+def stored_counts(session: storage.Session) -> Dict[str, int]:
+    """Returns the counts of the stored brands."""
+    return {answer.value: answer.count for answer in session.storage.count("collection_two").results}
+
+
+def test_fetching_batches():
+    """The not fetched documents should be read with one cursor, in full batches, in the order of `_id`."""
+    collection = FakeCollection([make_document(pk) for pk in (5, 1, 4, 2, 3)])
+
+    batches = list(storage.fetch_batches(collection, 2))
+
+    assert [[make_document(1), make_document(2)], [make_document(3), make_document(4)]] == batches
+    assert [({storage.FETCHED_FIELD_NAME: False}, [("_id", 1)], 2)] == collection.find_calls
+    assert [[1, 2], [3, 4], [5]] == [
+        [document["_id"] for document in batch] for batch in storage.fetch_batches(collection, 2, partial=True)
+    ]
+
+
+def test_storing_batch(temp_dir):
+    """Only the stored documents should be marked as fetched, with one update, so the next fetch skips them."""
+    collection = FakeCollection([make_document(pk) for pk in range(1, 6)])
+    session = make_session(temp_dir, collection)
+
+    documents = next(storage.fetch_batches(collection, 2))
+    storage.store_batch(session, documents)
+
+    assert [[1, 2]] == collection.updated_ids
+    assert [[3, 4], [5]] == [
+        [document["_id"] for document in batch] for batch in storage.fetch_batches(collection, 2, partial=True)
+    ]
+    assert {"brand_one": 2, "brand_two": 0} == stored_counts(session)
+
+
+def test_storing_batch_again_after_crash(temp_dir):
+    """When the script crashes before the documents are marked, they are stored again, but counted only once."""
+    collection = FakeCollection([make_document(pk) for pk in range(1, 4)])
+    session = make_session(temp_dir, collection)
+    documents = next(storage.fetch_batches(collection, 2))
+
+    def crash(query: dict, update: dict):
+        raise ConnectionError("crashed")
+
+    collection.update_many, update_many = crash, collection.update_many
+    with pytest.raises(ConnectionError):
+        storage.store_batch(session, documents)
+    collection.update_many = update_many
+
+    session = make_session(temp_dir, collection)
+    for documents in storage.fetch_batches(collection, 2, partial=True):
+        storage.store_batch(session, documents)
+
+    assert [[1, 2], [3]] == collection.updated_ids
+    assert {"brand_one": 3, "brand_two": 0} == stored_counts(session)
+
+
+def test_watching_inserted_documents(temp_dir):
+    """The not fetched documents and then the inserted ones should be stored, the token written after each batch."""
+    stream = FakeChangeStream(
+        [
+            make_change(1, "insert", make_document(3)),
+            make_change(2, "insert", make_document(4, "brand_two")),
+            make_change(3, "insert", make_document(5, "brand_two")),
+            None,
+        ]
+    )
+    collection = FakeCollection([make_document(1), make_document(2)], [stream])
+    session = make_session(temp_dir, collection)
+    token_path = os.path.join(temp_dir, storage.RESUME_TOKEN_FILE_NAME)
+
+    with pytest.raises(ChangesExhausted):
+        storage.watch_change_stream(session, token_path)
+
+    assert [None] == collection.resume_tokens
+    assert [[1, 2], [3, 4], [5]] == collection.updated_ids
+    assert {"brand_one": 3, "brand_two": 2} == stored_counts(session)
+    assert {"_data": "3"} == storage.read_resume_token(token_path)
+
+
+def test_resuming_from_stored_token(temp_dir):
+    """The stream should be resumed after the change with the stored token."""
+    stream = FakeChangeStream([make_change(8, "insert", make_document(1)), None])
+    collection = FakeCollection([], [stream])
+    session = make_session(temp_dir, collection)
+    token_path = os.path.join(temp_dir, storage.RESUME_TOKEN_FILE_NAME)
+    storage.write_resume_token(token_path, {"_data": "7"})
+
+    with pytest.raises(ChangesExhausted):
+        storage.watch_change_stream(session, token_path)
+
+    assert [{"_data": "7"}] == collection.resume_tokens
+    assert {"_data": "8"} == storage.read_resume_token(token_path)
+    assert [os.path.basename(token_path)] == [name for name in os.listdir(temp_dir) if name.startswith("resume")]
+
+
+def test_resuming_from_lost_token(temp_dir):
+    """When the stored token is not in the oplog anymore, a new stream should be opened.
+
+    The documents inserted in the meantime are stored by reading the not fetched ones.
+    """
+    stream = FakeChangeStream([make_change(9, "insert", make_document(2)), None])
+    collection = FakeCollection([make_document(1)], [stream], lost_tokens=[{"_data": "7"}])
+    session = make_session(temp_dir, collection)
+    token_path = os.path.join(temp_dir, storage.RESUME_TOKEN_FILE_NAME)
+    storage.write_resume_token(token_path, {"_data": "7"})
+
+    with pytest.raises(ChangesExhausted):
+        storage.watch_change_stream(session, token_path)
+
+    assert [{"_data": "7"}, None] == collection.resume_tokens
+    assert [[1], [2]] == collection.updated_ids
+    assert {"_data": "9"} == storage.read_resume_token(token_path)
+
+
+def test_invalidated_stream(temp_dir):
+    """After an invalidate change, the pending documents should be stored, and the token removed."""
+    stream = FakeChangeStream(
+        [
+            make_change(1, "insert", make_document(1)),
+            None,
+            make_change(2, "insert", make_document(2)),
+            make_change(3, "invalidate"),
+            make_change(4, "insert", make_document(3)),
+        ]
+    )
+    collection = FakeCollection([], [stream])
+    session = make_session(temp_dir, collection)
+    token_path = os.path.join(temp_dir, storage.RESUME_TOKEN_FILE_NAME)
+
+    storage.watch_change_stream(session, token_path)
+
+    assert [[1], [2]] == collection.updated_ids
+    assert {"brand_one": 2, "brand_two": 0} == stored_counts(session)
+    assert not os.path.exists(token_path)
+
+
+def test_replaced_and_inserted_documents(temp_dir):
+    """A replaced document should replace the stored answer, an inserted one with a stored pk should be skipped.
+
+    The other changes (e.g. marking the documents as fetched) should be ignored.
+    """
+    stream = FakeChangeStream(
+        [
+            make_change(1, "insert", make_document(1)),
+            make_change(2, "update"),
+            make_change(3, "insert", make_document(2)),
+            None,
+            make_change(4, "replace", make_document(1, "brand_two")),
+            make_change(5, "insert", make_document(2, "brand_two")),
+            None,
+        ]
+    )
+    collection = FakeCollection([], [stream])
+    session = make_session(temp_dir, collection, batch_size=10)
+    token_path = os.path.join(temp_dir, storage.RESUME_TOKEN_FILE_NAME)
+
+    with pytest.raises(ChangesExhausted):
+        storage.watch_change_stream(session, token_path)
+
+    assert {"brand_one": 1, "brand_two": 1} == stored_counts(session)
+    assert {"_data": "5"} == storage.read_resume_token(token_path)
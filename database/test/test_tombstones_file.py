@@ -0,0 +1,46 @@
+from .common import temp_file
+from ..file_format import MultiValue, MultiValueDataFile, SingleValue, SingleValueDataFile, TombstonesDataFile
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_file
+
+
+def test_non_existing_file():
+    """For non existing file, there should be no removed records."""
+    tombstones_file = TombstonesDataFile("akjdhakjdhas", SingleValueDataFile("akjdhakjdhas"))
+    assert 0 == tombstones_file.records_count()
+    assert [] == tombstones_file.positions().tolist()
+    assert [] == list(tombstones_file.read())
+
+
+def test_writing_and_reading(temp_file):
+    """The removed values should be read with their positions, in the order of writing."""
+    tombstones_file = TombstonesDataFile(temp_file, MultiValueDataFile(temp_file, 3))
+    values = [
+        (7, MultiValue(pk=3, yes_choices=[0, 2], no_choices=[1])),
+        (2, MultiValue(pk=1, yes_choices=[], no_choices=[0])),
+    ]
+    tombstones_file.write_many(values[:1])
+    tombstones_file.write_many(values[1:])
+
+    assert values == list(tombstones_file.read())
+    assert 2 == tombstones_file.records_count()
+    assert [2, 7] == tombstones_file.positions().tolist()
+
+    tombstones_file.truncate(1)
+    assert values[:1] == list(tombstones_file.read())
+
+
+def test_counting_and_selecting_removed_records(temp_file):
+    """The removed records should be counted and selected like in the records file."""
+    tombstones_file = TombstonesDataFile(temp_file, SingleValueDataFile(temp_file))
+    tombstones_file.write_many([(0, SingleValue(pk=4, value=1)), (5, SingleValue(pk=9, value=0))])
+    tombstones_file.write_many([(6, SingleValue(pk=4, value=0))])
+
+    records = tombstones_file.records()
+    records_count, counts = tombstones_file.count_records(records, 2)
+    assert (3, [2, 1]) == (records_count, counts.tolist())
+    records_count, counts = tombstones_file.count_records(records, 2, pk_range=(1, 5))
+    assert (2, [1, 1]) == (records_count, counts.tolist())
+    assert [4, 9] == tombstones_file.select_pks(records, 0).tolist()
+    assert [4] == tombstones_file.select_pks(records, 1).tolist()
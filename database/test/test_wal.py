@@ -0,0 +1,55 @@
+import os
+
+from .common import temp_file
+from ..wal import Operation, WalRecord, WriteAheadLog
+
+# this is a workaround, so the automated tools won't remove the import as unused
+temp_file
+
+
+def test_non_existing_file():
+    """For non existing file, there should be no records."""
+    wal = WriteAheadLog("akjdhakjdhas")
+    assert wal.is_empty()
+    assert [] == wal.read()
+    wal.clear()
+    assert not os.path.exists("akjdhakjdhas")
+
+
+def test_appending_and_clearing(temp_file):
+    """The appended records should be read in the same order, until the log is cleared."""
+    wal = WriteAheadLog(temp_file)
+    records = [
+        WalRecord(records={"one": 1, "two": 2}, answers=[{"pk": "1", "one.a": "yes"}]),
+        WalRecord(records={"one": 2, "two": 3}, answers=[{"pk": "2", "one.a": "no"}, {"pk": "3", "two": "b"}]),
+        WalRecord(records={"one": 3}, answers=[{"pk": "2"}], tombstones={"one": 1}, operation=Operation.DELETE),
+    ]
+    for record in records:
+        wal.append(record)
+
+    assert records == wal.read()
+    assert not wal.is_empty()
+
+    wal.clear()
+    assert wal.is_empty()
+    assert [] == wal.read()
+    assert 0 == os.path.getsize(temp_file)
+
+
+def test_torn_record(temp_file):
+    """A partially written record, or a record with bad checksum, should be ignored."""
+    wal = WriteAheadLog(temp_file)
+    record = WalRecord(records={"one": 1}, answers=[{"pk": "1"}])
+    wal.append(record)
+    size = os.path.getsize(temp_file)
+
+    wal.append(record)
+    with open(temp_file, "r+b") as f:
+        f.truncate(os.path.getsize(temp_file) - 3)
+    assert [record] == wal.read()
+
+    with open(temp_file, "r+b") as f:
+        f.truncate(size)
+        f.seek(size - 2)
+        f.write(b"XX")
+    assert [] == wal.read()
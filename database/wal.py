@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import zlib
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+
+class Operation(Enum):
+    """Operation applied with a batch of answers.
+
+    STORE: the answers are stored, the ones with the pks which are already stored are skipped.
+    UPSERT: the answers are stored, the ones with the pks which are already stored replace the stored ones.
+    DELETE: the answers with the pks are removed, only the `pk` of each answer is used.
+    """
+
+    STORE = "store"
+    UPSERT = "upsert"
+    DELETE = "delete"
+
+
+@dataclass
+class WalRecord:
+    """One batch of answers stored in the write-ahead log.
+
+    Attributes:
+        records: Dictionary [collection_name->number of records] before the batch was applied.
+        answers: Answers from the batch, as dictionaries from parsed json.
+        tombstones: Dictionary [collection_name->number of removed records] before the batch was applied.
+        operation: Operation applied with the batch.
+    """
+
+    records: Dict[str, int]
+    answers: List[dict]
+    tombstones: Dict[str, int] = field(default_factory=dict)
+    operation: Operation = Operation.STORE
+
+
+class WriteAheadLog:
+    """Write-ahead log for the batches of answers.
+
+    Each batch is stored as one record:
+
+        --------------------------------------
+        |   4B   |   4B   |      varies      |
+        | length | crc32  | payload (json)   |
+        --------------------------------------
+
+    The log is synchronized to disk once per batch (group commit), before the batch is applied
+    to the collection files. When all the files are synchronized, the log is cleared.
+
+    A record which is not complete or has a bad checksum is a torn write, it's ignored with all the following data.
+
+    Args:
+        file_path: Path of the log file.
+
+    Attributes:
+        BYTEORDER: Order of the bytes used in the record header.
+        HEADER_SIZE: Size of the record header in bytes.
+        file_path: Path of the log file.
+    """
+
+    BYTEORDER = "big"
+    HEADER_SIZE = 8
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    @staticmethod
+    def encode_answers(answers: List[dict]) -> str:
+        """Encodes the answers of a record, see `append()`.
+
+        The answers are most of the record, so they can be encoded before the writer lock is acquired.
+
+        Args:
+            answers: Answers from the batch, as dictionaries from parsed json.
+
+        Returns:
+            The answers as json.
+        """
+        return json.dumps(answers, default=str)
+
+    def append(self, record: WalRecord, encoded_answers: Optional[str] = None) -> None:
+        """Appends the record to the log and synchronizes it to disk.
+
+        Args:
+            record: Record to append.
+            encoded_answers: The answers of the record encoded with `encode_answers()`, encoded here if not set.
+        """
+        if encoded_answers is None:
+            encoded_answers = self.encode_answers(record.answers)
+        fields = json.dumps(
+            {"records": record.records, "tombstones": record.tombstones, "operation": record.operation.value}
+        )
+        # the answers are added as the last field of the json object
+        payload = f'{fields[:-1]}, "answers": {encoded_answers}}}'.encode()
+        header = len(payload).to_bytes(4, self.BYTEORDER) + zlib.crc32(payload).to_bytes(4, self.BYTEORDER)
+
+        with open(self.file_path, "ab") as f:
+            f.write(header + payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def is_empty(self) -> bool:
+        """Checks if there are no records in the log, without reading it.
+
+        Returns:
+            True for an empty or a missing file.
+        """
+        return not os.path.exists(self.file_path) or os.path.getsize(self.file_path) == 0
+
+    def read(self) -> List[WalRecord]:
+        """Reads all the complete records from the log.
+
+        Returns:
+            List of the records, without the torn ones at the end of the log.
+        """
+        if not os.path.exists(self.file_path):
+            return []
+
+        with open(self.file_path, "rb") as f:
+            data = f.read()
+
+        records = []
+        position = 0
+        while position + self.HEADER_SIZE <= len(data):
+            start = position + self.HEADER_SIZE
+            header = data[position:start]
+            length = int.from_bytes(header[:4], self.BYTEORDER)
+            checksum = int.from_bytes(header[4:], self.BYTEORDER)
+
+            end = start + length
+            payload = data[start:end]
+            if len(payload) != length or zlib.crc32(payload) != checksum:
+                break
+
+            value = json.loads(payload)
+            records.append(
+                WalRecord(
+                    records=value["records"],
+                    answers=value["answers"],
+                    tombstones=value.get("tombstones", {}),
+                    operation=Operation(value.get("operation", Operation.STORE.value)),
+                )
+            )
+            position = end
+
+        if position != len(data):
+            log.warning(f"Ignoring {len(data) - position} bytes of a torn record in {self.file_path}.")
+
+        return records
+
+    def clear(self) -> None:
+        """Removes all the records from the log."""
+        if not os.path.exists(self.file_path):
+            return
+
+        with open(self.file_path, "r+b") as f:
+            f.truncate(0)
+            os.fsync(f.fileno())
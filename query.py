@@ -67,7 +67,7 @@ def run(storage_dir):
     """The main user interface to select the query the stored data.
     """
     config = Config(storage_dir=storage_dir,)
-    session = Session(config=config, storage=Database(config.storage_dir),)
+    session = Session(config=config, storage=Database(config.storage_dir, read_only=True, shared_cache=True),)
 
     while True:
         for index, question in enumerate(questions):
@@ -4,11 +4,17 @@
 """
 
 import logging
+import os
 from dataclasses import dataclass
 from time import sleep
+from typing import Generator, List, Optional
 
 import click
+from bson import json_util
+from pymongo import ASCENDING
+from pymongo.change_stream import ChangeStream
 from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
 
 from common import (
     get_db_collection,
@@ -17,12 +23,22 @@ from common import (
     CONFIG_DEFAULT_MONGODB_DB_NAME,
     CONFIG_DEFAULT_STORAGE_DIR,
     CONFIG_DEFAULT_STORAGE_BATCH_SIZE,
+    CONFIG_DEFAULT_COMPACTION_INTERVAL,
+    CONFIG_DEFAULT_COMPACTION_RECORDS,
+    CONFIG_DEFAULT_MAX_WAIT_MS,
     FETCHED_FIELD_NAME,
 )
+from database.atomic import atomic_write
+from database.compaction import Compactor
 from database.db import Database
 
 log = logging.getLogger(__name__)
 
+RESUME_TOKEN_FILE_NAME = "resume_token.json"
+
+# the operations of the changes stored by the change stream watcher
+CHANGE_OPERATIONS = ("insert", "replace")
+
 
 @dataclass
 class Config:
@@ -33,6 +49,12 @@ class Config:
     db_collection: str
     storage_dir: str
     batch_size: int
+    compaction_interval: int
+    compaction_records: int
+    change_stream: bool
+    max_wait_ms: int
+    partitions: int
+    partition: int
 
 
 @dataclass
@@ -44,39 +66,242 @@ class Session:
     storage: Database
 
 
+def partition_query(config: Config, field: str = "_id") -> dict:
+    """Creates the query selecting the documents fetched by this process.
+
+    Each of the {--partitions} processes fetches the documents with `_id % partitions == partition`,
+    so the processes don't download and store the same documents. The `_id` is the pk, which is a number
+    (usually a sequential one), so the modulo splits the documents evenly, without a hash function,
+    which MongoDB queries don't have.
+
+    Args:
+        config: Command line arguments.
+        field: Name of the `_id` field, e.g. `fullDocument._id` in a change stream.
+
+    Returns:
+        The query, an empty one for a single partition.
+    """
+    if config.partitions == 1:
+        return {}
+    return {"$expr": {"$eq": [{"$mod": [{"$toLong": f"${field}"}, config.partitions]}, config.partition]}}
+
+
+def fetch_batches(
+    collection: Collection, batch_size: int, query: Optional[dict] = None, partial: bool = False
+) -> Generator[List[dict], None, None]:
+    """Yields the batches of the documents which were not fetched yet.
+
+    All the documents are read with one cursor, which gets one batch from the server with each round-trip.
+    The documents are read in the order of `_id`, so marking the fetched ones doesn't move them in the scanned index.
+    Only the full batches are yielded, the rest of the documents is left for the next call.
+
+    Args:
+        collection: MongoDB collection with the documents.
+        batch_size: Number of the documents in a batch.
+        query: If set, only the documents matching also this query are read, see `partition_query()`.
+        partial: If True, then the last batch is yielded also when it's not full.
+
+    Yields:
+        Lists of exactly `batch_size` documents, the last one can be shorter with `partial`.
+    """
+    cursor = collection.find(
+        {FETCHED_FIELD_NAME: False, **(query or {})},
+        projection={FETCHED_FIELD_NAME: False},
+        sort=[("_id", ASCENDING)],
+        batch_size=batch_size,
+    )
+    with cursor:
+        documents = []
+        for document in cursor:
+            documents.append(document)
+            if len(documents) == batch_size:
+                yield documents
+                documents = []
+        if partial and documents:
+            yield documents
+
+
+def store_batch(session: Session, documents: List[dict], upsert: bool = False) -> None:
+    """Stores the documents, and then marks them as fetched with one update.
+
+    The documents are marked only after `Database` synchronized them to disk. When the script crashes
+    in between, the documents are not marked, so they are downloaded again with the next batch. The re-delivery
+    is safe: `Database.store_answers()` skips the answers whose pks are already in the pk index of a collection,
+    and `Database.upsert_answers()` doesn't change anything for the same values. So each document is stored
+    at least once, and it's counted exactly once.
+
+    Args:
+        session: Runtime variables.
+        documents: Documents to store.
+        upsert: If True, then the documents replace the stored answers with the same pks.
+    """
+    if not documents:
+        return
+
+    ids = [document["_id"] for document in documents]
+    log.debug(f"Downloaded documents: {ids}")
+
+    if upsert:
+        session.storage.upsert_answers(documents)
+    else:
+        session.storage.store_answers(documents)
+
+    result = session.collection.update_many({"_id": {"$in": ids}}, {"$set": {FETCHED_FIELD_NAME: True}})
+    log.info(f"Stored {len(documents)} documents, marked {result.modified_count} as fetched")
+
+
 def start_data_watcher(session: Session) -> None:
     """Runs the data watcher.
 
     Downloads the data in batches of exact {--batch-size} number of elements
     and stores it on disk.
 
+    Each batch is marked as fetched with one update, after it's durably stored (see `store_batch()`).
+
     It sleeps for a couple of seconds between the checks unless there is lots of documents to fetch.
     Then it's fetching as fast as possible.
 
     """
 
-    collection = session.collection
-    documents_filter = {FETCHED_FIELD_NAME: False}
+    batch_size = session.config.batch_size
     sleep_time = 10
 
     while True:
-        documents_count = collection.count_documents(documents_filter)
-        log.info(f"found {documents_count} documents for fetching")
+        fetched = 0
+        for documents in fetch_batches(session.collection, batch_size, partition_query(session.config)):
+            store_batch(session, documents)
+            fetched += len(documents)
 
-        if documents_count < session.config.batch_size:
-            log.info(f"going to sleep for {sleep_time} seconds")
+        if fetched == 0:
+            log.info(f"less than {batch_size} documents for fetching, going to sleep for {sleep_time} seconds")
             sleep(sleep_time)
-            continue
 
-        for document in collection.find(documents_filter, limit=session.config.batch_size):
-            log.info(f"Downloaded document: {document['_id']}")
 
-            session.storage.store_answer(document)
+def read_resume_token(file_path: str) -> Optional[dict]:
+    """Reads the resume token of the change stream.
+
+    Args:
+        file_path: Path of the file with the token.
+
+    Returns:
+        The token, None if there is no file.
+    """
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path) as f:
+        return json_util.loads(f.read())
+
+
+def write_resume_token(file_path: str, resume_token: dict) -> None:
+    """Writes the resume token of the change stream, the file is replaced with `atomic_write()`.
+
+    Args:
+        file_path: Path of the file with the token.
+        resume_token: The token.
+    """
+    atomic_write(file_path, json_util.dumps(resume_token).encode())
 
-            collection.update_one({"_id": document["_id"]}, {"$set": {FETCHED_FIELD_NAME: True}})
-            log.info(f"Updated document: {document['_id']}")
 
-        sleep(0.2)
+def open_change_stream(
+    collection: Collection, resume_token: Optional[dict], max_wait_ms: int, query: Optional[dict] = None
+) -> ChangeStream:
+    """Opens the change stream of the inserted and replaced documents, without the `_fetched` field.
+
+    The updates (e.g. marking the documents as fetched) don't have the full documents, so they aren't in the stream.
+
+    Args:
+        collection: MongoDB collection with the documents.
+        resume_token: If set, the stream starts after the change with the token, if it's still in the oplog.
+        max_wait_ms: Maximal time the server waits for a change, before it returns an empty batch.
+        query: If set, only the changes matching also this query are returned, see `partition_query()`.
+
+    Returns:
+        The change stream.
+    """
+    pipeline = [
+        {"$match": {"operationType": {"$in": list(CHANGE_OPERATIONS)}, **(query or {})}},
+        {"$project": {f"fullDocument.{FETCHED_FIELD_NAME}": 0}},
+    ]
+    try:
+        return collection.watch(pipeline, resume_after=resume_token, max_await_time_ms=max_wait_ms)
+    except OperationFailure as e:
+        if resume_token is None:
+            raise
+        # the documents inserted in the meantime are read by the scan of the ones which were not fetched yet
+        log.warning(f"The change stream can't be resumed ({e}), starting a new one.")
+        return collection.watch(pipeline, max_await_time_ms=max_wait_ms)
+
+
+def watch_change_stream(session: Session, token_path: str) -> None:
+    """Stores the documents from one change stream, until the stream is invalidated.
+
+    The stream is opened before the documents which were not fetched yet are read, so a document inserted
+    in the meantime isn't missed (and a document read twice is skipped by the storage). The resume token
+    of the stream is stored in the `token_path` file after each stored batch, so after a restart the stream
+    continues with the next change, while it's still in the oplog.
+
+    A batch is stored when it has {--batch-size} documents, or when no other document was inserted
+    within {--max-wait-ms}. The inserted documents are stored with `Database.store_answers()`,
+    the replaced ones (e.g. by an upsert of an existing document) with `Database.upsert_answers()`.
+
+    The stream is invalidated e.g. when the collection is dropped or renamed. Then its resume token
+    can't be used anymore, so the token file is removed.
+
+    Args:
+        session: Runtime variables.
+        token_path: Path of the file with the resume token.
+    """
+    config = session.config
+    resume_token = read_resume_token(token_path)
+    query = partition_query(config, "fullDocument._id")
+    with open_change_stream(session.collection, resume_token, config.max_wait_ms, query) as stream:
+        for documents in fetch_batches(session.collection, config.batch_size, partition_query(config), partial=True):
+            store_batch(session, documents)
+
+        log.info("waiting for the inserted documents")
+        inserted: List[dict] = []
+        replaced: List[dict] = []
+        while stream.alive:
+            change = stream.try_next()
+            if change is not None:
+                operation = change["operationType"]
+                if operation == "invalidate":
+                    break
+                if operation == "insert":
+                    inserted.append(change["fullDocument"])
+                elif operation == "replace":
+                    replaced.append(change["fullDocument"])
+            if change is None or len(inserted) + len(replaced) >= config.batch_size:
+                if inserted or replaced:
+                    store_batch(session, inserted)
+                    store_batch(session, replaced, upsert=True)
+                    write_resume_token(token_path, stream.resume_token)
+                    inserted, replaced = [], []
+
+        store_batch(session, inserted)
+        store_batch(session, replaced, upsert=True)
+
+    log.warning("The change stream was invalidated.")
+    if os.path.exists(token_path):
+        os.remove(token_path)
+
+
+def start_change_stream_watcher(session: Session) -> None:
+    """Runs the data watcher, which is woken up by the inserted documents, with a MongoDB change stream.
+
+    A document is stored within milliseconds after it's inserted. The server waits for the changes,
+    so there is no polling while nothing is inserted. When the stream is invalidated, a new one is opened,
+    see `watch_change_stream()`.
+
+    """
+    config = session.config
+    token_path = os.path.join(config.storage_dir, RESUME_TOKEN_FILE_NAME)
+    if config.partitions > 1:
+        # each partition has its own stream
+        token_path = f"{token_path}.{config.partition}"
+
+    while True:
+        watch_change_stream(session, token_path)
 
 
 @click.command()
@@ -107,15 +332,68 @@ def start_data_watcher(session: Session) -> None:
     show_default=True,
     help="Size of the batch to download from MongoDB.",
 )
-def run(storage_dir, db_collection, db_name, db_connection, batch_size):
+@click.option(
+    "--compaction-interval",
+    default=CONFIG_DEFAULT_COMPACTION_INTERVAL,
+    show_default=True,
+    help="Number of seconds between the background compactions of the storage files, 0 disables the compaction.",
+)
+@click.option(
+    "--compaction-records",
+    default=CONFIG_DEFAULT_COMPACTION_RECORDS,
+    show_default=True,
+    help="Minimal number of the appended records to compact a collection.",
+)
+@click.option(
+    "--change-stream/--no-change-stream",
+    default=False,
+    show_default=True,
+    help="Wait for the inserted documents with a MongoDB change stream instead of polling, it needs a replica set.",
+)
+@click.option(
+    "--max-wait-ms",
+    default=CONFIG_DEFAULT_MAX_WAIT_MS,
+    show_default=True,
+    help="With --change-stream, milliseconds to wait for more documents before storing a partial batch.",
+)
+@click.option(
+    "--partitions",
+    default=1,
+    show_default=True,
+    help="Number of the storage.py processes, each one fetches only its part of the documents.",
+)
+@click.option(
+    "--partition", default=0, show_default=True, help="Part of the documents fetched by this process (from 0).",
+)
+def run(
+    storage_dir,
+    db_collection,
+    db_name,
+    db_connection,
+    batch_size,
+    compaction_interval,
+    compaction_records,
+    change_stream,
+    max_wait_ms,
+    partitions,
+    partition,
+):
     """A script for loading data from the MongoDB to the storage binary files.
     """
+    if not 0 <= partition < partitions:
+        raise click.BadParameter(f"The partition has to be from 0 to {partitions - 1}.", param_hint="--partition")
     config = Config(
         storage_dir=storage_dir,
         db_collection=db_collection,
         db_connection=db_connection,
         db_name=db_name,
         batch_size=batch_size,
+        compaction_interval=compaction_interval,
+        compaction_records=compaction_records,
+        change_stream=change_stream,
+        max_wait_ms=max_wait_ms,
+        partitions=partitions,
+        partition=partition,
     )
     session = Session(
         config=config,
@@ -125,7 +403,13 @@ def run(storage_dir, db_collection, db_name, db_connection, batch_size):
         storage=Database(config.storage_dir),
     )
 
-    start_data_watcher(session)
+    if config.compaction_interval > 0:
+        Compactor(session.storage, config.compaction_interval, config.compaction_records).start()
+
+    if config.change_stream:
+        start_change_stream_watcher(session)
+    else:
+        start_data_watcher(session)
 
 
 if __name__ == "__main__":